@@ -0,0 +1,84 @@
+import json
+import time
+from typing import List, Sequence
+
+import fire
+import numpy as np
+
+from tale_studio.embedders import EmbeddersStorage, set_embedder_threads
+from tale_studio.model_settings import DEFAULT_EMBEDDER_NAME
+
+QUERY_PREFIX = "query: "
+PASSAGE_PREFIX = "passage: "
+
+
+def load_paragraphs(save_file: str, max_paragraphs: int) -> List[str]:
+    with open(save_file) as r:
+        paragraphs = json.load(r)["paragraphs"]
+    return [p for p in paragraphs if p.strip()][:max_paragraphs]
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def top_k_sets(queries: np.ndarray, passages: np.ndarray, top_k: int):
+    scores = normalize(queries) @ normalize(passages).T
+    np.fill_diagonal(scores, -np.inf)
+    return [set(np.argsort(-row)[:top_k].tolist()) for row in scores]
+
+
+def run_backend(embedder_name: str, paragraphs: List[str], **embedder_kwargs):
+    start_time = time.perf_counter()
+    embedder = EmbeddersStorage.get_embedder(embedder_name, **embedder_kwargs)
+    load_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    passages = embedder.encode([PASSAGE_PREFIX + p for p in paragraphs])
+    queries = embedder.encode([QUERY_PREFIX + p for p in paragraphs])
+    encode_time = time.perf_counter() - start_time
+    throughput = 2 * len(paragraphs) / encode_time
+    return load_time, throughput, np.asarray(queries), np.asarray(passages)
+
+
+def main(
+    save_file: str,
+    model_name: str = DEFAULT_EMBEDDER_NAME,
+    backends: Sequence[str] = ("torch", "int8", "onnx"),
+    device: str = "",
+    num_threads: int = 0,
+    batch_size: int = 32,
+    max_paragraphs: int = 512,
+    top_k: int = 2,
+):
+    if isinstance(backends, str):
+        backends = backends.split(",")
+    paragraphs = load_paragraphs(save_file, max_paragraphs)
+    set_embedder_threads(num_threads)
+    embedder_kwargs = {
+        "device": device,
+        "batch_size": batch_size,
+    }
+
+    reference = None
+    for backend in backends:
+        embedder_name = f"{backend}:{model_name}"
+        load_time, throughput, queries, passages = run_backend(
+            embedder_name, paragraphs, **embedder_kwargs
+        )
+        retrieved = top_k_sets(queries, passages, top_k)
+        if reference is None:
+            reference = retrieved
+        agreement = np.mean(
+            [len(a & b) / len(a | b) for a, b in zip(reference, retrieved)]
+        )
+        print(
+            f"{embedder_name}: load {load_time:.1f} s, "
+            f"{throughput:.1f} texts/s, "
+            f"top-{top_k} agreement with {backends[0]} {agreement:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,49 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fire
+
+from tale_studio.gguf_wrapper import GGUFModels, GGUFBatchEngine
+from tale_studio.model_settings import GenerationParams
+
+DEFAULT_PROMPT = "Write the opening paragraph of a science fiction novel."
+
+
+def run_engine(model, prompt_tokens, n_parallel, n_requests, n_ctx, max_new_tokens):
+    engine = GGUFBatchEngine(model, n_parallel=n_parallel, n_ctx=n_ctx, seed=42)
+    params = GenerationParams(max_new_tokens=max_new_tokens)
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(n_requests) as pool:
+        futures = [
+            pool.submit(lambda: engine.submit(prompt_tokens, params).result())
+            for _ in range(n_requests)
+        ]
+        results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - start_time
+    n_tokens = sum(len(r) for r in results)
+    return n_tokens, elapsed
+
+
+def main(
+    model_name: str,
+    n_requests: int = 8,
+    n_parallel: int = 8,
+    n_ctx: int = 16384,
+    n_gpu_layers: int = 0,
+    max_new_tokens: int = 128,
+    prompt: str = DEFAULT_PROMPT,
+):
+    model = GGUFModels.get_model(model_name, n_gpu_layers=n_gpu_layers, n_ctx=n_ctx)
+    prompt_tokens = model.tokenize(prompt.encode("utf-8"), special=True)
+    for parallel in (1, n_parallel):
+        n_tokens, elapsed = run_engine(
+            model, prompt_tokens, parallel, n_requests, n_ctx, max_new_tokens
+        )
+        print(
+            f"n_parallel={parallel}: {n_requests} requests, {n_tokens} tokens "
+            f"in {elapsed:.1f} s, {n_tokens / elapsed:.1f} tokens/s"
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,65 @@
+import copy
+import json
+import time
+import difflib
+from typing import Sequence
+
+import fire
+
+from tale_studio.state import State
+from tale_studio.human_simulator import Human
+from tale_studio.model_settings import ModelSettings, DEFAULT_MODEL_NAME
+
+
+def plan_match_ratio(plan: str, plans: Sequence[str]) -> float:
+    return max(difflib.SequenceMatcher(a=plan, b=p).ratio() for p in plans)
+
+
+def main(
+    save_file: str,
+    out_file: str = "human_benchmark.jsonl",
+    model_name: str = DEFAULT_MODEL_NAME,
+    prompt_template: str = "openai",
+    n_trials: int = 3,
+    modes: Sequence[str] = ("two_step", "fused"),
+):
+    if isinstance(modes, str):
+        modes = modes.split(",")
+    initial_state = State.load(save_file)
+    assert len(initial_state.paragraphs) >= 2 and initial_state.next_instructions
+    model_settings = ModelSettings(model_name=model_name, prompt_template=prompt_template)
+    writer_paragraph = initial_state.paragraphs[-1]
+
+    with open(out_file, "w") as w:
+        for mode in modes:
+            human = Human(model_settings, fused=(mode == "fused"))
+            timings, length_ratios, match_ratios = [], [], []
+            for trial in range(n_trials):
+                state = copy.deepcopy(initial_state)
+                start_time = time.perf_counter()
+                state = human.step(state)
+                timings.append(time.perf_counter() - start_time)
+
+                extended_paragraph = state.paragraphs[-1]
+                length_ratios.append(len(extended_paragraph) / len(writer_paragraph))
+                match_ratios.append(
+                    plan_match_ratio(state.instruction, initial_state.next_instructions)
+                )
+                record = {
+                    "mode": mode,
+                    "trial": trial,
+                    "time": timings[-1],
+                    "extended_paragraph": extended_paragraph,
+                    "revised_plan": state.instruction,
+                }
+                w.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+            print(
+                f"{mode}: {sum(timings) / n_trials:.1f} s per step, "
+                f"extension ratio {sum(length_ratios) / n_trials:.2f}, "
+                f"revised plan similarity {sum(match_ratios) / n_trials:.2f}"
+            )
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
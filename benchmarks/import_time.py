@@ -0,0 +1,70 @@
+import sys
+import subprocess
+from typing import Dict, Sequence
+
+import fire
+
+from tale_studio.files import ROOT_DIR_PATH
+
+HEAVY_MODULES = (
+    "torch",
+    "sentence_transformers",
+    "llama_cpp",
+    "openai",
+    "anthropic",
+    "tiktoken",
+    "nltk",
+    "requests",
+)
+DEFAULT_MODULES = (
+    "tale_studio.utils",
+    "tale_studio.recurrentgpt",
+    "tale_studio.human_simulator",
+    "tale_studio.summarize_book",
+)
+
+
+def measure_import_time(module: str) -> Dict[str, int]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=str(ROOT_DIR_PATH),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to import {module}:\n{result.stderr}")
+
+    timings = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = int(cumulative.strip())
+    return timings
+
+
+def main(
+    modules: Sequence[str] = DEFAULT_MODULES,
+    budget_ms: float = 500.0,
+):
+    if isinstance(modules, str):
+        modules = modules.split(",")
+
+    failed = False
+    for module in modules:
+        timings = measure_import_time(module)
+        total_ms = timings[module] / 1000.0
+        heavy = [m for m in HEAVY_MODULES if m in timings]
+        status = "OK"
+        if total_ms > budget_ms or heavy:
+            status = "FAIL"
+            failed = True
+        print(f"{module}: {total_ms:.1f} ms (budget {budget_ms:.1f} ms) {status}")
+        if heavy:
+            print(f"    eagerly imported: {', '.join(heavy)}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,79 @@
+import time
+
+import fire
+import numpy as np
+
+from tale_studio.retrieval import build_memory_index, cosine_scores, top_k_indices
+
+
+def numpy_top_k(queries: np.ndarray, memory_index: np.ndarray, top_k: int):
+    return [top_k_indices(cosine_scores(q, memory_index), top_k) for q in queries]
+
+
+def reference_top_k(queries: np.ndarray, embeddings: np.ndarray, top_k: int):
+    return [top_k_indices(cosine_scores(q, embeddings), top_k) for q in queries]
+
+
+def report_parity(name, results, reference, top_k):
+    same_top1 = sum(r[0] == t[0] for r, t in zip(results, reference))
+    overlap = sum(len(set(r) & set(t)) for r, t in zip(results, reference))
+    print(
+        f"{name}: top-1 agreement {same_top1 / len(reference):.1%}, "
+        f"top-{top_k} overlap {overlap / (len(reference) * top_k):.1%}"
+    )
+
+
+def torch_top_k(queries: np.ndarray, embeddings: np.ndarray, top_k: int):
+    import torch
+
+    passages = torch.nn.functional.normalize(torch.tensor(embeddings), p=2, dim=1)
+    results = []
+    for q in queries:
+        query = torch.nn.functional.normalize(torch.tensor(q).unsqueeze(0), p=2, dim=1)
+        scores = torch.mm(query, passages.transpose(0, 1))[0]
+        results.append(torch.topk(scores, k=top_k)[1].tolist())
+    return results
+
+
+def timed(fn, *args, repeats: int = 3):
+    best_time, result = None, None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start_time
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    return result, best_time
+
+
+def main(
+    n_paragraphs: int = 10000,
+    dim: int = 768,
+    n_queries: int = 100,
+    top_k: int = 2,
+    seed: int = 42,
+):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n_paragraphs, dim)).astype(np.float32)
+    queries = embeddings[rng.choice(n_paragraphs, n_queries, replace=False)]
+    queries = queries + 0.5 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    memory_index = build_memory_index(embeddings)
+    print(f"Index: float32 {embeddings.nbytes / 2 ** 20:.1f} MB, float16 {memory_index.nbytes / 2 ** 20:.1f} MB")
+
+    numpy_results, numpy_time = timed(numpy_top_k, queries, memory_index, top_k)
+    print(f"numpy float16: {numpy_time / n_queries * 1000:.3f} ms per query")
+    reference_results, reference_time = timed(reference_top_k, queries, embeddings, top_k)
+    print(f"numpy float32: {reference_time / n_queries * 1000:.3f} ms per query")
+    report_parity("float16 vs float32", numpy_results, reference_results, top_k)
+
+    try:
+        torch_results, torch_time = timed(torch_top_k, queries, embeddings, top_k)
+    except ImportError:
+        print("torch is not installed, skipping the torch parity check")
+        return
+    print(f"torch: {torch_time / n_queries * 1000:.3f} ms per query")
+    report_parity("float16 vs torch", numpy_results, torch_results, top_k)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,52 @@
+import copy
+import time
+import random
+from typing import Sequence
+
+import fire
+
+from tale_studio.state import State
+from tale_studio.recurrentgpt import RecurrentGPT
+from tale_studio.model_settings import ModelSettings, DEFAULT_MODEL_NAME
+
+
+def run_steps(state: State, model_settings: ModelSettings, n_steps: int, seed: int):
+    random.seed(seed)
+    writer = RecurrentGPT(model_settings)
+    timings = []
+    for _ in range(n_steps):
+        state.instruction = random.choice(state.next_instructions)
+        start_time = time.perf_counter()
+        state = writer.step(state)
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+
+def main(
+    save_file: str,
+    model_name: str = DEFAULT_MODEL_NAME,
+    prompt_template: str = "openai",
+    n_steps: int = 3,
+    modes: Sequence[str] = ("sequential", "pipelined"),
+    seed: int = 42,
+):
+    if isinstance(modes, str):
+        modes = modes.split(",")
+    initial_state = State.load(save_file)
+    assert initial_state.next_instructions, "The save should have next instructions"
+
+    for mode in modes:
+        model_settings = ModelSettings(
+            model_name=model_name,
+            prompt_template=prompt_template,
+            pipelined_step=(mode == "pipelined"),
+        )
+        timings = run_steps(
+            copy.deepcopy(initial_state), model_settings, n_steps, seed
+        )
+        mean_time = sum(timings) / len(timings)
+        print(f"{mode}: {mean_time:.1f} s per step over {len(timings)} steps")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -1,4 +1,3 @@
-import json
 import random
 import os
 import gradio as gr
@@ -7,31 +6,56 @@ import fire
 
 from tale_studio.state import State
 from tale_studio.recurrentgpt import RecurrentGPT
-from tale_studio.embedders import EMBEDDER_LIST
+from tale_studio.embedders import EMBEDDER_LIST, set_embedder_threads
+from tale_studio.retrieval import RETRIEVAL_MODES
 from tale_studio.utils import (
     anthropic_list_models,
     openai_list_models,
     openai_get_key,
     anthropic_get_key
 )
+from tale_studio.local_server_wrapper import (
+    local_list_models,
+    LOCAL_API_LIST,
+    BALANCING_STRATEGIES,
+)
 from tale_studio.human_simulator import Human
-from tale_studio.files import LOCAL_MODELS_LIST, SAVES_DIR_PATH
+from tale_studio.files import LOCAL_MODELS_LIST, SAVES_DIR_PATH, AUTOSAVES_DIR_PATH
 from tale_studio.prompt_templates import (
     PROMPT_TEMPLATE_LIST,
     PROMPT_TEMPLATES,
     DEFAULT_PROMPT_TEMPLATE_NAME,
 )
-from tale_studio.model_settings import ModelSettings
-
+from tale_studio.model_settings import ModelSettings, DEFAULT_MODEL_NAME
+from tale_studio.paragraph_view import (
+    get_page_count,
+    snapshot_page,
+    apply_page_edit,
+    StalePageError,
+    PARAGRAPH_SEPARATOR,
+)
+from tale_studio.sessions import SESSIONS
+from tale_studio.saves_catalog import SAVES_CATALOG
+from tale_studio.autosave import AUTOSAVE
+from tale_studio.usage import USAGE
+from tale_studio.single_flight import format_load_stats
+from tale_studio.hedging import HEDGING
+from tale_studio.scheduler import (
+    SCHEDULER,
+    request_context,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    PRIORITY_LOW,
+)
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", None)
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", None)
 
 MODEL_LIST = list(LOCAL_MODELS_LIST)
-if ANTHROPIC_API_KEY:
-    MODEL_LIST.extend(anthropic_list_models())
-if OPENAI_API_KEY:
-    MODEL_LIST.extend(openai_list_models(OPENAI_API_KEY))
+if DEFAULT_MODEL_NAME not in MODEL_LIST:
+    MODEL_LIST.append(DEFAULT_MODEL_NAME)
+
+CONCURRENCY_LIMIT = 32
+SAVES_PAGE_SIZE = 50
+DEFAULT_MODEL_SETTINGS = ModelSettings()
 
 DEFAULT_NOVEL_TYPE = "Science Fiction"
 DEFAULT_DESCRIPTION = (
@@ -39,52 +63,82 @@ DEFAULT_DESCRIPTION = (
 )
 
 
-def validate_inputs(model_state):
-    openai_key = openai_get_key(model_state)
+def get_session(request: gr.Request):
+    return SESSIONS.get(request.session_hash)
+
+
+def mark_dirty(request: gr.Request):
+    AUTOSAVE.mark_dirty(request.session_hash, get_session(request).state)
+
+
+def validate_inputs(model_settings):
+    openai_key = openai_get_key(model_settings)
     if (
-        model_state.prompt_template == "openai"
-        and model_state.model_name not in openai_list_models(api_key=openai_key)
+        model_settings.prompt_template == "openai"
+        and model_settings.model_name not in openai_list_models(api_key=openai_key)
     ):
         raise gr.Error("Please set the correct prompt template!")
 
-    anthropic_key = anthropic_get_key(model_state)
     if (
-        model_state.prompt_template == "anthropic"
-        and model_state.model_name not in anthropic_list_models(api_key=anthropic_key)
+        model_settings.prompt_template == "anthropic"
+        and model_settings.model_name not in anthropic_list_models()
     ):
         raise gr.Error("Please set the correct prompt template!")
 
 
-def generate_meta(novel_type, description, model_state):
-    validate_inputs(model_state)
-    writer = RecurrentGPT(model_state)
-    state = writer.generate_meta(novel_type=novel_type, description=description)
-    return (state, state.name, state.language, state.synopsis, state.outline)
+def show_page(session, page):
+    session.page_snapshot = snapshot_page(session.state.paragraphs, page)
+    return PARAGRAPH_SEPARATOR.join(session.page_snapshot.paragraphs)
+
+
+def show_last_page(session):
+    page_count = get_page_count(len(session.state.paragraphs))
+    text = show_page(session, page_count)
+    return text, gr.update(value=page_count, maximum=page_count)
+
+
+def generate_meta(novel_type, description, request: gr.Request):
+    session = get_session(request)
+    validate_inputs(session.model_settings)
+    writer = RecurrentGPT(session.model_settings)
+    with request_context(request.session_hash, PRIORITY_NORMAL):
+        state = writer.generate_meta(novel_type=novel_type, description=description)
+        session.state = state
+        session.reset_tree()
+    return (state.name, state.language, state.synopsis, state.outline)
+
+
+def show_tree(session):
+    tree = session.get_tree()
+    return gr.update(choices=tree.list_choices(), value=tree.current_id)
 
 
-def generate_first_step(state, model_state):
-    assert state is not None
-    validate_inputs(model_state)
-    writer = RecurrentGPT(model_state)
-    state = writer.generate_first_step(state)
+def generate_first_step(request: gr.Request):
+    session = get_session(request)
+    validate_inputs(session.model_settings)
+    writer = RecurrentGPT(session.model_settings)
+    with request_context(request.session_hash, PRIORITY_NORMAL):
+        state = writer.generate_first_step(session.state)
+        session.reset_tree()
+    mark_dirty(request)
     return (
-        state,
         state.short_memory,
-        "\n\n".join(state.paragraphs),
+        *show_last_page(session),
         state.next_instructions[0],
         state.next_instructions[1],
         state.next_instructions[2],
+        show_tree(session),
     )
 
 
-def generate_instructions(state, model_state):
-    assert state is not None
-    validate_inputs(model_state)
-    writer = RecurrentGPT(model_state)
-    state = writer.generate_instructions(state)
-    state.instruction = random.choice(state.next_instructions)
+def generate_instructions(request: gr.Request):
+    session = get_session(request)
+    validate_inputs(session.model_settings)
+    writer = RecurrentGPT(session.model_settings)
+    with request_context(request.session_hash, PRIORITY_HIGH):
+        state = writer.generate_instructions(session.state)
+        state.instruction = random.choice(state.next_instructions)
     return (
-        state,
         state.next_instructions[0],
         state.next_instructions[1],
         state.next_instructions[2],
@@ -92,65 +146,111 @@ def generate_instructions(state, model_state):
     )
 
 
-def step(state, model_state, selection_mode):
-    assert state is not None
-    validate_inputs(model_state)
-    writer = RecurrentGPT(model_state)
+def step(selection_mode, request: gr.Request):
+    session = get_session(request)
+    validate_inputs(session.model_settings)
+    writer = RecurrentGPT(session.model_settings)
 
-    if selection_mode == "gpt":
-        human = Human(model_state)
-        state = human.step(state)
-    elif selection_mode == "random":
-        state.instruction = random.choice(state.next_instructions)
-    else:
-        assert instruction
+    with request_context(request.session_hash, PRIORITY_LOW):
+        state = session.state
+        parent_id = session.get_tree().current_id
+        if selection_mode in ("gpt", "gpt_fused"):
+            human = Human(session.model_settings, fused=selection_mode == "gpt_fused")
+            state = human.step(state)
+        elif selection_mode == "random":
+            state.instruction = random.choice(state.next_instructions)
+        else:
+            assert state.instruction
 
-    state = writer.step(state)
+        state = writer.step(state)
+        session.get_tree().commit(state, label=state.instruction, parent_id=parent_id)
+        session.state = state
+    mark_dirty(request)
 
     return (
-        state,
         state.short_memory,
-        "\n\n".join(state.paragraphs),
+        *show_last_page(session),
         state.next_instructions[0],
         state.next_instructions[1],
         state.next_instructions[2],
         "",
+        show_tree(session),
     )
 
 
-def save(
-    file_name,
-    root_dir,
-    state,
-):
-    if not file_name:
-        raise gr.Error("File name should not be empty")
-    if not name:
-        raise gr.Error("Please set a name of the story")
+def save(file_name, root_dir, request: gr.Request):
+    with SCHEDULER.session_lock(request.session_hash):
+        state = get_session(request).state
+        if not file_name:
+            raise gr.Error("File name should not be empty")
+        if not state.name:
+            raise gr.Error("Please set a name of the story")
 
-    with open(os.path.join(root_dir, file_name), "w") as w:
-        json.dump(state.to_dict(), w, ensure_ascii=False, indent=4)
+        state.save(os.path.join(root_dir, file_name), indent=4)
+        if os.path.samefile(root_dir, SAVES_DIR_PATH):
+            SAVES_CATALOG.update(file_name, state)
 
 
-def load(file_name):
-    with open(file_name) as r:
-        state = State.from_dict(json.load(r))
+def show_state(session):
+    state = session.state
     return (
-        state,
         state.name,
         state.synopsis,
         state.outline,
         state.short_memory,
-        "\n\n".join(state.paragraphs),
+        *show_last_page(session),
         state.next_instructions[0] if state.next_instructions else "",
         state.next_instructions[1] if state.next_instructions else "",
         state.next_instructions[2] if state.next_instructions else "",
+        show_tree(session),
     )
 
 
-def load_from_saves(file_name):
-    full_path = os.path.join(SAVES_DIR_PATH, file_name)
-    return load(full_path)
+def load(file_name, request: gr.Request):
+    session = get_session(request)
+    with SCHEDULER.session_lock(request.session_hash):
+        session.state = State.load(file_name)
+        session.reset_tree()
+        return show_state(session)
+
+
+def switch_node(node_id, request: gr.Request):
+    session = get_session(request)
+    if node_id is None:
+        raise gr.Error("Please select a story node")
+    with SCHEDULER.session_lock(request.session_hash):
+        session.state = session.get_tree().checkout(int(node_id), previous=session.state)
+        mark_dirty(request)
+        return show_state(session)
+
+
+def undo_step(request: gr.Request):
+    session = get_session(request)
+    with SCHEDULER.session_lock(request.session_hash):
+        session.state = session.get_tree().undo(previous=session.state)
+        mark_dirty(request)
+        return show_state(session)
+
+
+def prune_node(node_id, request: gr.Request):
+    session = get_session(request)
+    if node_id is None:
+        raise gr.Error("Please select a story node")
+    with SCHEDULER.session_lock(request.session_hash):
+        try:
+            state = session.get_tree().prune(int(node_id), previous=session.state)
+        except ValueError as e:
+            raise gr.Error(str(e))
+        if state is not None:
+            session.state = state
+            mark_dirty(request)
+        return show_state(session)
+
+
+def load_from_saves(file_name, from_autosaves, request: gr.Request):
+    saves_dir = AUTOSAVES_DIR_PATH if from_autosaves else SAVES_DIR_PATH
+    full_path = os.path.join(saves_dir, file_name)
+    return load(full_path, request)
 
 
 css = """
@@ -160,8 +260,6 @@ footer {
 """
 
 with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
-    state = gr.State(State())
-    model_state = gr.State(ModelSettings())
     gr.Markdown("# Tale Studio")
     with gr.Tab("Main"):
         with gr.Row():
@@ -219,6 +317,18 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
                 paragraphs = gr.Textbox(
                     label="Written Paragraphs (editable)", max_lines=20, lines=20
                 )
+            with gr.Row():
+                btn_prev_page = gr.Button("◀", variant="secondary", min_width=50)
+                paragraphs_page = gr.Number(
+                    value=1,
+                    minimum=1,
+                    maximum=1,
+                    precision=0,
+                    label="Page",
+                    show_label=False,
+                    container=False,
+                )
+                btn_next_page = gr.Button("▶", variant="secondary", min_width=50)
             with gr.Row():
                 short_memory = gr.Textbox(
                     label="Short-Term Memory (editable)", max_lines=5, lines=5
@@ -244,6 +354,7 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
                     selection_mode = gr.Radio(
                         [
                             ("Select with GPT", "gpt"),
+                            ("Select with GPT (single call)", "gpt_fused"),
                             ("Select randomly", "random"),
                             ("Select manually", "manual"),
                         ],
@@ -264,13 +375,28 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
 
         with gr.Row():
             btn_step = gr.Button("Next Step", variant="primary")
+        with gr.Accordion("Story tree", open=False):
+            story_node = gr.Dropdown(
+                label="Story node",
+                choices=[],
+                value=None,
+                info="Every step is a node, branches share the paragraphs of their ancestors",
+            )
+            with gr.Row():
+                btn_switch_node = gr.Button("Switch", variant="primary")
+                btn_undo_step = gr.Button("Undo", variant="secondary")
+                btn_prune_node = gr.Button("Prune branch", variant="stop")
         with gr.Row() as save_load_buttons:
             btn_save = gr.Button("Save", variant="primary")
             btn_load = gr.Button("Load", variant="primary")
             btn_upload = gr.UploadButton("Upload", variant="primary")
 
         with gr.Group(visible=False) as file_saver:
-            save_filename = gr.Textbox(lines=1, label="File name")
+            save_filename = gr.Textbox(
+                lines=1,
+                label="File name",
+                info="Use the .tale extension for a compact binary save, .json otherwise",
+            )
             save_root = gr.Textbox(
                 lines=1,
                 label="File folder",
@@ -283,6 +409,12 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
                 btn_close_save = gr.Button("Close", variant="secondary")
 
         with gr.Group(visible=False) as file_loader:
+            with gr.Row():
+                load_query = gr.Textbox(
+                    lines=1, label="Search", placeholder="Name, file name or text"
+                )
+                load_page = gr.Number(value=1, minimum=1, precision=0, label="Page")
+                load_autosaves = gr.Checkbox(value=False, label="Autosaves")
             load_filename = gr.Dropdown(label="File name", choices=[], value=None)
             with gr.Row():
                 btn_confirm_load = gr.Button("Confirm", variant="primary")
@@ -294,17 +426,162 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
                 with gr.Column(scale=1, min_width=200):
                     model_name = gr.Dropdown(
                         MODEL_LIST,
-                        value=model_state.value.model_name,
+                        value=DEFAULT_MODEL_SETTINGS.model_name,
                         multiselect=False,
                         label="Model name",
                     )
                 with gr.Column(scale=1, min_width=200):
                     embedder_name = gr.Dropdown(
                         EMBEDDER_LIST,
-                        value=model_state.value.embedder_name,
+                        value=DEFAULT_MODEL_SETTINGS.embedder_name,
                         multiselect=False,
                         label="Embedder name",
                     )
+            with gr.Row():
+                with gr.Column(scale=1, min_width=200):
+                    embedder_device = gr.Textbox(
+                        label="Embedder device",
+                        value=DEFAULT_MODEL_SETTINGS.embedder_device,
+                        info="Empty for auto, 'cpu', 'cuda'",
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    embedder_batch_size = gr.Number(
+                        label="Embedder batch size",
+                        value=DEFAULT_MODEL_SETTINGS.embedder_batch_size,
+                        precision=0,
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    embedder_service_url = gr.Textbox(
+                        label="Embedding service URL",
+                        value=DEFAULT_MODEL_SETTINGS.embedder_service_url,
+                        info="Empty to load locally, http://host:port or unix:///path.sock",
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    n_parallel = gr.Number(
+                        label="Parallel sequences (GGUF)",
+                        value=DEFAULT_MODEL_SETTINGS.n_parallel,
+                        precision=0,
+                        info="Batch concurrent requests to a local model",
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    api_context_size = gr.Number(
+                        label="API context size",
+                        value=DEFAULT_MODEL_SETTINGS.api_context_size,
+                        precision=0,
+                        info="0 to look it up by model name",
+                    )
+            with gr.Row():
+                with gr.Column(scale=1, min_width=200):
+                    retrieval_mode = gr.Dropdown(
+                        RETRIEVAL_MODES,
+                        value=DEFAULT_MODEL_SETTINGS.retrieval_mode,
+                        label="Long memory retrieval",
+                        info="bm25 does not load the embedder, hybrid fuses bm25 and embeddings",
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    l1_segment_size = gr.Number(
+                        label="Paragraphs per segment summary",
+                        value=DEFAULT_MODEL_SETTINGS.l1_segment_size,
+                        precision=0,
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    l2_group_size = gr.Number(
+                        label="Segments per chapter summary",
+                        value=DEFAULT_MODEL_SETTINGS.l2_group_size,
+                        precision=0,
+                    )
+            with gr.Row():
+                pipelined_step = gr.Checkbox(
+                    label="Pipelined step",
+                    value=DEFAULT_MODEL_SETTINGS.pipelined_step,
+                    info="Summarize and generate instructions concurrently",
+                )
+                reconcile_instructions = gr.Checkbox(
+                    label="Reconcile instructions",
+                    value=DEFAULT_MODEL_SETTINGS.reconcile_instructions,
+                    info="Regenerate instructions with the updated memory",
+                )
+        with gr.Group():
+            with gr.Row():
+                with gr.Column(scale=2, min_width=200):
+                    local_base_urls = gr.Textbox(
+                        label="Local server URLs",
+                        value=DEFAULT_MODEL_SETTINGS.local_base_urls,
+                        info="Comma-separated OpenAI-compatible base URLs, e.g. http://127.0.0.1:8001/v1",
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    local_api = gr.Dropdown(
+                        LOCAL_API_LIST,
+                        value=DEFAULT_MODEL_SETTINGS.local_api,
+                        label="Local server API",
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    local_balancing = gr.Dropdown(
+                        BALANCING_STRATEGIES,
+                        value=DEFAULT_MODEL_SETTINGS.local_balancing,
+                        label="Load balancing",
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    local_max_concurrency = gr.Number(
+                        label="Requests per server",
+                        value=DEFAULT_MODEL_SETTINGS.local_max_concurrency,
+                        precision=0,
+                    )
+            with gr.Row():
+                with gr.Column(scale=2, min_width=200):
+                    tgi_url = gr.Textbox(
+                        label="TGI URL",
+                        value=DEFAULT_MODEL_SETTINGS.tgi_url,
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    seed = gr.Number(
+                        label="Seed",
+                        value=DEFAULT_MODEL_SETTINGS.seed,
+                        precision=0,
+                        info="-1 for random",
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    local_stream = gr.Checkbox(
+                        label="Stream from local servers",
+                        value=DEFAULT_MODEL_SETTINGS.local_stream,
+                    )
+        with gr.Group():
+            with gr.Row():
+                with gr.Column(scale=2, min_width=200):
+                    hedge_model_name = gr.Textbox(
+                        label="Hedge model",
+                        value=DEFAULT_MODEL_SETTINGS.hedge_model_name,
+                        info="Secondary model for slow or failed requests (API, local: or GGUF), empty to disable",
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    hedge_prompt_template = gr.Dropdown(
+                        [""] + PROMPT_TEMPLATE_LIST,
+                        value=DEFAULT_MODEL_SETTINGS.hedge_prompt_template,
+                        label="Hedge prompt template",
+                        info="Empty for the main template",
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    hedge_percentile = gr.Number(
+                        label="Hedge after latency percentile",
+                        value=DEFAULT_MODEL_SETTINGS.hedge_percentile,
+                        minimum=1,
+                        maximum=100,
+                        info="Per prompt, over recent requests",
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    hedge_delay = gr.Number(
+                        label="Initial hedge delay, s",
+                        value=DEFAULT_MODEL_SETTINGS.hedge_delay,
+                        info="Used until enough latencies are recorded",
+                    )
+                with gr.Column(scale=1, min_width=200):
+                    hedge_max_share = gr.Number(
+                        label="Max share of hedged requests",
+                        value=DEFAULT_MODEL_SETTINGS.hedge_max_share,
+                        minimum=0,
+                        maximum=1,
+                        info="Cap on extra spend",
+                    )
         with gr.Group():
             with gr.Row():
                 with gr.Column(scale=1, min_width=200):
@@ -339,7 +616,7 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
                     temperature = gr.Slider(
                         minimum=0.01,
                         maximum=1.50,
-                        value=model_state.value.generation_params.temperature,
+                        value=DEFAULT_MODEL_SETTINGS.generation_params.temperature,
                         step=0.01,
                         interactive=True,
                         label="Temperature",
@@ -347,7 +624,7 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
                     repetition_penalty = gr.Slider(
                         minimum=0.1,
                         maximum=1.5,
-                        value=model_state.value.generation_params.repetition_penalty,
+                        value=DEFAULT_MODEL_SETTINGS.generation_params.repetition_penalty,
                         step=0.05,
                         interactive=True,
                         label="Repetition penalty",
@@ -356,7 +633,7 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
                     top_p = gr.Slider(
                         minimum=0.01,
                         maximum=1.0,
-                        value=model_state.value.generation_params.top_p,
+                        value=DEFAULT_MODEL_SETTINGS.generation_params.top_p,
                         step=0.05,
                         interactive=True,
                         label="Top-p",
@@ -364,22 +641,51 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
                     top_k = gr.Slider(
                         minimum=10,
                         maximum=100,
-                        value=model_state.value.generation_params.top_k,
+                        value=DEFAULT_MODEL_SETTINGS.generation_params.top_k,
                         step=5,
                         interactive=True,
                         label="Top-k",
                     )
 
-    # Sync inputs
+        with gr.Accordion("Request queue", open=False):
+            queue_stats = gr.Markdown(SCHEDULER.format_stats())
+            usage_stats = gr.Markdown(USAGE.format_stats())
+            load_stats = gr.Markdown(format_load_stats())
+            hedge_stats = gr.Markdown(HEDGING.format_stats())
+            btn_refresh_queue_stats = gr.Button("🔄 Refresh", variant="secondary")
 
-    @paragraphs.change(inputs=[state, paragraphs], outputs=state)
-    def set_paragraphs(state, paragraphs):
-        state.paragraphs = [p.strip() for p in paragraphs.split("\n\n") if p.strip()]
-        return state
+    # Sync inputs
 
-    def set_field(state, field, value):
-        setattr(state, field, value)
-        return state
+    @paragraphs.input(inputs=[paragraphs, paragraphs_page])
+    def set_paragraphs(paragraphs, page, request: gr.Request):
+        session = get_session(request)
+        with SCHEDULER.session_lock(request.session_hash):
+            try:
+                apply_page_edit(session.state.paragraphs, session.page_snapshot, page, paragraphs)
+            except StalePageError:
+                raise gr.Error("The story has changed since this page was shown, please reload the page")
+            mark_dirty(request)
+
+    @paragraphs_page.change(inputs=[paragraphs_page], outputs=paragraphs)
+    def select_page(page, request: gr.Request):
+        return show_page(get_session(request), page)
+
+    @btn_prev_page.click(inputs=[paragraphs_page], outputs=paragraphs_page)
+    def prev_page(page):
+        return max(1, page - 1)
+
+    @btn_next_page.click(inputs=[paragraphs_page], outputs=paragraphs_page)
+    def next_page(page, request: gr.Request):
+        num_paragraphs = len(get_session(request).state.paragraphs)
+        return min(get_page_count(num_paragraphs), page + 1)
+
+    def make_setter(get_target, key, autosave=False):
+        def set_field(value, request: gr.Request):
+            setattr(get_target(get_session(request)), key, value)
+            if autosave:
+                mark_dirty(request)
+
+        return set_field
 
     state_fields = {
         "name": name,
@@ -392,23 +698,36 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
         "short_memory": short_memory,
     }
     for key, field in state_fields.items():
-        field.change((lambda s, f, k=key: set_field(s, k, f)), [state, field], state)
+        field.change(make_setter(lambda s: s.state, key, autosave=True), [field], None)
 
-    model_state_fields = {
+    model_settings_fields = {
         "model_name": model_name,
         "prompt_template": prompt_template,
         "embedder_name": embedder_name,
-        "openai_api_key": openai_api_key,
-        "anthropic_api_key": anthropic_api_key,
+        "embedder_device": embedder_device,
+        "embedder_batch_size": embedder_batch_size,
+        "embedder_service_url": embedder_service_url,
+        "n_parallel": n_parallel,
+        "api_context_size": api_context_size,
+        "pipelined_step": pipelined_step,
+        "reconcile_instructions": reconcile_instructions,
+        "retrieval_mode": retrieval_mode,
+        "l1_segment_size": l1_segment_size,
+        "l2_group_size": l2_group_size,
+        "local_api": local_api,
+        "local_balancing": local_balancing,
+        "local_max_concurrency": local_max_concurrency,
+        "local_stream": local_stream,
+        "tgi_url": tgi_url,
+        "seed": seed,
+        "hedge_model_name": hedge_model_name,
+        "hedge_prompt_template": hedge_prompt_template,
+        "hedge_percentile": hedge_percentile,
+        "hedge_delay": hedge_delay,
+        "hedge_max_share": hedge_max_share,
     }
-    for key, field in model_state_fields.items():
-        field.change(
-            (lambda s, f, k=key: set_field(s, k, f)), [model_state, field], model_state
-        )
-
-    def set_param(state, field, value):
-        setattr(state.generation_params, field, value)
-        return state
+    for key, field in model_settings_fields.items():
+        field.change(make_setter(lambda s: s.model_settings, key), [field], None)
 
     generation_params_fields = {
         "temperature": temperature,
@@ -418,44 +737,46 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
     }
     for key, field in generation_params_fields.items():
         field.change(
-            (lambda s, f, k=key: set_param(s, k, f)), [model_state, field], model_state
+            make_setter(lambda s: s.model_settings.generation_params, key),
+            [field],
+            None,
         )
 
     # Main events
     btn_init.click(
         generate_meta,
-        inputs=[novel_type, description, model_state],
-        outputs=[state, name, language, synopsis, outline],
+        inputs=[novel_type, description],
+        outputs=[name, language, synopsis, outline],
     ).success(
         generate_first_step,
-        inputs=[state, model_state],
         outputs=[
-            state,
             short_memory,
             paragraphs,
+            paragraphs_page,
             instruction1,
             instruction2,
             instruction3,
+            story_node,
         ],
     )
 
     btn_step.click(
         step,
-        inputs=[state, model_state, selection_mode],
+        inputs=[selection_mode],
         outputs=[
-            state,
             short_memory,
             paragraphs,
+            paragraphs_page,
             instruction1,
             instruction2,
             instruction3,
             instruction,
+            story_node,
         ],
     )
     btn_generate_instructions.click(
         generate_instructions,
-        inputs=[state, model_state],
-        outputs=[state, instruction1, instruction2, instruction3, instruction],
+        outputs=[instruction1, instruction2, instruction3, instruction],
     )
 
     # Save/Load
@@ -467,78 +788,116 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
     def hide_save_menu():
         return gr.update(visible=False), gr.update(visible=True)
 
-    @btn_load.click(outputs=[load_filename, file_loader, save_load_buttons])
-    def show_load_menu():
-        files = os.listdir(SAVES_DIR_PATH)
-        files = [f for f in files if not f.startswith(".")]
-        first_file = files[0] if files else None
-        load_filename = gr.update(choices=files, value=first_file, interactive=True)
+    def list_saves(query, page, from_autosaves):
+        catalog = AUTOSAVE.catalog if from_autosaves else SAVES_CATALOG
+        page = max(1, int(page or 1))
+        rows = catalog.list(
+            query=query, limit=SAVES_PAGE_SIZE, offset=(page - 1) * SAVES_PAGE_SIZE
+        )
+        choices = [
+            (f"{r['name']} ({r['file_name']}, {r['paragraph_count']} paragraphs)", r["file_name"])
+            for r in rows
+        ]
+        first_file = choices[0][1] if choices else None
+        total = catalog.count(query=query)
+        return gr.update(
+            choices=choices,
+            value=first_file,
+            interactive=True,
+            info=f"{total} saves found",
+        )
+
+    load_filters = [load_query, load_page, load_autosaves]
+
+    @btn_load.click(
+        inputs=load_filters,
+        outputs=[load_filename, file_loader, save_load_buttons],
+    )
+    def show_load_menu(query, page, from_autosaves):
+        load_filename = list_saves(query, page, from_autosaves)
         return load_filename, gr.update(visible=True), gr.update(visible=False)
 
+    for load_filter in load_filters:
+        load_filter.change(list_saves, inputs=load_filters, outputs=load_filename)
+
     @btn_close_load.click(outputs=[file_loader, save_load_buttons])
     def hide_load_menu():
         return gr.update(visible=False), gr.update(visible=True)
 
-    btn_confirm_save.click(save, inputs=[save_filename, save_root, state]).success(
+    btn_confirm_save.click(save, inputs=[save_filename, save_root]).success(
         lambda: (gr.update(visible=False), gr.update(visible=True)),
         outputs=[file_saver, save_load_buttons],
     )
 
+    load_outputs = [
+        name,
+        synopsis,
+        outline,
+        short_memory,
+        paragraphs,
+        paragraphs_page,
+        instruction1,
+        instruction2,
+        instruction3,
+        story_node,
+    ]
     btn_confirm_load.click(
         load_from_saves,
-        inputs=[load_filename],
-        outputs=[
-            state,
-            name,
-            synopsis,
-            outline,
-            short_memory,
-            paragraphs,
-            instruction1,
-            instruction2,
-            instruction3,
-        ],
+        inputs=[load_filename, load_autosaves],
+        outputs=load_outputs,
     ).success(
         lambda: (gr.update(visible=False), gr.update(visible=True)),
         outputs=[file_loader, save_load_buttons],
     )
 
-    btn_upload.upload(
-        load,
-        inputs=[btn_upload],
-        outputs=[
-            state,
-            name,
-            synopsis,
-            outline,
-            short_memory,
-            paragraphs,
-            instruction1,
-            instruction2,
-            instruction3,
-        ],
-    )
+    btn_upload.upload(load, inputs=[btn_upload], outputs=load_outputs)
+
+    # Story tree
+    btn_switch_node.click(switch_node, inputs=[story_node], outputs=load_outputs)
+    btn_undo_step.click(undo_step, outputs=load_outputs)
+    btn_prune_node.click(prune_node, inputs=[story_node], outputs=load_outputs)
 
     # Other events
-    def create_model_list(model_state):
+    def create_model_list(model_settings):
         model_list = list(LOCAL_MODELS_LIST)
-        openai_key = openai_get_key(model_state)
-        anthropic_key = anthropic_get_key(model_state)
+        openai_key = openai_get_key(model_settings)
+        anthropic_key = anthropic_get_key(model_settings)
         if openai_key:
             model_list.extend(openai_list_models(openai_key))
         if anthropic_key:
             model_list.extend(anthropic_list_models())
+        model_list.extend(local_list_models(model_settings))
         return model_list
 
-    @openai_api_key.change(inputs=[model_state], outputs=[model_name])
-    def on_openai_api_key_change(model_state):
-        model_list = create_model_list(model_state)
+    def on_load(request: gr.Request):
+        model_list = create_model_list(get_session(request).model_settings)
         return gr.update(choices=model_list)
 
-    @anthropic_api_key.change(inputs=[model_state], outputs=[model_name])
-    def on_anthropic_api_key_change(model_state):
-        model_list = create_model_list(model_state)
-        return gr.update(choices=model_list)
+    demo.load(on_load, outputs=[model_name])
+
+    @openai_api_key.change(inputs=[openai_api_key], outputs=[model_name])
+    def on_openai_api_key_change(openai_api_key, request: gr.Request):
+        model_settings = get_session(request).model_settings
+        model_settings.openai_api_key = openai_api_key
+        return gr.update(choices=create_model_list(model_settings))
+
+    @anthropic_api_key.change(inputs=[anthropic_api_key], outputs=[model_name])
+    def on_anthropic_api_key_change(anthropic_api_key, request: gr.Request):
+        model_settings = get_session(request).model_settings
+        model_settings.anthropic_api_key = anthropic_api_key
+        return gr.update(choices=create_model_list(model_settings))
+
+    local_base_urls.change(
+        make_setter(lambda s: s.model_settings, "local_base_urls"), [local_base_urls], None
+    )
+
+    def on_local_base_urls_submit(local_base_urls, request: gr.Request):
+        model_settings = get_session(request).model_settings
+        model_settings.local_base_urls = local_base_urls
+        return gr.update(choices=create_model_list(model_settings))
+
+    local_base_urls.submit(on_local_base_urls_submit, [local_base_urls], [model_name])
+    local_base_urls.blur(on_local_base_urls_submit, [local_base_urls], [model_name])
 
     @selected_instruction.select(
         inputs=[instruction1, instruction2, instruction3], outputs=[instruction]
@@ -558,23 +917,29 @@ with gr.Blocks(title="TaleStudio", css=css, analytics_enabled=False) as demo:
         is_manual = "manual" in value
         return gr.Row.update(visible=is_manual)
 
-    @prompt_template_name.select(
-        inputs=[model_state, prompt_template], outputs=[model_state, prompt_template]
-    )
-    def select_prompt_template_name(model_state, prompt_template, evt: gr.SelectData):
+    @prompt_template_name.select(outputs=[prompt_template])
+    def select_prompt_template_name(evt: gr.SelectData, request: gr.Request):
         value = evt.value
         is_custom = "custom" in value
         prompt_template = PROMPT_TEMPLATES[value]
         is_hardcoded = "openai" in value or "anthropic" in value
-        model_state.prompt_template = prompt_template
-        return model_state, gr.update(
+        get_session(request).model_settings.prompt_template = prompt_template
+        return gr.update(
             value=prompt_template, interactive=is_custom, visible=not is_hardcoded
         )
 
-    demo.queue()
+    @btn_refresh_queue_stats.click(outputs=[queue_stats, usage_stats, load_stats, hedge_stats])
+    def refresh_queue_stats():
+        return SCHEDULER.format_stats(), USAGE.format_stats(), format_load_stats(), HEDGING.format_stats()
+
+    demo.queue(default_concurrency_limit=CONCURRENCY_LIMIT)
 
 
-def launch(server_port: int = 8080, server_name: str = "0.0.0.0", share: bool = False):
+def launch(server_port: int = 8080, server_name: str = "0.0.0.0", share: bool = False, embedder_threads: int = 0):
+    set_embedder_threads(embedder_threads)
+    SAVES_CATALOG.sync()
+    if os.path.isdir(AUTOSAVES_DIR_PATH):
+        AUTOSAVE.catalog.sync()
     demo.launch(
         server_port=server_port,
         share=share,
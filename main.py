@@ -20,14 +20,17 @@ def main(
     model_name: str = DEFAULT_MODEL_NAME,
     embedder_name: str = DEFAULT_EMBEDDER_NAME,
     prompt_template: str = "openai",
+    pipelined_step: bool = False,
+    fused_human: bool = False,
 ):
     model_settings = ModelSettings(
         embedder_name=DEFAULT_EMBEDDER_NAME,
         model_name=DEFAULT_MODEL,
         prompt_template=prompt_template,
+        pipelined_step=pipelined_step,
     )
     writer = RecurrentGPT(model_settings)
-    human = Human(model_settings)
+    human = Human(model_settings, fused=fused_human)
     state = writer.generate_plan(novel_type=novel_type, description=description)
     state = writer.generate_first_paragraphs(state)
 
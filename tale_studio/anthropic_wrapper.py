@@ -1,15 +1,19 @@
 import logging
-import time
 import os
 import json
 import inspect
 from typing import Optional
 
-from anthropic import Anthropic, APIError
+from tale_studio.usage import USAGE
+from tale_studio.scheduler import check_cancelled, cancellable_sleep
+from tale_studio.single_flight import SingleFlightCache
 
 DEFAULT_MODEL = "claude-3-haiku-20240307"
 DEFAULT_SLEEP_TIME = 20
 
+ANTHROPIC_MODEL_LISTS = SingleFlightCache("anthropic model lists")
+ANTHROPIC_TOKENIZERS = SingleFlightCache("anthropic tokenizers")
+
 
 def anthropic_completion(
     messages,
@@ -19,6 +23,8 @@ def anthropic_completion(
     max_tokens: int = 2048,
     **kwargs,
 ):
+    from anthropic import Anthropic, APIError
+
     if not api_key:
         api_key = os.environ.get("ANTHROPIC_API_KEY", None)
 
@@ -28,6 +34,7 @@ def anthropic_completion(
         messages = messages[1:]
 
     while True:
+        check_cancelled()
         try:
             client = Anthropic(api_key=api_key)
             completion = client.messages.create(
@@ -40,24 +47,45 @@ def anthropic_completion(
             break
         except APIError as e:
             logging.warning(f"Anthropic error: {e}.")
-            time.sleep(sleep_time)
+            cancellable_sleep(sleep_time)
+    record_usage(completion.usage)
     return completion.content[0].text
 
 
+def record_usage(usage):
+    cached_tokens = getattr(usage, "cache_read_input_tokens", 0) or 0
+    cache_write_tokens = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    USAGE.record(
+        "anthropic",
+        prompt_tokens=usage.input_tokens + cached_tokens + cache_write_tokens,
+        cached_tokens=cached_tokens,
+        cache_write_tokens=cache_write_tokens,
+        completion_tokens=usage.output_tokens,
+    )
+
+
 def anthropic_tokenize(text: str, api_key: Optional[str] = None):
-    client = Anthropic(api_key)
-    tokenizer = client.get_tokenizer()
+    def load():
+        from anthropic import Anthropic
+
+        return Anthropic(api_key=api_key).get_tokenizer()
+
+    tokenizer = ANTHROPIC_TOKENIZERS.get(api_key, load)
     return tokenizer.encode(text)
 
 
 def anthropic_list_models():
-    models = (
-        inspect.signature(Anthropic().messages.create).parameters["model"].annotation
-    )
-    models = models[models.find("Literal") + len("Literal"): -1]
-    models = models.replace("'", '"')
-    models = json.loads(models)
-    return models
+    def load():
+        from anthropic import Anthropic
+
+        models = (
+            inspect.signature(Anthropic().messages.create).parameters["model"].annotation
+        )
+        models = models[models.find("Literal") + len("Literal"): -1]
+        models = models.replace("'", '"')
+        return json.loads(models)
+
+    return ANTHROPIC_MODEL_LISTS.get(None, load)
 
 
 def anthropic_get_key(model_settings):
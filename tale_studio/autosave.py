@@ -0,0 +1,112 @@
+import os
+import re
+import time
+import atexit
+import logging
+import threading
+from typing import Dict, Optional
+
+from tale_studio.state import State
+from tale_studio.files import AUTOSAVES_DIR_PATH
+from tale_studio.saves_catalog import SavesCatalog
+
+DEFAULT_INTERVAL = 30.0
+DEFAULT_MAX_BYTES_PER_SECOND = 4 * 1024 * 1024
+AUTOSAVE_EXTENSION = ".tale"
+
+
+class AutosaveService:
+    def __init__(
+        self,
+        autosave_dir: str = AUTOSAVES_DIR_PATH,
+        interval: float = DEFAULT_INTERVAL,
+        max_bytes_per_second: int = DEFAULT_MAX_BYTES_PER_SECOND,
+    ):
+        self.autosave_dir = str(autosave_dir)
+        self.interval = interval
+        self.max_bytes_per_second = max_bytes_per_second
+        self.catalog = SavesCatalog(self.autosave_dir)
+        self.pending: Dict[str, State] = dict()
+        self.last_write: Dict[str, float] = dict()
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def get_file_name(self, session_id: str) -> str:
+        return re.sub(r"[^A-Za-z0-9_-]", "_", session_id) + AUTOSAVE_EXTENSION
+
+    def mark_dirty(self, session_id: str, state: State):
+        with self.condition:
+            if self.thread is None:
+                os.makedirs(self.autosave_dir, exist_ok=True)
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+            self.pending[session_id] = state.fork()
+            self.condition.notify()
+
+    def remove(self, session_id: str):
+        file_name = self.get_file_name(session_id)
+        with self.condition:
+            self.pending.pop(session_id, None)
+            self.last_write.pop(session_id, None)
+        with self.write_lock:
+            path = os.path.join(self.autosave_dir, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+            if os.path.isdir(self.autosave_dir):
+                self.catalog.remove(file_name)
+
+    def _next_due(self):
+        now = time.monotonic()
+        next_session_id, next_due_time = None, None
+        for session_id in self.pending:
+            due_time = self.last_write.get(session_id, 0.0) + self.interval
+            if next_due_time is None or due_time < next_due_time:
+                next_session_id, next_due_time = session_id, due_time
+        if next_session_id is None:
+            return None, None
+        return next_session_id, next_due_time - now
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                session_id, delay = self._next_due()
+                while session_id is None or delay > 0:
+                    self.condition.wait(timeout=delay)
+                    session_id, delay = self._next_due()
+                state = self.pending.pop(session_id)
+                self.last_write[session_id] = time.monotonic()
+            self._write(session_id, state)
+
+    def _write(self, session_id: str, state: State):
+        file_name = self.get_file_name(session_id)
+        path = os.path.join(self.autosave_dir, file_name)
+        try:
+            start_time = time.monotonic()
+            with self.write_lock:
+                with self.condition:
+                    if session_id not in self.last_write:
+                        return
+                state.save(path)
+                self.catalog.update(file_name, state)
+        except Exception:
+            logging.exception(f"Autosave failed for session {session_id}")
+            return
+        min_duration = os.path.getsize(path) / self.max_bytes_per_second
+        elapsed = time.monotonic() - start_time
+        if elapsed < min_duration:
+            time.sleep(min_duration - elapsed)
+
+    def flush(self):
+        with self.condition:
+            pending = self.pending
+            self.pending = dict()
+            now = time.monotonic()
+            for session_id in pending:
+                self.last_write[session_id] = now
+        for session_id, state in pending.items():
+            self._write(session_id, state)
+
+
+AUTOSAVE = AutosaveService()
+atexit.register(AUTOSAVE.flush)
@@ -0,0 +1,206 @@
+import io
+import os
+import json
+import time
+import logging
+from typing import Dict, List, Optional
+
+from tale_studio.files import atomic_open
+from tale_studio.model_settings import ModelSettings
+from tale_studio.openai_wrapper import openai_get_key
+from tale_studio.anthropic_wrapper import anthropic_get_key
+from tale_studio.generation_profiles import apply_profile, DEFAULT_PROFILE
+
+DEFAULT_POLL_INTERVAL = 30
+
+
+def make_messages(prompt: str, system_prompt: str):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def get_params(
+    model_settings: ModelSettings,
+    profiles: Optional[Dict[str, str]],
+    custom_id: str,
+):
+    profile = (profiles or dict()).get(custom_id, DEFAULT_PROFILE)
+    return apply_profile(model_settings, profile).generation_params
+
+
+class OpenAIBatchClient:
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
+        from openai import OpenAI
+
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+
+    def submit(
+        self,
+        prompts: Dict[str, str],
+        model_settings: ModelSettings,
+        system_prompt: str,
+        profiles: Optional[Dict[str, str]] = None,
+    ) -> str:
+        lines = []
+        for custom_id, prompt in prompts.items():
+            params = get_params(model_settings, profiles, custom_id)
+            body = {
+                "model": model_settings.model_name,
+                "messages": make_messages(prompt, system_prompt),
+                "max_tokens": params.max_new_tokens,
+                "temperature": params.temperature,
+                "top_p": params.top_p,
+            }
+            if params.stop:
+                body["stop"] = list(params.stop)
+            request = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }
+            lines.append(json.dumps(request, ensure_ascii=False))
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        input_file = self.client.files.create(
+            file=("batch.jsonl", io.BytesIO(data)), purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def poll(self, batch_id: str) -> Optional[Dict[str, str]]:
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("failed", "expired", "cancelled"):
+            raise RuntimeError(f"Batch {batch_id} ended with status {batch.status}")
+        if batch.status != "completed":
+            return None
+        results = dict()
+        if not batch.output_file_id:
+            return results
+        content = self.client.files.content(batch.output_file_id).text
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            message = response["body"]["choices"][0]["message"]
+            results[record["custom_id"]] = message["content"]
+        return results
+
+
+class AnthropicBatchClient:
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
+        from anthropic import Anthropic
+
+        client = Anthropic(api_key=api_key, base_url=base_url)
+        batches = getattr(client.messages, "batches", None)
+        self.batches = batches if batches is not None else client.beta.messages.batches
+
+    def submit(
+        self,
+        prompts: Dict[str, str],
+        model_settings: ModelSettings,
+        system_prompt: str,
+        profiles: Optional[Dict[str, str]] = None,
+    ) -> str:
+        requests = []
+        for custom_id, prompt in prompts.items():
+            params = get_params(model_settings, profiles, custom_id)
+            requests.append({
+                "custom_id": custom_id,
+                "params": {
+                    "model": model_settings.model_name,
+                    "max_tokens": params.max_new_tokens,
+                    "temperature": min(params.temperature, 1.0),
+                    "stop_sequences": list(params.stop),
+                    "system": system_prompt,
+                    "messages": [{"role": "user", "content": prompt}],
+                },
+            })
+        return self.batches.create(requests=requests).id
+
+    def poll(self, batch_id: str) -> Optional[Dict[str, str]]:
+        batch = self.batches.retrieve(batch_id)
+        if batch.processing_status != "ended":
+            return None
+        results = dict()
+        for record in self.batches.results(batch_id):
+            if record.result.type != "succeeded":
+                continue
+            results[record.custom_id] = record.result.message.content[0].text
+        return results
+
+
+def get_batch_provider(model_name: str) -> str:
+    if model_name.startswith("claude"):
+        return "anthropic"
+    return "openai"
+
+
+def get_batch_client(
+    provider: str,
+    model_settings: ModelSettings,
+    base_url: Optional[str] = None,
+):
+    if provider == "openai":
+        return OpenAIBatchClient(openai_get_key(model_settings), base_url=base_url)
+    if provider == "anthropic":
+        return AnthropicBatchClient(anthropic_get_key(model_settings), base_url=base_url)
+    raise ValueError(f"Batch API is not supported for provider {provider}")
+
+
+class BatchJobs:
+    def __init__(self, job_file: str):
+        self.job_file = job_file
+        self.jobs: Dict[str, Dict] = dict()
+        if os.path.exists(job_file):
+            with open(job_file) as r:
+                self.jobs = json.load(r)
+
+    def _save(self):
+        with atomic_open(self.job_file, "w") as w:
+            json.dump(self.jobs, w, ensure_ascii=False, indent=4)
+
+    def run(
+        self,
+        stage: str,
+        prompts: Dict[str, str],
+        client,
+        model_settings: ModelSettings,
+        system_prompt: str,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        profiles: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, str]:
+        job = self.jobs.get(stage)
+        if job is None or sorted(job["custom_ids"]) != sorted(prompts.keys()):
+            batch_id = client.submit(prompts, model_settings, system_prompt, profiles=profiles)
+            job = {"batch_id": batch_id, "custom_ids": list(prompts.keys())}
+            self.jobs[stage] = job
+            self._save()
+            print(f"Submitted batch {batch_id} for {stage}: {len(prompts)} requests")
+
+        while "results" not in job:
+            results = client.poll(job["batch_id"])
+            if results is None:
+                print(f"Waiting for batch {job['batch_id']} ({stage})...")
+                time.sleep(poll_interval)
+                continue
+            job["results"] = results
+            self._save()
+
+        missing: List[str] = [c for c in prompts if c not in job["results"]]
+        if missing:
+            logging.warning(f"Batch {job['batch_id']} has no results for {missing}")
+        return job["results"]
+
+    def clear(self):
+        self.jobs = dict()
+        if os.path.exists(self.job_file):
+            os.remove(self.job_file)
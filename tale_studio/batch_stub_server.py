@@ -0,0 +1,188 @@
+import json
+import time
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+import fire
+
+
+def stub_output(custom_id: str) -> str:
+    if custom_id == "meta":
+        return json.dumps({"name": "Stub Book", "language": "English"})
+    if custom_id.startswith("l1-"):
+        return json.dumps({"summary": [
+            {"chapter_header": f"Chapter {custom_id}"},
+            {"summary_point": f"Stub summary point for {custom_id}."},
+        ]})
+    if custom_id == "synopsis":
+        return json.dumps({"synopsis": "Stub synopsis."})
+    return json.dumps({"summary": f"Stub summary for {custom_id}."})
+
+
+class StubStorage:
+    lock = threading.Lock()
+    files: Dict[str, bytes] = dict()
+    batches: Dict[str, Dict] = dict()
+    counter = 0
+
+    @classmethod
+    def next_id(cls, prefix: str) -> str:
+        with cls.lock:
+            cls.counter += 1
+            return f"{prefix}_{cls.counter}"
+
+
+def openai_result_line(custom_id: str, body: Dict) -> Dict:
+    message = {"role": "assistant", "content": stub_output(custom_id)}
+    response = {
+        "id": f"chatcmpl-{custom_id}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+    return {
+        "id": f"batch_req_{custom_id}",
+        "custom_id": custom_id,
+        "response": {"status_code": 200, "request_id": custom_id, "body": response},
+        "error": None,
+    }
+
+
+def anthropic_result_line(custom_id: str, params: Dict) -> Dict:
+    message = {
+        "id": f"msg_{custom_id}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "stub"),
+        "content": [{"type": "text", "text": stub_output(custom_id)}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": 0, "output_tokens": 0},
+    }
+    return {"custom_id": custom_id, "result": {"type": "succeeded", "message": message}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def _send_json(self, record: Dict, status: int = 200):
+        self._send_bytes(json.dumps(record).encode("utf-8"), "application/json", status)
+
+    def _send_bytes(self, data: bytes, content_type: str, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length)
+
+    def _read_upload(self) -> bytes:
+        body = self._read_body()
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+        message = BytesParser(policy=HTTP).parsebytes(header + body)
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "file":
+                return part.get_payload(decode=True)
+        return b""
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if path == "/v1/files":
+            file_id = StubStorage.next_id("file")
+            data = self._read_upload()
+            StubStorage.files[file_id] = data
+            self._send_json({
+                "id": file_id,
+                "object": "file",
+                "bytes": len(data),
+                "created_at": int(time.time()),
+                "filename": "batch.jsonl",
+                "purpose": "batch",
+                "status": "processed",
+            })
+            return
+        if path == "/v1/batches":
+            request = json.loads(self._read_body())
+            lines = StubStorage.files[request["input_file_id"]].decode("utf-8").splitlines()
+            outputs = []
+            for line in lines:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                outputs.append(openai_result_line(record["custom_id"], record["body"]))
+            output_file_id = StubStorage.next_id("file")
+            StubStorage.files[output_file_id] = "\n".join(json.dumps(o) for o in outputs).encode("utf-8")
+            batch_id = StubStorage.next_id("batch")
+            StubStorage.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"],
+                "completion_window": request["completion_window"],
+                "status": "completed",
+                "output_file_id": output_file_id,
+                "created_at": int(time.time()),
+                "request_counts": {"total": len(outputs), "completed": len(outputs), "failed": 0},
+            }
+            self._send_json(StubStorage.batches[batch_id])
+            return
+        if path == "/v1/messages/batches":
+            request = json.loads(self._read_body())
+            outputs = [anthropic_result_line(r["custom_id"], r["params"]) for r in request["requests"]]
+            results_id = StubStorage.next_id("file")
+            StubStorage.files[results_id] = "\n".join(json.dumps(o) for o in outputs).encode("utf-8")
+            batch_id = StubStorage.next_id("msgbatch")
+            host = self.headers.get("Host")
+            StubStorage.batches[batch_id] = {
+                "id": batch_id,
+                "type": "message_batch",
+                "processing_status": "ended",
+                "request_counts": {
+                    "processing": 0,
+                    "succeeded": len(outputs),
+                    "errored": 0,
+                    "canceled": 0,
+                    "expired": 0,
+                },
+                "created_at": "2024-01-01T00:00:00Z",
+                "expires_at": "2024-01-02T00:00:00Z",
+                "ended_at": "2024-01-01T00:00:00Z",
+                "cancel_initiated_at": None,
+                "archived_at": None,
+                "results_url": f"http://{host}/v1/results/{results_id}",
+            }
+            self._send_json(StubStorage.batches[batch_id])
+            return
+        self._send_json({"error": {"message": f"Unknown path {path}"}}, status=404)
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts[:2] == ["v1", "batches"] and len(parts) == 3:
+            self._send_json(StubStorage.batches[parts[2]])
+            return
+        if parts[:3] == ["v1", "messages", "batches"] and len(parts) == 4:
+            self._send_json(StubStorage.batches[parts[3]])
+            return
+        if parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content":
+            self._send_bytes(StubStorage.files[parts[2]], "application/octet-stream")
+            return
+        if parts[:2] == ["v1", "results"] and len(parts) == 3:
+            self._send_bytes(StubStorage.files[parts[2]], "application/binary")
+            return
+        self._send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    print(f"Batch API stub is listening on http://{host}:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    fire.Fire(serve)
@@ -1,17 +1,216 @@
-from sentence_transformers import SentenceTransformer
+import os
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Tuple, List, Dict, Optional
+
+import numpy as np
+
+from tale_studio.files import CACHE_DIR_PATH
+from tale_studio.single_flight import SingleFlightCache
+
+
+EMBEDDER_BACKENDS = ("torch", "int8", "onnx")
+DEFAULT_EMBEDDER_BACKEND = "torch"
+EMBEDDER_THREADS = {"num_threads": 0}
+
+
+def set_embedder_threads(num_threads: int = 0):
+    EMBEDDER_THREADS["num_threads"] = num_threads
+    if not num_threads:
+        return
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(num_threads)
+
+
+def parse_embedder_name(embedder_name: str) -> Tuple[str, str]:
+    backend, sep, model_name = embedder_name.partition(":")
+    if sep and backend in EMBEDDER_BACKENDS:
+        return backend, model_name
+    return DEFAULT_EMBEDDER_BACKEND, embedder_name
+
+
+def load_sentence_transformer(embedder_name: str, device: str = ""):
+    from sentence_transformers import SentenceTransformer
+
+    backend, model_name = parse_embedder_name(embedder_name)
+    num_threads = EMBEDDER_THREADS["num_threads"]
+    if backend == "onnx":
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+        provider = "CPUExecutionProvider"
+        if device.startswith("cuda"):
+            provider = "CUDAExecutionProvider"
+        return SentenceTransformer(
+            model_name,
+            device=device or None,
+            backend="onnx",
+            model_kwargs={"provider": provider, "session_options": session_options},
+        )
+
+    import torch
+
+    if backend == "int8":
+        model = SentenceTransformer(model_name, device="cpu")
+        return torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return SentenceTransformer(model_name, device=device or None)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingsCache:
+    def __init__(self, db_path: str, max_memory_items: int = 10000):
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self.memory: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def _connect(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(str(self.db_path)), exist_ok=True)
+            self.connection = sqlite3.connect(
+                str(self.db_path), check_same_thread=False, timeout=30
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "embedder_name TEXT, prefix TEXT, text_hash TEXT, vector BLOB, "
+                "PRIMARY KEY (embedder_name, prefix, text_hash))"
+            )
+            self.connection.commit()
+        return self.connection
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys: List[Tuple[str, str, str]]) -> Dict[Tuple, np.ndarray]:
+        found = dict()
+        with self.lock:
+            missing = []
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+                elif key not in found:
+                    missing.append(key)
+            if not missing:
+                return found
+
+            connection = self._connect()
+            for key in missing:
+                row = connection.execute(
+                    "SELECT vector FROM embeddings "
+                    "WHERE embedder_name = ? AND prefix = ? AND text_hash = ?",
+                    key,
+                ).fetchone()
+                if row is None:
+                    continue
+                vector = np.frombuffer(row[0], dtype=np.float32)
+                found[key] = vector
+                self._remember(key, vector)
+        return found
+
+    def put_many(self, items: Dict[Tuple[str, str, str], np.ndarray]):
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)",
+                    [
+                        (*key, np.asarray(vector, dtype=np.float32).tobytes())
+                        for key, vector in items.items()
+                    ],
+                )
+            for key, vector in items.items():
+                self._remember(key, np.asarray(vector, dtype=np.float32))
+
+
+class Embedder:
+    def __init__(
+        self,
+        model,
+        name: str = "",
+        batch_size: int = 32,
+        cache: Optional[EmbeddingsCache] = None,
+    ):
+        self.model = model
+        self.name = name
+        self.batch_size = batch_size
+        self.cache = cache
+
+    def encode(self, sentences, **kwargs):
+        kwargs.setdefault("batch_size", self.batch_size)
+        return self.model.encode(sentences, **kwargs)
+
+    def encode_cached(self, texts: List[str], prefix: str = "", batch_size: Optional[int] = None) -> np.ndarray:
+        keys = [(self.name, prefix, text_hash(text)) for text in texts]
+        vectors = self.cache.get_many(keys) if self.cache is not None else dict()
+
+        missing = dict()
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing[key] = text
+        if missing:
+            embeddings = self.encode(
+                [prefix + text for text in missing.values()],
+                convert_to_numpy=True,
+                batch_size=batch_size or self.batch_size,
+            )
+            new_vectors = {
+                key: np.asarray(embedding, dtype=np.float32)
+                for key, embedding in zip(missing.keys(), embeddings)
+            }
+            if self.cache is not None:
+                self.cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
 
 
 class EmbeddersStorage:
-    embedders = dict()
+    models = SingleFlightCache("embedders")
+    cache = EmbeddingsCache(CACHE_DIR_PATH / "embeddings.sqlite")
 
     @classmethod
-    def get_embedder(cls, embedder_name: str):
-        if embedder_name not in cls.embedders:
-            cls.embedders[embedder_name] = SentenceTransformer(embedder_name)
-        return cls.embedders[embedder_name]
+    def get_embedder(
+        cls,
+        embedder_name: str,
+        device: str = "",
+        batch_size: int = 32,
+        service_url: str = "",
+    ):
+        def load():
+            if service_url:
+                from tale_studio.embedding_server import RemoteEmbeddingModel
+
+                return RemoteEmbeddingModel(service_url, embedder_name)
+            return load_sentence_transformer(embedder_name, device=device)
+
+        model = cls.models.get((embedder_name, device, service_url), load)
+        return Embedder(model, name=embedder_name, batch_size=batch_size, cache=cls.cache)
 
 
 EMBEDDER_LIST = [
     "embaas/sentence-transformers-multilingual-e5-base",
+    "onnx:embaas/sentence-transformers-multilingual-e5-base",
+    "int8:embaas/sentence-transformers-multilingual-e5-base",
     "sentence-transformers/multi-qa-mpnet-base-cos-v1",
+    "onnx:sentence-transformers/multi-qa-mpnet-base-cos-v1",
+    "int8:sentence-transformers/multi-qa-mpnet-base-cos-v1",
 ]
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import queue
+import socket
+import threading
+import http.client
+from concurrent.futures import Future
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingUnixStreamServer
+from typing import List, Optional
+from urllib.parse import urlparse
+
+import fire
+import numpy as np
+
+from tale_studio.embedders import load_sentence_transformer, set_embedder_threads
+from tale_studio.single_flight import SingleFlightCache
+
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 5
+DEFAULT_TIMEOUT = 300
+UNIX_SCHEME = "unix://"
+
+
+@dataclass
+class BatchRequest:
+    texts: List[str]
+    future: Future
+
+
+@dataclass
+class BatcherStats:
+    requests: int = 0
+    texts: int = 0
+    batches: int = 0
+
+    @property
+    def mean_batch_size(self) -> float:
+        if not self.batches:
+            return 0.0
+        return self.texts / self.batches
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        model,
+        batch_size: int = 32,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+    ):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue: "queue.Queue[BatchRequest]" = queue.Queue()
+        self.stats = BatcherStats()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        future = Future()
+        self.queue.put(BatchRequest(texts=list(texts), future=future))
+        return future
+
+    def _collect(self) -> List[BatchRequest]:
+        requests = [self.queue.get()]
+        count = len(requests[0].texts)
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            requests.append(request)
+            count += len(request.texts)
+        return requests
+
+    def _loop(self):
+        while True:
+            requests = self._collect()
+            texts = [text for request in requests for text in request.texts]
+            try:
+                embeddings = self.model.encode(
+                    texts, batch_size=self.batch_size, convert_to_numpy=True
+                )
+                embeddings = np.asarray(embeddings, dtype=np.float32)
+            except Exception as e:
+                for request in requests:
+                    request.future.set_exception(e)
+                continue
+            self.stats.requests += len(requests)
+            self.stats.texts += len(texts)
+            self.stats.batches += 1
+            start = 0
+            for request in requests:
+                end = start + len(request.texts)
+                request.future.set_result(embeddings[start:end])
+                start = end
+
+
+class EmbeddingService:
+    def __init__(
+        self,
+        device: str = "",
+        batch_size: int = 32,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+    ):
+        self.device = device
+        self.batch_size = batch_size
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batchers = SingleFlightCache("embedding service models")
+
+    def get_batcher(self, embedder_name: str) -> MicroBatcher:
+        def load():
+            model = load_sentence_transformer(embedder_name, device=self.device)
+            return MicroBatcher(
+                model,
+                batch_size=self.batch_size,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=self.max_wait_ms,
+            )
+
+        return self.batchers.get(embedder_name, load)
+
+    def encode(self, embedder_name: str, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self.get_batcher(embedder_name).submit(texts).result()
+
+    def get_stats(self):
+        with self.batchers.lock:
+            batchers = {name: value for name, (value, _) in self.batchers.values.items()}
+        return {
+            name: {
+                "requests": batcher.stats.requests,
+                "texts": batcher.stats.texts,
+                "batches": batcher.stats.batches,
+                "mean_batch_size": batcher.stats.mean_batch_size,
+            }
+            for name, batcher in batchers.items()
+        }
+
+
+def make_handler(service: EmbeddingService):
+    class EmbeddingHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def address_string(self):
+            if isinstance(self.client_address, tuple):
+                return self.client_address[0]
+            return "unix"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, data: bytes, content_type: str, status: int = 200, headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or dict()).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_json(self, record, status: int = 200):
+            self._send(json.dumps(record).encode("utf-8"), "application/json", status)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/health":
+                self._send_json({"status": "ok", "models": service.get_stats()})
+                return
+            self._send_json({"error": f"Unknown path {self.path}"}, status=404)
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/encode":
+                self._send_json({"error": f"Unknown path {self.path}"}, status=404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            try:
+                embeddings = service.encode(request["embedder_name"], request["texts"])
+            except Exception as e:
+                self._send_json({"error": str(e)}, status=500)
+                return
+            shape = ",".join(str(d) for d in embeddings.shape)
+            self._send(
+                embeddings.astype(np.float32).tobytes(),
+                "application/octet-stream",
+                headers={"X-Embedding-Shape": shape},
+            )
+
+    return EmbeddingHandler
+
+
+class UnixHTTPServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float = DEFAULT_TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class RemoteEmbeddingModel:
+    def __init__(self, service_url: str, embedder_name: str, timeout: float = DEFAULT_TIMEOUT):
+        self.service_url = service_url
+        self.embedder_name = embedder_name
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.service_url.startswith(UNIX_SCHEME):
+            return UnixHTTPConnection(self.service_url[len(UNIX_SCHEME):], timeout=self.timeout)
+        url = urlparse(self.service_url)
+        return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=self.timeout)
+
+    def _post(self, body: bytes):
+        connection = getattr(self.local, "connection", None)
+        for attempt in range(2):
+            if connection is None:
+                connection = self._connect()
+                self.local.connection = connection
+            try:
+                connection.request(
+                    "POST", "/encode", body=body, headers={"Content-Type": "application/json"}
+                )
+                response = connection.getresponse()
+                return response, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                connection = self.local.connection = None
+                if attempt:
+                    raise
+
+    def encode(self, sentences, convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        sentences = list(sentences)
+        body = json.dumps({"embedder_name": self.embedder_name, "texts": sentences})
+        response, data = self._post(body.encode("utf-8"))
+        if response.status != 200:
+            raise RuntimeError(f"Embedding service error: {data.decode('utf-8', 'replace')}")
+        shape = tuple(int(d) for d in response.getheader("X-Embedding-Shape").split(","))
+        return np.frombuffer(data, dtype=np.float32).reshape(shape)
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8766,
+    socket_path: Optional[str] = None,
+    embedder_name: Optional[str] = None,
+    device: str = "",
+    num_threads: int = 0,
+    batch_size: int = 32,
+    max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+    max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+):
+    set_embedder_threads(num_threads)
+    service = EmbeddingService(
+        device=device,
+        batch_size=batch_size,
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+    )
+    if embedder_name:
+        service.get_batcher(embedder_name)
+    handler = make_handler(service)
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, handler)
+        print(f"Embedding service is listening on {UNIX_SCHEME}{socket_path}")
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        print(f"Embedding service is listening on http://{host}:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    fire.Fire(serve)
@@ -1,9 +1,29 @@
 import pathlib
 import os
+import threading
+from contextlib import contextmanager
 
 DIR_PATH = pathlib.Path(__file__).parent.resolve()
 ROOT_DIR_PATH = DIR_PATH.parent.resolve()
 MODELS_DIR_PATH = ROOT_DIR_PATH / "models"
 PROMPTS_DIR_PATH = DIR_PATH / "prompts"
 SAVES_DIR_PATH = ROOT_DIR_PATH / "saves"
+CACHE_DIR_PATH = ROOT_DIR_PATH / "cache"
+SESSIONS_DIR_PATH = ROOT_DIR_PATH / "sessions"
+AUTOSAVES_DIR_PATH = SAVES_DIR_PATH / "autosave"
 LOCAL_MODELS_LIST = tuple(f for f in os.listdir(MODELS_DIR_PATH) if f.endswith(".gguf"))
+
+
+@contextmanager
+def atomic_open(file_name, mode: str = "w"):
+    file_name = str(file_name)
+    tmp_file_name = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_file_name, mode) as w:
+            yield w
+            w.flush()
+            os.fsync(w.fileno())
+        os.replace(tmp_file_name, file_name)
+    finally:
+        if os.path.exists(tmp_file_name):
+            os.remove(tmp_file_name)
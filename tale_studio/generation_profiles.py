@@ -0,0 +1,49 @@
+import os
+import json
+import copy
+from dataclasses import replace
+from typing import Dict, Sequence
+
+from tale_studio.files import PROMPTS_DIR_PATH
+from tale_studio.model_settings import ModelSettings
+from tale_studio.single_flight import SingleFlightCache
+
+PROFILES_PATH = PROMPTS_DIR_PATH / "profiles.json"
+DEFAULT_PROFILE = "default"
+
+GENERATION_PROFILES = SingleFlightCache("generation profiles")
+
+
+def load_profiles(path=PROFILES_PATH) -> Dict[str, Dict]:
+    def load():
+        with open(path) as r:
+            return json.load(r)
+
+    return GENERATION_PROFILES.get(str(path), load)
+
+
+def get_profile(profile_name: str = DEFAULT_PROFILE) -> Dict:
+    profiles = load_profiles()
+    profile = dict(profiles.get(DEFAULT_PROFILE, {}))
+    profile.update(profiles.get(profile_name.replace(os.sep, "/"), {}))
+    return profile
+
+
+def apply_profile(model_settings: ModelSettings, profile_name: str = DEFAULT_PROFILE) -> ModelSettings:
+    profile = get_profile(profile_name)
+    params = model_settings.generation_params
+    if "max_new_tokens" in profile:
+        profile["max_new_tokens"] = min(profile["max_new_tokens"], params.max_new_tokens)
+    if "stop" in profile:
+        profile["stop"] = tuple(dict.fromkeys(tuple(params.stop) + tuple(profile["stop"])))
+    model_settings = copy.copy(model_settings)
+    model_settings.generation_params = replace(params, **profile)
+    return model_settings
+
+
+def truncate_at_stop(text: str, stop: Sequence[str]) -> str:
+    for s in stop:
+        index = text.find(s)
+        if index != -1:
+            text = text[:index]
+    return text
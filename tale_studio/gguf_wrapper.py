@@ -1,15 +1,30 @@
 import copy
-from typing import List, Dict
+import queue
+import logging
+import threading
+from concurrent.futures import CancelledError, Future
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional
 
-from llama_cpp import Llama
+import numpy as np
 
-from tale_studio.model_settings import ModelSettings
+from tale_studio.model_settings import ModelSettings, GenerationParams
 from tale_studio.prompt_templates import format_template
 from tale_studio.files import MODELS_DIR_PATH
+from tale_studio.scheduler import SCHEDULER, RequestRejected, check_cancelled, get_cancel_event, is_cancelled
+from tale_studio.single_flight import SingleFlightCache
+
+REPETITION_PENALTY_WINDOW = 64
+STOP_WINDOW_TOKENS = 16
+
+
+def get_gguf_backend_key(model_name: str, n_parallel: int) -> str:
+    return f"gguf:{model_name}:{max(1, n_parallel)}"
 
 
 class GGUFModels:
-    models = dict()
+    models = SingleFlightCache("gguf models")
+    engines = SingleFlightCache("gguf engines")
 
     @classmethod
     def get_model(
@@ -18,13 +33,261 @@ class GGUFModels:
         n_gpu_layers: int = -1,
         n_ctx: int = 16384,
     ):
-        if model_name not in cls.models:
-            cls.models[model_name] = Llama(
+        def load():
+            from llama_cpp import Llama
+
+            return Llama(
                 model_path=str(MODELS_DIR_PATH / model_name),
                 n_ctx=n_ctx,
                 n_gpu_layers=n_gpu_layers,
             )
-        return cls.models[model_name]
+
+        return cls.models.get(model_name, load)
+
+    @classmethod
+    def get_engine(
+        cls,
+        model_name: str,
+        n_parallel: int,
+        n_gpu_layers: int = -1,
+        n_ctx: int = 16384,
+    ):
+        def load():
+            model = cls.get_model(model_name, n_gpu_layers=n_gpu_layers, n_ctx=n_ctx)
+            engine = GGUFBatchEngine(model, n_parallel=n_parallel, n_ctx=n_ctx)
+            SCHEDULER.set_limit(get_gguf_backend_key(model_name, n_parallel), n_parallel)
+            return engine
+
+        return cls.engines.get((model_name, n_parallel), load)
+
+
+def sample_token(
+    logits: np.ndarray,
+    previous_tokens: List[int],
+    params: GenerationParams,
+    rng: np.random.Generator,
+) -> int:
+    logits = logits.astype(np.float64)
+    if params.repetition_penalty != 1.0 and previous_tokens:
+        ids = np.unique(previous_tokens[-REPETITION_PENALTY_WINDOW:])
+        values = logits[ids]
+        logits[ids] = np.where(
+            values > 0,
+            values / params.repetition_penalty,
+            values * params.repetition_penalty,
+        )
+    if params.temperature <= 0.0:
+        return int(np.argmax(logits))
+
+    logits /= params.temperature
+    candidates = np.arange(len(logits))
+    if 0 < params.top_k < len(logits):
+        candidates = np.argpartition(-logits, params.top_k - 1)[: params.top_k]
+    candidates = candidates[np.argsort(-logits[candidates])]
+    probs = np.exp(logits[candidates] - logits[candidates[0]])
+    probs /= probs.sum()
+    cutoff = int(np.searchsorted(np.cumsum(probs), params.top_p)) + 1
+    candidates, probs = candidates[:cutoff], probs[:cutoff]
+    return int(rng.choice(candidates, p=probs / probs.sum()))
+
+
+def hit_stop(model, tokens: List[int], stop) -> bool:
+    if not stop:
+        return False
+    tail = model.detokenize(tokens[-STOP_WINDOW_TOKENS:])
+    return any(s.encode("utf-8") in tail for s in stop)
+
+
+@dataclass
+class BatchSequence:
+    prompt_tokens: List[int]
+    params: GenerationParams
+    future: Future
+    cancel_event: Optional[threading.Event] = None
+    seq_id: int = -1
+    n_past: int = 0
+    pending_tokens: List[int] = field(default_factory=list)
+    generated_tokens: List[int] = field(default_factory=list)
+
+
+class GGUFBatchEngine:
+    def __init__(
+        self,
+        model,
+        n_parallel: int,
+        n_ctx: int = 16384,
+        n_batch: int = 512,
+        seed: Optional[int] = None,
+    ):
+        self.model = model
+        self.n_parallel = n_parallel
+        self.n_ctx = n_ctx
+        self.n_batch = n_batch
+        self.rng = np.random.default_rng(seed)
+        self.requests: queue.Queue = queue.Queue()
+        self.active: List[BatchSequence] = []
+        self.free_seq_ids = list(range(n_parallel))
+        self.ctx = None
+        self.batch = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def sequence_n_ctx(self) -> int:
+        return self.n_ctx // self.n_parallel
+
+    def submit(
+        self,
+        prompt_tokens: List[int],
+        params: GenerationParams,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> Future:
+        if len(prompt_tokens) >= self.sequence_n_ctx:
+            raise RequestRejected(
+                f"Prompt has {len(prompt_tokens)} tokens, but each of {self.n_parallel} parallel "
+                f"sequences has only {self.sequence_n_ctx} tokens of context. "
+                f"Reduce the prompt, increase n_ctx or decrease n_parallel."
+            )
+        future = Future()
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+            self.requests.put(BatchSequence(list(prompt_tokens), params, future, cancel_event))
+        return future
+
+    def _init_context(self):
+        import llama_cpp
+
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = self.n_ctx
+        params.n_batch = self.n_batch + self.n_parallel
+        if hasattr(params, "n_seq_max"):
+            params.n_seq_max = self.n_parallel
+        self.ctx = llama_cpp.llama_new_context_with_model(self.model.model, params)
+        self.batch = llama_cpp.llama_batch_init(
+            self.n_batch + self.n_parallel, 0, self.n_parallel
+        )
+
+    def _admit(self, block: bool):
+        while self.free_seq_ids:
+            try:
+                sequence = self.requests.get(block=block)
+            except queue.Empty:
+                return
+            block = False
+            if sequence.cancel_event is not None and sequence.cancel_event.is_set():
+                sequence.future.cancel()
+            if not sequence.future.set_running_or_notify_cancel():
+                continue
+            sequence.seq_id = self.free_seq_ids.pop()
+            sequence.pending_tokens = sequence.prompt_tokens[:]
+            self.active.append(sequence)
+
+    def _finish(self, sequence: BatchSequence, error: Optional[Exception] = None):
+        import llama_cpp
+
+        llama_cpp.llama_kv_cache_seq_rm(self.ctx, sequence.seq_id, -1, -1)
+        self.active.remove(sequence)
+        self.free_seq_ids.append(sequence.seq_id)
+        if error is not None:
+            sequence.future.set_exception(error)
+        else:
+            sequence.future.set_result(sequence.generated_tokens)
+
+    def _fill_batch(self):
+        entries = []
+        decoding = [s for s in self.active if not s.pending_tokens]
+        prefilling = [s for s in self.active if s.pending_tokens]
+        for sequence in decoding:
+            entries.append((sequence, sequence.generated_tokens[-1], True))
+        budget = self.n_batch
+        for sequence in prefilling:
+            if budget <= 0:
+                break
+            chunk = sequence.pending_tokens[:budget]
+            sequence.pending_tokens = sequence.pending_tokens[len(chunk):]
+            budget -= len(chunk)
+            for i, token in enumerate(chunk):
+                is_last = not sequence.pending_tokens and i == len(chunk) - 1
+                entries.append((sequence, token, is_last))
+
+        for i, (sequence, token, need_logits) in enumerate(entries):
+            self.batch.token[i] = token
+            self.batch.pos[i] = sequence.n_past
+            self.batch.n_seq_id[i] = 1
+            self.batch.seq_id[i][0] = sequence.seq_id
+            self.batch.logits[i] = need_logits
+            sequence.n_past += 1
+        self.batch.n_tokens = len(entries)
+        return entries
+
+    def _step(self):
+        import llama_cpp
+
+        entries = self._fill_batch()
+        if not entries:
+            return
+        status = llama_cpp.llama_decode(self.ctx, self.batch)
+        if status != 0:
+            error = RuntimeError(f"llama_decode failed with status {status}")
+            for sequence in list(self.active):
+                self._finish(sequence, error)
+            return
+
+        n_vocab = self.model.n_vocab()
+        eos_token = self.model.token_eos()
+        for i, (sequence, _, need_logits) in enumerate(entries):
+            if not need_logits:
+                continue
+            if sequence.n_past >= self.sequence_n_ctx:
+                self._finish(sequence)
+                continue
+            logits = np.ctypeslib.as_array(
+                llama_cpp.llama_get_logits_ith(self.ctx, i), shape=(n_vocab,)
+            )
+            token = sample_token(
+                logits,
+                sequence.prompt_tokens + sequence.generated_tokens,
+                sequence.params,
+                self.rng,
+            )
+            sequence.generated_tokens.append(token)
+            is_finished = (
+                token == eos_token
+                or len(sequence.generated_tokens) >= sequence.params.max_new_tokens
+                or hit_stop(self.model, sequence.generated_tokens, sequence.params.stop)
+                or (sequence.cancel_event is not None and sequence.cancel_event.is_set())
+            )
+            if is_finished:
+                self._finish(sequence)
+
+    def _fail_queued(self, error: Exception):
+        while True:
+            try:
+                sequence = self.requests.get_nowait()
+            except queue.Empty:
+                return
+            if sequence.future.set_running_or_notify_cancel():
+                sequence.future.set_exception(error)
+
+    def _loop(self):
+        try:
+            self._init_context()
+        except Exception as e:
+            logging.exception("GGUF batch engine failed to start")
+            with self.lock:
+                self.thread = None
+                self._fail_queued(e)
+            return
+        while True:
+            self._admit(block=not self.active)
+            try:
+                self._step()
+            except Exception as e:
+                logging.exception("GGUF batch engine failure")
+                for sequence in list(self.active):
+                    self._finish(sequence, e)
 
 
 def gguf_completion(
@@ -38,18 +301,41 @@ def gguf_completion(
         n_gpu_layers=model_settings.n_gpu_layers,
     )
     tokens = model.tokenize(prompt.encode("utf-8"), special=True)
+    if len(tokens) >= model_settings.n_ctx:
+        raise RequestRejected(
+            f"Prompt has {len(tokens)} tokens, but the context has only {model_settings.n_ctx} tokens"
+        )
+
+    if model_settings.n_parallel > 1:
+        engine = GGUFModels.get_engine(
+            model_settings.model_name,
+            n_parallel=model_settings.n_parallel,
+            n_ctx=model_settings.n_ctx,
+            n_gpu_layers=model_settings.n_gpu_layers,
+        )
+        future = engine.submit(tokens, model_settings.generation_params, get_cancel_event())
+        try:
+            tokens = future.result()
+        except CancelledError:
+            tokens = []
+        check_cancelled()
+        return model.detokenize(tokens).decode("utf-8", errors="ignore")
 
     params = copy.deepcopy(vars(model_settings.generation_params))
     params["temp"] = params.pop("temperature")
     params["repeat_penalty"] = params.pop("repetition_penalty")
-    params.pop("max_new_tokens")
+    max_new_tokens = params.pop("max_new_tokens")
+    stop = params.pop("stop")
 
     generator = model.generate(tokens, **params)
     tokens = []
     for token in generator:
-        tokens.append(token)
         if token == model.token_eos():
             break
+        tokens.append(token)
+        if len(tokens) >= max_new_tokens or hit_stop(model, tokens, stop) or is_cancelled():
+            break
+    check_cancelled()
     return model.detokenize(tokens).decode("utf-8", errors="ignore")
 
 
@@ -0,0 +1,189 @@
+import copy
+import time
+import logging
+import threading
+import contextvars
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+import numpy as np
+
+from tale_studio.model_settings import ModelSettings
+from tale_studio.scheduler import RequestCancelled, cancel_scope
+
+DEFAULT_WINDOW = 200
+DEFAULT_MIN_SAMPLES = 5
+DEFAULT_BURST = 2.0
+
+
+@dataclass
+class HedgeStats:
+    requests: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+    fallbacks: int = 0
+    denied: int = 0
+
+
+class HedgeRace:
+    def __init__(self, complete: Callable[[ModelSettings], str]):
+        self.complete = complete
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.attempts: Dict[Future, Tuple[threading.Event, bool, str]] = dict()
+        self.finish_times: Dict[bool, float] = dict()
+
+    def start(self, settings: ModelSettings, is_hedge: bool) -> Future:
+        event = threading.Event()
+
+        def target():
+            with cancel_scope(event):
+                output = self.complete(settings)
+            self.finish_times[is_hedge] = time.perf_counter()
+            return output
+
+        future = self.executor.submit(contextvars.copy_context().run, target)
+        self.attempts[future] = (event, is_hedge, settings.model_name)
+        return future
+
+    def model_name(self, future: Future) -> str:
+        return self.attempts[future][2]
+
+    def stop(self):
+        for future, (event, _, _) in self.attempts.items():
+            event.set()
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+
+def get_hedge_settings(model_settings: ModelSettings) -> Optional[ModelSettings]:
+    if not model_settings.hedge_model_name:
+        return None
+    hedge_settings = copy.copy(model_settings)
+    hedge_settings.model_name = model_settings.hedge_model_name
+    if model_settings.hedge_prompt_template:
+        hedge_settings.prompt_template = model_settings.hedge_prompt_template
+    hedge_settings.hedge_model_name = ""
+    return hedge_settings
+
+
+class HedgePolicy:
+    def __init__(
+        self,
+        window: int = DEFAULT_WINDOW,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+        burst: float = DEFAULT_BURST,
+    ):
+        self.min_samples = min_samples
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets: Dict[Tuple[str, str, float], float] = defaultdict(float)
+        self.latencies: Dict[Tuple[str, str], Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+        self.stats: Dict[str, HedgeStats] = defaultdict(HedgeStats)
+
+    def record_latency(self, model_name: str, profile: str, latency: float):
+        with self.lock:
+            self.latencies[(model_name, profile)].append(latency)
+
+    def get_delay(self, model_name: str, profile: str, percentile: float, default_delay: float) -> float:
+        with self.lock:
+            latencies = list(self.latencies.get((model_name, profile), tuple()))
+        if len(latencies) < self.min_samples:
+            return default_delay
+        return float(np.percentile(latencies, percentile))
+
+    def _on_request(self, bucket: Tuple[str, str, float], profile: str, max_share: float):
+        with self.lock:
+            self.stats[profile].requests += 1
+            self.buckets[bucket] = min(self.burst, self.buckets[bucket] + max_share)
+
+    def _try_acquire(self, bucket: Tuple[str, str, float], profile: str) -> bool:
+        with self.lock:
+            if self.buckets[bucket] < 1.0:
+                self.stats[profile].denied += 1
+                return False
+            self.buckets[bucket] -= 1.0
+            self.stats[profile].hedged += 1
+            return True
+
+    def _count(self, profile: str, key: str):
+        with self.lock:
+            stats = self.stats[profile]
+            setattr(stats, key, getattr(stats, key) + 1)
+
+    def run(
+        self,
+        complete: Callable[[ModelSettings], str],
+        model_settings: ModelSettings,
+        profile: str,
+    ) -> str:
+        model_name = model_settings.model_name
+        hedge_settings = get_hedge_settings(model_settings)
+        start_time = time.perf_counter()
+        if hedge_settings is None:
+            output = complete(model_settings)
+            self.record_latency(model_name, profile, time.perf_counter() - start_time)
+            return output
+
+        max_share = model_settings.hedge_max_share
+        bucket = (model_name, hedge_settings.model_name, max_share)
+        self._on_request(bucket, profile, max(max_share, 0.0))
+        delay = self.get_delay(
+            model_name, profile, model_settings.hedge_percentile, model_settings.hedge_delay
+        )
+        race = HedgeRace(complete)
+        primary = race.start(model_settings, False)
+        try:
+            done, _ = wait([primary], timeout=delay if max_share > 0 else None)
+            if done and primary.exception() is None:
+                return primary.result()
+            if done:
+                return self._fallback(race, primary, hedge_settings, profile)
+            if not self._try_acquire(bucket, profile):
+                return primary.result()
+            logging.info(f"{model_name} is slower than {delay:.1f}s, hedging with {hedge_settings.model_name}")
+            race.start(hedge_settings, True)
+            return self._race(race, profile)
+        finally:
+            if False in race.finish_times:
+                self.record_latency(model_name, profile, race.finish_times[False] - start_time)
+            elif not primary.done():
+                self.record_latency(model_name, profile, time.perf_counter() - start_time)
+            race.stop()
+
+    def _fallback(self, race: "HedgeRace", primary, hedge_settings: ModelSettings, profile: str) -> str:
+        logging.warning(
+            f"{race.model_name(primary)} failed: {primary.exception()}, falling back to {hedge_settings.model_name}"
+        )
+        self._count(profile, "fallbacks")
+        return race.start(hedge_settings, True).result()
+
+    def _race(self, race: "HedgeRace", profile: str) -> str:
+        pending, error = set(race.attempts), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if race.attempts[future][1]:
+                        self._count(profile, "hedge_wins")
+                    return future.result()
+                if not isinstance(future.exception(), RequestCancelled):
+                    error = future.exception()
+        raise error or RequestCancelled()
+
+    def format_stats(self) -> str:
+        with self.lock:
+            lines = [
+                "| Prompt | Requests | Hedged | Hedge wins | Fallbacks | Denied by cap |",
+                "|---|---|---|---|---|---|",
+            ]
+            for profile, stats in sorted(self.stats.items()):
+                lines.append(
+                    f"| {profile} | {stats.requests} | {stats.hedged} | {stats.hedge_wins} "
+                    f"| {stats.fallbacks} | {stats.denied} |"
+                )
+        return "\n".join(lines)
+
+
+HEDGING = HedgePolicy()
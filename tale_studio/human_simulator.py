@@ -6,12 +6,13 @@ from tale_studio.model_settings import ModelSettings
 
 
 class Human:
-    def __init__(self, model_settings: ModelSettings):
+    def __init__(self, model_settings: ModelSettings, fused: bool = False):
         self.model_settings = model_settings
+        self.fused = fused
 
     def select_plan(self, state: State):
         prompt = encode_prompt(
-            "human_select.jinja",
+            "human_select",
             previous_paragraph=state.paragraphs[-2],
             memory=state.short_memory,
             writer_new_paragraph=state.paragraphs[-1],
@@ -20,7 +21,7 @@ class Human:
         print("HUMAN SELECT")
         print(prompt)
         print()
-        output = self._complete(prompt)
+        output = self._complete(prompt, "human_select")
         print("HUMAN SELECT RESPONSE")
         print(json.dumps(output, ensure_ascii=False, indent=4))
         print("==========")
@@ -28,9 +29,12 @@ class Human:
         return output["selected_plan"]
 
     def step(self, state: State):
+        if self.fused:
+            return self.fused_step(state)
+
         state.instruction = self.select_plan(state)
         prompt = encode_prompt(
-            "human_write.jinja",
+            "human_write",
             previous_paragraph=state.paragraphs[-2],
             memory=state.short_memory,
             writer_new_paragraph=state.paragraphs[-1],
@@ -39,18 +43,37 @@ class Human:
         print("HUMAN STEP")
         print(prompt)
         print()
-        output = self._complete(prompt)
+        output = self._complete(prompt, "human_write")
         print("HUMAN STEP RESPONSE")
         print(json.dumps(output, ensure_ascii=False, indent=4))
         print("==========")
+        return self._apply_output(state, output)
+
+    def fused_step(self, state: State):
+        prompt = encode_prompt(
+            "human_fused",
+            previous_paragraph=state.paragraphs[-2],
+            memory=state.short_memory,
+            writer_new_paragraph=state.paragraphs[-1],
+            previous_plans=state.next_instructions,
+        )
+        print("HUMAN FUSED STEP")
+        print(prompt)
+        print()
+        output = self._complete(prompt, "human_fused")
+        print("HUMAN FUSED STEP RESPONSE")
+        print(json.dumps(output, ensure_ascii=False, indent=4))
+        print("==========")
+        return self._apply_output(state, output)
 
+    def _apply_output(self, state: State, output):
         extended_paragraph = output["extended_paragraph"]
         extended_paragraph = " ".join([p for p in extended_paragraph.split("\n") if p])
         extended_paragraph = extended_paragraph.strip()
 
-        state.paragraphs = state.paragraphs[:-1] + [extended_paragraph]
+        state.paragraphs[-1] = extended_paragraph
         state.instruction = output["revised_plan"]
         return state
 
-    def _complete(self, prompt):
-        return novel_json_completion(prompt, model_settings=self.model_settings)
+    def _complete(self, prompt, profile):
+        return novel_json_completion(prompt, model_settings=self.model_settings, profile=profile)
@@ -0,0 +1,286 @@
+import json
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import List, Dict, Tuple
+
+from tale_studio.model_settings import ModelSettings
+from tale_studio.prompt_templates import format_template
+from tale_studio.scheduler import SCHEDULER, RequestRejected, check_cancelled, hash_key
+from tale_studio.usage import USAGE
+from tale_studio.single_flight import SingleFlightCache
+
+LOCAL_MODEL_PREFIX = "local:"
+BALANCING_STRATEGIES = ("least_loaded", "round_robin")
+LOCAL_API_LIST = ("chat", "completions")
+DEFAULT_TIMEOUT = 600
+FAILURE_COOLDOWN = 30
+RETRYABLE_STATUS_CODES = (408, 429)
+MODEL_LIST_TTL = 60
+POOL_IDLE_TTL = 600
+MAX_POOLS = 8
+
+LOCAL_MODEL_LISTS = SingleFlightCache("local model lists", ttl=MODEL_LIST_TTL)
+
+
+def parse_base_urls(base_urls: str) -> Tuple[str, ...]:
+    urls = [u.strip().rstrip("/") for u in base_urls.replace("\n", ",").split(",")]
+    return tuple(u for u in urls if u)
+
+
+def get_pool_backend_key(base_urls: Tuple[str, ...]) -> str:
+    return f"local:{hash_key(','.join(base_urls))}"
+
+
+def get_local_backend_key(model_settings: ModelSettings) -> str:
+    return get_pool_backend_key(parse_base_urls(model_settings.local_base_urls))
+
+
+@dataclass
+class Endpoint:
+    base_url: str
+    session: object
+    in_flight: int = 0
+    served: int = 0
+    errors: int = 0
+    retry_after: float = 0.0
+
+
+class LocalServerPool:
+    def __init__(
+        self,
+        base_urls: Tuple[str, ...],
+        max_concurrency: int = 4,
+        balancing: str = "least_loaded",
+    ):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        assert base_urls, "No local server URLs"
+        assert balancing in BALANCING_STRATEGIES
+        self.base_urls = base_urls
+        self.max_concurrency = max_concurrency
+        self.balancing = balancing
+        self.last_used = time.monotonic()
+        self.closed = False
+        self.condition = threading.Condition()
+        self.next_index = 0
+        self.endpoints: List[Endpoint] = []
+        for base_url in base_urls:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.endpoints.append(Endpoint(base_url=base_url, session=session))
+
+    def _pick(self, excluded) -> Endpoint:
+        now = time.monotonic()
+        candidates = [(i, e) for i, e in enumerate(self.endpoints) if e.base_url not in excluded]
+        healthy = [c for c in candidates if c[1].retry_after <= now]
+        candidates = [c for c in (healthy or candidates) if c[1].in_flight < self.max_concurrency]
+        if not candidates:
+            return None
+        if self.balancing == "round_robin":
+            n = len(self.endpoints)
+            candidates.sort(key=lambda c: (c[0] - self.next_index) % n)
+        else:
+            candidates.sort(key=lambda c: (c[1].in_flight, (c[0] - self.next_index) % len(self.endpoints)))
+        index, endpoint = candidates[0]
+        self.next_index = (index + 1) % len(self.endpoints)
+        return endpoint
+
+    def acquire(self, excluded=frozenset()) -> Endpoint:
+        with self.condition:
+            while True:
+                if len(excluded) >= len(self.endpoints):
+                    raise RuntimeError("All local servers failed")
+                endpoint = self._pick(excluded)
+                if endpoint is not None:
+                    endpoint.in_flight += 1
+                    return endpoint
+                self.condition.wait()
+
+    def release(self, endpoint: Endpoint, failed: bool = False):
+        with self.condition:
+            endpoint.in_flight -= 1
+            if failed:
+                endpoint.errors += 1
+                endpoint.retry_after = time.monotonic() + FAILURE_COOLDOWN
+            else:
+                endpoint.served += 1
+            self.condition.notify_all()
+            if self.closed and not any(e.in_flight for e in self.endpoints):
+                self._close_sessions()
+
+    def configure(self, max_concurrency: int, balancing: str) -> bool:
+        assert balancing in BALANCING_STRATEGIES
+        with self.condition:
+            changed = (self.max_concurrency, self.balancing) != (max_concurrency, balancing)
+            self.max_concurrency = max_concurrency
+            self.balancing = balancing
+            self.condition.notify_all()
+            return changed
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            if not any(e.in_flight for e in self.endpoints):
+                self._close_sessions()
+
+    def _close_sessions(self):
+        for endpoint in self.endpoints:
+            endpoint.session.close()
+
+    def post(self, path: str, data: Dict, stream: bool = True) -> str:
+        import requests
+
+        excluded = set()
+        while True:
+            endpoint = self.acquire(excluded)
+            try:
+                output = self._post(endpoint, path, data, stream)
+            except requests.HTTPError as e:
+                status = e.response.status_code
+                if status < 500 and status not in RETRYABLE_STATUS_CODES:
+                    self.release(endpoint)
+                    raise RequestRejected(f"Local server {endpoint.base_url} rejected the request: {e}") from e
+                self._fail(endpoint, e, excluded)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                self._fail(endpoint, e, excluded)
+            except BaseException:
+                self.release(endpoint)
+                raise
+            else:
+                self.release(endpoint)
+                return output
+
+    def _fail(self, endpoint: Endpoint, error: Exception, excluded: set):
+        self.release(endpoint, failed=True)
+        logging.warning(f"Local server {endpoint.base_url} failed: {error}")
+        excluded.add(endpoint.base_url)
+
+    def _post(self, endpoint: Endpoint, path: str, data: Dict, stream: bool) -> str:
+        url = endpoint.base_url + path
+        data = {**data, "stream": stream}
+        if stream:
+            data["stream_options"] = {"include_usage": True}
+        with endpoint.session.post(url, json=data, stream=stream, timeout=DEFAULT_TIMEOUT) as response:
+            response.raise_for_status()
+            if not stream:
+                record = response.json()
+                record_usage(record.get("usage"))
+                return extract_text(record["choices"][0])
+            parts = []
+            for line in response.iter_lines(decode_unicode=True):
+                check_cancelled()
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                chunk = json.loads(payload)
+                record_usage(chunk.get("usage"))
+                if chunk.get("choices"):
+                    parts.append(extract_text(chunk["choices"][0]))
+            return "".join(parts)
+
+    def list_models(self) -> Tuple[str, ...]:
+        models = []
+        for endpoint in self.endpoints:
+            try:
+                response = endpoint.session.get(endpoint.base_url + "/models", timeout=10)
+                response.raise_for_status()
+                models.extend(m["id"] for m in response.json()["data"])
+            except Exception as e:
+                logging.warning(f"Can't list models of {endpoint.base_url}: {e}")
+        return tuple(dict.fromkeys(models))
+
+
+def record_usage(usage: Dict):
+    if not usage:
+        return
+    details = usage.get("prompt_tokens_details") or dict()
+    USAGE.record(
+        "local",
+        prompt_tokens=usage.get("prompt_tokens") or 0,
+        cached_tokens=details.get("cached_tokens") or 0,
+        completion_tokens=usage.get("completion_tokens") or 0,
+    )
+
+
+def extract_text(choice: Dict) -> str:
+    if "delta" in choice:
+        return choice["delta"].get("content") or ""
+    if "message" in choice:
+        return choice["message"].get("content") or ""
+    return choice.get("text") or ""
+
+
+class LocalServerPools:
+    pools: Dict[Tuple[str, ...], LocalServerPool] = dict()
+    lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls, model_settings: ModelSettings) -> LocalServerPool:
+        base_urls = parse_base_urls(model_settings.local_base_urls)
+        max_concurrency = model_settings.local_max_concurrency
+        balancing = model_settings.local_balancing
+        with cls.lock:
+            cls._evict_idle(exclude=base_urls)
+            pool = cls.pools.get(base_urls)
+            if pool is None:
+                pool = LocalServerPool(base_urls, max_concurrency=max_concurrency, balancing=balancing)
+                cls.pools[base_urls] = pool
+                SCHEDULER.set_limit(get_pool_backend_key(base_urls), max_concurrency * len(base_urls))
+            elif pool.configure(max_concurrency, balancing):
+                SCHEDULER.set_limit(get_pool_backend_key(base_urls), max_concurrency * len(base_urls))
+            pool.last_used = time.monotonic()
+            return pool
+
+    @classmethod
+    def _close(cls, base_urls: Tuple[str, ...]):
+        cls.pools.pop(base_urls).close()
+
+    @classmethod
+    def _evict_idle(cls, exclude: Tuple[str, ...]):
+        now = time.monotonic()
+        by_age = sorted(cls.pools.items(), key=lambda item: item[1].last_used)
+        for i, (base_urls, pool) in enumerate(by_age):
+            if base_urls == exclude or any(e.in_flight for e in pool.endpoints):
+                continue
+            if now - pool.last_used > POOL_IDLE_TTL or len(by_age) - i > MAX_POOLS:
+                cls._close(base_urls)
+
+
+def local_completion(
+    messages: List[Dict[str, str]],
+    model_settings: ModelSettings,
+):
+    pool = LocalServerPools.get_pool(model_settings)
+    params = model_settings.generation_params
+    data = {
+        "model": model_settings.model_name[len(LOCAL_MODEL_PREFIX):],
+        "max_tokens": params.max_new_tokens,
+        "temperature": params.temperature,
+        "top_p": params.top_p,
+        "top_k": params.top_k,
+        "repetition_penalty": params.repetition_penalty,
+    }
+    if params.stop:
+        data["stop"] = list(params.stop)
+    if model_settings.seed >= 0:
+        data["seed"] = model_settings.seed
+    if model_settings.local_api == "completions":
+        data["prompt"] = format_template(messages, model_settings.prompt_template)
+        return pool.post("/completions", data, stream=model_settings.local_stream)
+    data["messages"] = messages
+    return pool.post("/chat/completions", data, stream=model_settings.local_stream)
+
+
+def local_list_models(model_settings: ModelSettings) -> Tuple[str, ...]:
+    if not parse_base_urls(model_settings.local_base_urls):
+        return tuple()
+    pool = LocalServerPools.get_pool(model_settings)
+    models = LOCAL_MODEL_LISTS.get(model_settings.local_base_urls, pool.list_models)
+    return tuple(LOCAL_MODEL_PREFIX + m for m in models)
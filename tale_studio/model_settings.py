@@ -1,4 +1,5 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields, asdict
+from typing import Tuple
 
 from tale_studio.files import LOCAL_MODELS_LIST
 
@@ -13,15 +14,50 @@ class GenerationParams:
     top_p: float = 0.9
     top_k: int = 30
     max_new_tokens: int = 4096
+    stop: Tuple[str, ...] = tuple()
 
 
 @dataclass
 class ModelSettings:
     model_name: str = DEFAULT_MODEL_NAME
     embedder_name: str = DEFAULT_EMBEDDER_NAME
+    embedder_device: str = ""
+    embedder_batch_size: int = 32
+    embedder_service_url: str = ""
     prompt_template: str = "chatml"
     openai_api_key: str = ""
     anthropic_api_key: str = ""
     generation_params: GenerationParams = field(default_factory=GenerationParams)
     n_ctx: int = 16384
+    api_context_size: int = 0
     n_gpu_layers: int = -1
+    n_parallel: int = 1
+    pipelined_step: bool = False
+    reconcile_instructions: bool = False
+    retrieval_mode: str = "flat"
+    l1_segment_size: int = 8
+    l2_group_size: int = 4
+    seed: int = 42
+    tgi_url: str = "http://127.0.0.1:8000/generate"
+    local_base_urls: str = ""
+    local_api: str = "chat"
+    local_balancing: str = "least_loaded"
+    local_max_concurrency: int = 4
+    local_stream: bool = True
+    hedge_model_name: str = ""
+    hedge_prompt_template: str = ""
+    hedge_percentile: float = 95.0
+    hedge_delay: float = 30.0
+    hedge_max_share: float = 0.1
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, d):
+        known = {f.name for f in fields(cls)}
+        d = {key: value for key, value in d.items() if key in known}
+        params = dict(d.get("generation_params", {}))
+        params["stop"] = tuple(params.get("stop", tuple()))
+        d["generation_params"] = GenerationParams(**params)
+        return cls(**d)
@@ -1,13 +1,13 @@
 import copy
 import logging
-import time
 import os
 from dataclasses import dataclass
 from typing import Optional, Sequence
 from multiprocessing.pool import ThreadPool
 
-from tiktoken import encoding_for_model
-from openai import OpenAI, APIError
+from tale_studio.usage import USAGE
+from tale_studio.scheduler import check_cancelled, cancellable_sleep
+from tale_studio.single_flight import SingleFlightCache
 
 
 @dataclass
@@ -25,6 +25,10 @@ class OpenAIDecodingArguments:
 DEFAULT_ARGS = OpenAIDecodingArguments()
 DEFAULT_MODEL = "gpt-4o-mini"
 DEFAULT_SLEEP_TIME = 20
+MODEL_LIST_TTL = 600
+
+OPENAI_MODEL_LISTS = SingleFlightCache("openai model lists", ttl=MODEL_LIST_TTL)
+OPENAI_TOKENIZERS = SingleFlightCache("openai tokenizers")
 
 
 def openai_completion(
@@ -34,9 +38,12 @@ def openai_completion(
     sleep_time: int = DEFAULT_SLEEP_TIME,
     api_key: Optional[str] = None,
 ):
+    from openai import OpenAI, APIError
+
     decoding_args = copy.deepcopy(decoding_args)
     assert decoding_args.n == 1
     while True:
+        check_cancelled()
         try:
             client = OpenAI(api_key=api_key) if api_key else OpenAI()
             completions = client.chat.completions.create(
@@ -52,10 +59,23 @@ def openai_completion(
                 )
             else:
                 logging.warning("Hit request rate limit; retrying...")
-                time.sleep(sleep_time)
+                cancellable_sleep(sleep_time)
+    record_usage(completions.usage)
     return completions.choices[0].message.content
 
 
+def record_usage(usage, backend: str = "openai"):
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    USAGE.record(
+        backend,
+        prompt_tokens=usage.prompt_tokens or 0,
+        cached_tokens=getattr(details, "cached_tokens", 0) or 0,
+        completion_tokens=usage.completion_tokens or 0,
+    )
+
+
 def openai_batch_completion(
     batch,
     decoding_args: OpenAIDecodingArguments = DEFAULT_ARGS,
@@ -81,7 +101,12 @@ def openai_tokenize(
     text: str,
     model_name: str,
 ):
-    encoding = encoding_for_model(model_name)
+    def load():
+        from tiktoken import encoding_for_model
+
+        return encoding_for_model(model_name)
+
+    encoding = OPENAI_TOKENIZERS.get(model_name, load)
     return encoding.encode(text)
 
 
@@ -90,8 +115,14 @@ def openai_list_models(
 ):
     if not api_key:
         return tuple()
-    client = OpenAI(api_key=api_key)
-    return tuple((m.id for m in client.models.list().data))
+
+    def load():
+        from openai import OpenAI
+
+        client = OpenAI(api_key=api_key)
+        return tuple((m.id for m in client.models.list().data))
+
+    return OPENAI_MODEL_LISTS.get(api_key, load)
 
 
 def openai_get_key(model_settings):
@@ -0,0 +1,388 @@
+import os
+import mmap
+import tempfile
+import threading
+from array import array
+from collections.abc import MutableSequence, Sequence
+from typing import Iterable, List, Optional, Tuple
+
+from tale_studio.files import CACHE_DIR_PATH
+
+PARAGRAPHS_SPILL_DIR_PATH = CACHE_DIR_PATH / "paragraphs"
+DEFAULT_MAX_HOT_BYTES = 8 * 1024 * 1024
+DEFAULT_KEEP_HOT = 64
+MAX_FROZEN_DEPTH = 8
+
+
+def encode_paragraphs(paragraphs: Iterable[str]) -> Tuple[bytes, array]:
+    encoded = [p.encode("utf-8") for p in paragraphs]
+    ends, position = array("q"), 0
+    for item in encoded:
+        position += len(item)
+        ends.append(position)
+    return b"".join(encoded), ends
+
+
+class MmapParagraphs(Sequence):
+    def __init__(self, spill_dir=PARAGRAPHS_SPILL_DIR_PATH):
+        os.makedirs(spill_dir, exist_ok=True)
+        self.file = tempfile.TemporaryFile(dir=spill_dir)
+        self.offsets = array("q", [0])
+        self.mmap: Optional[mmap.mmap] = None
+        self.lock = threading.Lock()
+
+    def append_encoded(self, data: bytes, ends: Iterable[int]) -> int:
+        with self.lock:
+            start = len(self)
+            self.file.seek(0, os.SEEK_END)
+            self.file.write(data)
+            self.file.flush()
+            base = self.offsets[-1]
+            self.offsets.extend(base + end for end in ends)
+            if not self.offsets[-1]:
+                return start
+            if self.mmap is not None:
+                self.mmap.close()
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            return start
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        with self.lock:
+            if index < 0:
+                index += len(self)
+            start, end = self.offsets[index], self.offsets[index + 1]
+            if start == end:
+                return ""
+            return self.mmap[start:end].decode("utf-8")
+
+
+class FrozenParagraphs(Sequence):
+    def __init__(self, parent: Sequence = tuple(), base: int = 0):
+        self.parent = parent
+        self.base = base
+        self.buffer = bytearray()
+        self.offsets = array("q", [0])
+        self.spilled: Optional[MmapParagraphs] = None
+        self.spilled_start = 0
+        self.lock = threading.Lock()
+
+    @property
+    def ram_bytes(self) -> int:
+        return len(self.buffer)
+
+    def try_extend(self, count: int, data: bytes, ends: Iterable[int]) -> bool:
+        with self.lock:
+            if self.spilled is not None or count != len(self):
+                return False
+            base = self.offsets[-1]
+            self.buffer += data
+            self.offsets.extend(base + end for end in ends)
+            return True
+
+    def spill(self, target: MmapParagraphs):
+        with self.lock:
+            if self.spilled is not None or len(self.offsets) == 1:
+                return
+            self.spilled_start = target.append_encoded(bytes(self.buffer), self.offsets[1:])
+            self.spilled = target
+            self.buffer = bytearray()
+
+    def _get(self, index: int) -> str:
+        with self.lock:
+            if self.spilled is not None:
+                return self.spilled[self.spilled_start + index]
+            start, end = self.offsets[index], self.offsets[index + 1]
+            return self.buffer[start:end].decode("utf-8")
+
+    def __len__(self):
+        return self.base + len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("paragraph index out of range")
+        segment = self
+        while index < segment.base:
+            segment = segment.parent
+            if not isinstance(segment, FrozenParagraphs):
+                return segment[index]
+        return segment._get(index - segment.base)
+
+
+def get_frozen_chain(cold: Sequence) -> List[FrozenParagraphs]:
+    chain = []
+    while isinstance(cold, FrozenParagraphs):
+        chain.append(cold)
+        cold = cold.parent
+    return chain
+
+
+class ParagraphView(Sequence):
+    def __init__(self, store: "ParagraphStore", start: int, stop: int):
+        self.store = store
+        self.start = start
+        self.stop = max(start, stop)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return ParagraphView(self.store, self.start + start, self.start + stop)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("paragraph index out of range")
+        return self.store[self.start + index]
+
+    def __iter__(self):
+        for i in range(self.start, self.stop):
+            yield self.store[i]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"ParagraphView({self.start}:{self.stop})"
+
+
+class ParagraphStore(MutableSequence):
+    def __init__(
+        self,
+        paragraphs: Iterable[str] = tuple(),
+        cold: Optional[Sequence] = None,
+        spill_dir=PARAGRAPHS_SPILL_DIR_PATH,
+        max_hot_bytes: int = DEFAULT_MAX_HOT_BYTES,
+        keep_hot: int = DEFAULT_KEEP_HOT,
+    ):
+        self.cold = cold if cold is not None else tuple()
+        self.cold_count = len(self.cold)
+        self.buffer = bytearray()
+        self.offsets = array("q", [0])
+        self.spill_dir = spill_dir
+        self.max_hot_bytes = max_hot_bytes
+        self.keep_hot = keep_hot
+        self.blobs: Optional[MmapParagraphs] = None
+        self.stable = 0
+        self.lock = threading.RLock()
+        self._extend_hot([p.encode("utf-8") for p in paragraphs])
+
+    def __len__(self):
+        return self.cold_count + len(self.offsets) - 1
+
+    def _normalize(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("paragraph index out of range")
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return ParagraphView(self, start, stop)
+        with self.lock:
+            index = self._normalize(index)
+            if index < self.cold_count:
+                return self.cold[index]
+            index -= self.cold_count
+            return self.buffer[self.offsets[index]: self.offsets[index + 1]].decode("utf-8")
+
+    def view(self, start: int = 0, stop: Optional[int] = None) -> ParagraphView:
+        return ParagraphView(self, start, len(self) if stop is None else stop)
+
+    def _extend_hot(self, encoded: List[bytes]):
+        for data in encoded:
+            self.buffer += data
+            self.offsets.append(len(self.buffer))
+
+    def append(self, value: str):
+        with self.lock:
+            self._extend_hot([value.encode("utf-8")])
+            self._maybe_spill()
+
+    def extend(self, values: Iterable[str]):
+        with self.lock:
+            self._extend_hot([v.encode("utf-8") for v in values])
+            self._maybe_spill()
+
+    def _thaw(self, start: int = 0):
+        encoded = [p.encode("utf-8") for p in self.cold[start:self.cold_count]]
+        hot_buffer, hot_offsets = self.buffer, self.offsets
+        self.cold_count = start
+        if not start:
+            self.cold = tuple()
+        self.buffer, self.offsets = bytearray(), array("q", [0])
+        self._extend_hot(encoded)
+        shift = len(self.buffer)
+        self.buffer += hot_buffer
+        self.offsets.extend(shift + o for o in hot_offsets[1:])
+
+    def _replace(self, start: int, stop: int, values: Iterable[str]):
+        encoded = [v.encode("utf-8") for v in values]
+        with self.lock:
+            self.stable = min(self.stable, start)
+            if start < self.cold_count:
+                self._thaw(start)
+            first, last = start - self.cold_count, stop - self.cold_count
+            begin, end = self.offsets[first], self.offsets[last]
+            data = b"".join(encoded)
+            self.buffer[begin:end] = data
+            ends = array("q")
+            position = begin
+            for item in encoded:
+                position += len(item)
+                ends.append(position)
+            delta = len(data) - (end - begin)
+            tail = array("q", (o + delta for o in self.offsets[last + 1:]))
+            self.offsets = self.offsets[:first + 1] + ends + tail
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            assert step == 1, "Extended slices are not supported"
+            self._replace(start, max(start, stop), list(value))
+            return
+        index = self._normalize(index)
+        self._replace(index, index + 1, [value])
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            assert step == 1, "Extended slices are not supported"
+            self._replace(start, max(start, stop), [])
+            return
+        index = self._normalize(index)
+        self._replace(index, index + 1, [])
+
+    def insert(self, index, value):
+        index = min(max(0, index + len(self) if index < 0 else index), len(self))
+        self._replace(index, index, [value])
+
+    def _maybe_spill(self):
+        if self.spill_dir is None or len(self.buffer) <= self.max_hot_bytes:
+            return
+        if len(self.offsets) - 1 > self.keep_hot:
+            self.spill()
+
+    def _get_blobs(self) -> MmapParagraphs:
+        if self.blobs is None:
+            self.blobs = MmapParagraphs(self.spill_dir)
+        return self.blobs
+
+    def _new_segment(self) -> FrozenParagraphs:
+        chain = get_frozen_chain(self.cold)
+        if len(chain) < MAX_FROZEN_DEPTH:
+            return FrozenParagraphs(self.cold, self.cold_count)
+        merged, parent = chain[:len(chain) // 2], chain[len(chain) // 2]
+        base = min(min(segment.base for segment in merged), self.cold_count)
+        segment = FrozenParagraphs(parent, base)
+        segment.try_extend(base, *encode_paragraphs(self.cold[base:self.cold_count]))
+        return segment
+
+    def _freeze(self, count: int):
+        cut = self.offsets[count]
+        data, ends = bytes(self.buffer[:cut]), self.offsets[1:count + 1]
+        cold = self.cold
+        if not isinstance(cold, FrozenParagraphs) or not cold.try_extend(self.cold_count, data, ends):
+            cold = self._new_segment()
+            cold.try_extend(self.cold_count, data, ends)
+        self.cold, self.cold_count = cold, self.cold_count + count
+        del self.buffer[:cut]
+        self.offsets = array("q", (o - cut for o in self.offsets[count:]))
+
+    def _spill_frozen(self, force: bool = False):
+        if self.spill_dir is None:
+            return
+        chain = get_frozen_chain(self.cold)
+        if not force and sum(segment.ram_bytes for segment in chain) <= self.max_hot_bytes:
+            return
+        for segment in chain:
+            segment.spill(self._get_blobs())
+
+    def spill(self, keep_hot: Optional[int] = None):
+        keep_hot = self.keep_hot if keep_hot is None else keep_hot
+        with self.lock:
+            count = len(self.offsets) - 1 - keep_hot
+            if count <= 0:
+                return
+            self._freeze(count)
+            self._spill_frozen(force=True)
+
+    def copy(self) -> "ParagraphStore":
+        with self.lock:
+            store = ParagraphStore(
+                cold=self.cold,
+                spill_dir=self.spill_dir,
+                max_hot_bytes=self.max_hot_bytes,
+                keep_hot=self.keep_hot,
+            )
+            store.cold_count = self.cold_count
+            store.buffer = bytearray(self.buffer)
+            store.offsets = array("q", self.offsets)
+            store.blobs = self.blobs
+            store.stable = self.stable
+            return store
+
+    def freeze(self):
+        with self.lock:
+            count = len(self.offsets) - 1
+            if not count:
+                return
+            self._freeze(count)
+            self._spill_frozen()
+
+    def fork(self, count: Optional[int] = None) -> "ParagraphStore":
+        with self.lock:
+            self.freeze()
+            store = self.copy()
+            if count is not None:
+                store.cold_count = min(max(0, count), self.cold_count)
+            store.stable = store.cold_count
+            return store
+
+    def mark_stable(self):
+        with self.lock:
+            self.stable = len(self)
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __getstate__(self):
+        return {
+            "paragraphs": list(self),
+            "max_hot_bytes": self.max_hot_bytes,
+            "keep_hot": self.keep_hot,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(
+            state["paragraphs"],
+            max_hot_bytes=state["max_hot_bytes"],
+            keep_hot=state["keep_hot"],
+        )
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __repr__(self):
+        return f"ParagraphStore({len(self)} paragraphs, {self.cold_count} cold)"
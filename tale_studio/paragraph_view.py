@@ -0,0 +1,60 @@
+import difflib
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+PAGE_SIZE = 10
+PARAGRAPH_SEPARATOR = "\n\n"
+
+
+def get_page_count(num_paragraphs: int, page_size: int = PAGE_SIZE) -> int:
+    return max(1, (num_paragraphs + page_size - 1) // page_size)
+
+
+def get_page_bounds(
+    num_paragraphs: int, page: int, page_size: int = PAGE_SIZE
+) -> Tuple[int, int]:
+    page = min(max(1, int(page)), get_page_count(num_paragraphs, page_size))
+    start = (page - 1) * page_size
+    return start, min(start + page_size, num_paragraphs)
+
+
+class StalePageError(ValueError):
+    pass
+
+
+@dataclass
+class PageSnapshot:
+    page: int = 1
+    start: int = 0
+    paragraphs: List[str] = field(default_factory=list)
+
+
+def snapshot_page(paragraphs: List[str], page: int, page_size: int = PAGE_SIZE) -> PageSnapshot:
+    start, end = get_page_bounds(len(paragraphs), page, page_size)
+    page = start // page_size + 1
+    return PageSnapshot(page=page, start=start, paragraphs=list(paragraphs[start:end]))
+
+
+def render_page(paragraphs: List[str], page: int, page_size: int = PAGE_SIZE) -> str:
+    start, end = get_page_bounds(len(paragraphs), page, page_size)
+    return PARAGRAPH_SEPARATOR.join(paragraphs[start:end])
+
+
+def split_paragraphs(text: str) -> List[str]:
+    return [p.strip() for p in text.split(PARAGRAPH_SEPARATOR) if p.strip()]
+
+
+def apply_page_edit(
+    paragraphs: List[str], snapshot: PageSnapshot, page: int, text: str
+) -> int:
+    start = snapshot.start
+    old_page = snapshot.paragraphs
+    if int(page) != snapshot.page or paragraphs[start:start + len(old_page)] != old_page:
+        raise StalePageError("The page has changed since it was shown")
+    new_page = split_paragraphs(text)
+    matcher = difflib.SequenceMatcher(a=old_page, b=new_page, autojunk=False)
+    opcodes = [op for op in matcher.get_opcodes() if op[0] != "equal"]
+    for _, i1, i2, j1, j2 in reversed(opcodes):
+        paragraphs[start + i1: start + i2] = new_page[j1:j2]
+    snapshot.paragraphs = new_page
+    return len(opcodes)
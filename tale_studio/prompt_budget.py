@@ -0,0 +1,94 @@
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, Sequence
+
+from tale_studio.model_settings import ModelSettings
+
+TEMPLATE_OVERHEAD_TOKENS = 32
+API_CONTEXT_SIZES = (
+    ("gpt-4o", 128000),
+    ("gpt-4.1", 1047576),
+    ("gpt-4-turbo", 128000),
+    ("gpt-4", 8192),
+    ("gpt-3.5-turbo", 16385),
+    ("o1-mini", 128000),
+    ("o1-preview", 128000),
+    ("o1", 200000),
+    ("o3", 200000),
+    ("o4", 200000),
+    ("claude", 200000),
+)
+UNKNOWN_API_MODELS = set()
+
+
+@dataclass
+class TrimRule:
+    name: str
+    separator: str = "\n"
+    from_start: bool = False
+
+
+def get_context_size(model_settings: ModelSettings, backend: str) -> int:
+    if backend in ("openai", "anthropic"):
+        if model_settings.api_context_size > 0:
+            return model_settings.api_context_size
+        model_name = model_settings.model_name
+        matches = [(len(prefix), size) for prefix, size in API_CONTEXT_SIZES if model_name.startswith(prefix)]
+        if matches:
+            return max(matches)[1]
+        if model_name not in UNKNOWN_API_MODELS:
+            UNKNOWN_API_MODELS.add(model_name)
+            logging.warning(
+                f"Unknown context size for {model_name}, using n_ctx={model_settings.n_ctx}. "
+                "Set api_context_size in the model settings to override it"
+            )
+        return model_settings.n_ctx
+    if backend == "gguf" and model_settings.n_parallel > 1:
+        return model_settings.n_ctx // model_settings.n_parallel
+    return model_settings.n_ctx
+
+
+def get_max_prompt_tokens(
+    model_settings: ModelSettings,
+    count_tokens: Callable[[str], int],
+    system_prompt: str = "",
+    backend: str = "gguf",
+):
+    max_new_tokens = model_settings.generation_params.max_new_tokens
+    reserved = max_new_tokens + count_tokens(system_prompt) + TEMPLATE_OVERHEAD_TOKENS
+    return get_context_size(model_settings, backend) - reserved
+
+
+def fit_prompt_variables(
+    render: Callable[..., str],
+    variables: Dict[str, str],
+    trim_rules: Sequence[TrimRule],
+    max_prompt_tokens: int,
+    count_tokens: Callable[[str], int],
+):
+    variables = dict(variables)
+    prompt_tokens = count_tokens(render(**variables))
+    for rule in trim_rules:
+        if prompt_tokens <= max_prompt_tokens:
+            break
+        logging.info(f"Prompt overflow, trimming {rule.name}")
+        units = [u for u in variables[rule.name].split(rule.separator) if u.strip()]
+        if rule.from_start:
+            units = units[::-1]
+        unit_tokens = [count_tokens(u) for u in units]
+        while units and prompt_tokens > max_prompt_tokens:
+            overflow = prompt_tokens - max_prompt_tokens
+            removed_tokens = 0
+            while units and removed_tokens < overflow:
+                units.pop()
+                removed_tokens += unit_tokens.pop()
+            kept_units = units[::-1] if rule.from_start else units
+            variables[rule.name] = rule.separator.join(kept_units)
+            prompt_tokens = count_tokens(render(**variables))
+
+    if prompt_tokens > max_prompt_tokens:
+        raise ValueError(
+            f"Prompt does not fit into the context window: "
+            f"{prompt_tokens} > {max_prompt_tokens} tokens"
+        )
+    return variables
@@ -1,53 +1,163 @@
 import json
-
-import torch
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 from tale_studio.state import State
 from tale_studio.embedders import EmbeddersStorage
 from tale_studio.utils import (
     novel_json_completion,
     encode_prompt,
-    cos_sim,
     novel_completion,
+    get_token_counter,
+    get_backend,
+    DEFAULT_SYSTEM_PROMPT,
+)
+from tale_studio.retrieval import (
+    HierarchicalRetriever,
+    cosine_scores,
+    format_long_memory,
+    get_segments,
+    reciprocal_rank_fusion,
+    top_k_indices,
 )
+from tale_studio.prompt_budget import (
+    TrimRule,
+    fit_prompt_variables,
+    get_max_prompt_tokens,
+)
+from tale_studio.generation_profiles import apply_profile
+
+OUTPUT_TRIM_RULES = (
+    TrimRule("input_long_term_memory"),
+    TrimRule("short_memory", separator=". ", from_start=True),
+)
+INSTRUCT_TRIM_RULES = (
+    TrimRule("short_memory", separator=". ", from_start=True),
+)
+STORY_PREFIX_TRIM_RULES = (TrimRule("outline"),)
+STORY_PREFIX_PROMPTS = ("output", "instruct")
+STORY_PREFIX_SHARE = 0.5
 
 
 class RecurrentGPT:
     def __init__(self, model_settings):
         self.model_settings = model_settings
-        self.embedder = EmbeddersStorage.get_embedder(model_settings.embedder_name)
         self.query_prefix = "query: "
         self.passage_prefix = "passage: "
+        self.story_prefix_cache = dict()
+
+    @property
+    def embedder(self):
+        return EmbeddersStorage.get_embedder(
+            self.model_settings.embedder_name,
+            device=self.model_settings.embedder_device,
+            batch_size=self.model_settings.embedder_batch_size,
+            service_url=self.model_settings.embedder_service_url,
+        )
 
     def get_relevant_long_memory(
         self, instruction, long_memory, memory_index, top_k: int = 2
     ):
-        instruction_embedding = self.embedder.encode(
-            self.query_prefix + instruction, convert_to_tensor=True
-        )
-        memory_scores = cos_sim(instruction_embedding, memory_index)[0]
-        top_k = min(top_k, len(long_memory))
-        top_k_idx = torch.topk(memory_scores, k=top_k)[1]
+        if not long_memory:
+            return ""
+        instruction_embedding = self.embedder.encode_cached(
+            [instruction], self.query_prefix
+        )[0]
+        memory_scores = cosine_scores(instruction_embedding, memory_index)
+        top_k_idx = top_k_indices(memory_scores, top_k)
         top_k_memory = [long_memory[idx] for idx in top_k_idx]
-        return "\n".join(
-            [
-                f"Related Paragraphs {i+1}: {memory}"
-                for i, memory in enumerate(top_k_memory)
-            ]
+        return format_long_memory(top_k_memory)
+
+    def retrieve_long_memory(self, state: State, top_k: int = 2):
+        mode = self.model_settings.retrieval_mode
+        if mode == "bm25":
+            state.update_lexical_index()
+            indices = state.lexical_index.search(state.instruction, top_k=top_k)
+            return format_long_memory([state.long_memory[i] for i in indices])
+        if mode == "hybrid":
+            if not state.long_memory:
+                return ""
+            state.update_lexical_index()
+            state.update_index(self.embedder, self.passage_prefix)
+            query_embedding = self.embedder.encode_cached(
+                [state.instruction], self.query_prefix
+            )[0]
+            indices = reciprocal_rank_fusion(
+                [
+                    state.lexical_index.scores(state.instruction),
+                    cosine_scores(query_embedding, state.memory_index),
+                ],
+                top_k=top_k,
+            )
+            return format_long_memory([state.long_memory[i] for i in indices])
+        if mode == "hierarchical":
+            retriever = HierarchicalRetriever(
+                self.embedder, self.query_prefix, self.passage_prefix
+            )
+            indices = retriever.retrieve(
+                state.instruction,
+                state.long_memory,
+                state.l1_summaries,
+                state.l2_summaries,
+                top_k=top_k,
+            )
+            return format_long_memory([state.long_memory[i] for i in indices])
+        state.update_index(self.embedder, self.passage_prefix)
+        return self.get_relevant_long_memory(
+            state.instruction, state.long_memory, state.memory_index, top_k=top_k
         )
 
+    def update_memory(self, state: State):
+        mode = self.model_settings.retrieval_mode
+        if mode == "hierarchical":
+            self.update_summaries(state)
+            return
+        if mode in ("bm25", "hybrid"):
+            state.update_lexical_index()
+        if mode in ("flat", "hybrid"):
+            state.update_index(self.embedder, self.passage_prefix)
+
+    def update_summaries(self, state: State):
+        segment_size = self.model_settings.l1_segment_size
+        long_memory = state.long_memory
+        chapters = get_segments(state.l1_summaries, len(long_memory))
+        covered = max([s.end for chapter in chapters for s in chapter], default=0)
+        while len(long_memory) - covered >= segment_size:
+            if chapters and len(chapters) <= len(state.l2_summaries):
+                header = f"Part {len(state.l2_summaries) + 1}"
+                state.l1_summaries.append({"chapter_header": header})
+            segment = long_memory[covered: covered + segment_size]
+            summary = self._complete_json(
+                "summarize_segment",
+                language=state.language,
+                text="\n\n".join(segment),
+                num_sentences=3,
+            )["summary"]
+            covered += segment_size
+            state.l1_summaries.append(
+                {"summary_point": summary, "paragraph_number": covered - 1}
+            )
+
+            chapters = get_segments(state.l1_summaries, len(long_memory))
+            open_chapters = chapters[len(state.l2_summaries):]
+            if open_chapters and len(open_chapters[0]) >= self.model_settings.l2_group_size:
+                chapter_summary = self._complete_json(
+                    "summarize_segment",
+                    language=state.language,
+                    text="\n".join(s.text for s in open_chapters[0]),
+                    num_sentences=5,
+                )["summary"]
+                state.l2_summaries.append(chapter_summary)
+
     def step(self, state: State):
         assert state.instruction
 
-        state.update_index(self.embedder, self.passage_prefix)
-        formatted_long_memory = self.get_relevant_long_memory(
-            state.instruction, state.long_memory, state.memory_index
-        )
+        formatted_long_memory = self.retrieve_long_memory(state)
 
         output_paragraph = self._complete_text(
             "output",
-            outline=state.outline,
-            language=state.language,
+            trim_rules=OUTPUT_TRIM_RULES,
+            **self._story_variables(state),
             short_memory=state.short_memory,
             input_paragraph=state.paragraphs[-1],
             input_instruction=state.instruction,
@@ -57,32 +167,57 @@ class RecurrentGPT:
             [p.strip() for p in output_paragraph.split("\n") if p.strip()]
         )
         state.paragraphs.append(output_paragraph)
-        state.update_index(self.embedder, self.passage_prefix)
 
-        state.short_memory = self._complete_json(
+        if self.model_settings.pipelined_step:
+            return self._finish_step_pipelined(state)
+
+        self.update_memory(state)
+        state.short_memory = self.summarize(state)
+        state = self.generate_instructions(state)
+        return state
+
+    def _finish_step_pipelined(self, state: State):
+        def submit(pool, fn, *args):
+            return pool.submit(contextvars.copy_context().run, fn, *args)
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            index_future = submit(pool, self.update_memory, state)
+            memory_future = submit(pool, self.summarize, state)
+            instructions_future = submit(pool, self.predict_instructions, state)
+            short_memory = memory_future.result()
+            next_instructions = instructions_future.result()
+            index_future.result()
+
+        state.short_memory = short_memory
+        state.next_instructions = next_instructions
+        if self.model_settings.reconcile_instructions:
+            state = self.generate_instructions(state)
+        return state
+
+    def summarize(self, state: State):
+        return self._complete_json(
             "summarize",
             language=state.language,
             short_memory=state.short_memory,
             input_paragraph=state.paragraphs[-2],
         )["updated_memory"]
 
-        state = self.generate_instructions(state)
-        return state
-
-    def generate_instructions(self, state: State):
+    def predict_instructions(self, state: State):
         output = self._complete_json(
             "instruct",
-            language=state.language,
+            trim_rules=INSTRUCT_TRIM_RULES,
+            **self._story_variables(state),
             short_memory=state.short_memory,
             output_paragraph=state.paragraphs[-1],
-            outline=state.outline,
         )
-        state.next_instructions = [
+        return [
             output["instruction_1"].strip(),
             output["instruction_2"].strip(),
             output["instruction_3"].strip(),
         ]
 
+    def generate_instructions(self, state: State):
+        state.next_instructions = self.predict_instructions(state)
         return state
 
     def generate_name(self, state: State):
@@ -160,23 +295,77 @@ class RecurrentGPT:
         ]
         return state
 
-    def _complete_json(self, prompt_name, **kwargs):
+    def _story_variables(self, state: State):
+        variables = dict(
+            name=state.name,
+            novel_type=state.novel_type,
+            synopsis=state.synopsis,
+            outline=state.outline,
+            language=state.language,
+        )
+        key = tuple(variables.values())
+        if key not in self.story_prefix_cache:
+            backend = get_backend(self.model_settings)
+            count_tokens = get_token_counter(self.model_settings, backend)
+            max_prompt_tokens = min(
+                get_max_prompt_tokens(
+                    apply_profile(self.model_settings, prompt_name), count_tokens, DEFAULT_SYSTEM_PROMPT, backend
+                )
+                for prompt_name in STORY_PREFIX_PROMPTS
+            )
+            self.story_prefix_cache[key] = fit_prompt_variables(
+                render=lambda **v: encode_prompt("story_prefix", **v),
+                variables=variables,
+                trim_rules=STORY_PREFIX_TRIM_RULES,
+                max_prompt_tokens=int(max_prompt_tokens * STORY_PREFIX_SHARE),
+                count_tokens=count_tokens,
+            )
+        return dict(self.story_prefix_cache[key])
+
+    def _render(self, prompt_name, **kwargs):
         prompt = encode_prompt(prompt_name, **kwargs)
+        if prompt_name not in STORY_PREFIX_PROMPTS:
+            return "", prompt
+        return encode_prompt("story_prefix", **kwargs), prompt
+
+    def _fit_prompt(self, prompt_name, trim_rules, **kwargs):
+        if not trim_rules:
+            return kwargs
+        backend = get_backend(self.model_settings)
+        count_tokens = get_token_counter(self.model_settings, backend)
+        return fit_prompt_variables(
+            render=lambda **variables: "\n\n".join(self._render(prompt_name, **variables)),
+            variables=kwargs,
+            trim_rules=trim_rules,
+            max_prompt_tokens=get_max_prompt_tokens(
+                apply_profile(self.model_settings, prompt_name), count_tokens, DEFAULT_SYSTEM_PROMPT, backend
+            ),
+            count_tokens=count_tokens,
+        )
+
+    def _complete_json(self, prompt_name, trim_rules=tuple(), **kwargs):
+        kwargs = self._fit_prompt(prompt_name, trim_rules, **kwargs)
+        prefix, prompt = self._render(prompt_name, **kwargs)
         print(f"{prompt_name.upper()} PROMPT")
         print(prompt)
         print()
-        result = novel_json_completion(prompt, model_settings=self.model_settings)
+        result = novel_json_completion(
+            prompt, model_settings=self.model_settings, prefix=prefix, profile=prompt_name
+        )
         print(f"{prompt_name.upper()} OUTPUT")
         print(json.dumps(result, ensure_ascii=False, indent=4))
         print("===========")
         return result
 
-    def _complete_text(self, prompt_name, **kwargs):
-        prompt = encode_prompt(prompt_name, **kwargs)
+    def _complete_text(self, prompt_name, trim_rules=tuple(), **kwargs):
+        kwargs = self._fit_prompt(prompt_name, trim_rules, **kwargs)
+        prefix, prompt = self._render(prompt_name, **kwargs)
         print(f"{prompt_name.upper()} PROMPT")
         print(prompt)
         print()
-        result = novel_completion(prompt, model_settings=self.model_settings)
+        result = novel_completion(
+            prompt, model_settings=self.model_settings, prefix=prefix, profile=prompt_name
+        )
         print(f"{prompt_name.upper()} OUTPUT")
         print(result)
         print("===========")
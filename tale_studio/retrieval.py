@@ -0,0 +1,225 @@
+import re
+import math
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+RETRIEVAL_MODES = ("flat", "hierarchical", "bm25", "hybrid")
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+RRF_K = 60
+MEMORY_INDEX_DTYPE = np.float16
+SCORE_CHUNK_SIZE = 1024
+
+
+@dataclass
+class Segment:
+    text: str
+    start: int
+    end: int
+
+
+def get_segments(l1_summaries: Sequence[dict], paragraphs_count: int) -> List[List[Segment]]:
+    chapters = [[]]
+    points = []
+    window_start, window_end = 0, -1
+
+    def flush():
+        if points:
+            chapters[-1].append(Segment(" ".join(points), window_start, window_end + 1))
+            points.clear()
+
+    for s in l1_summaries:
+        if "chapter_header" in s:
+            flush()
+            chapters.append([])
+            continue
+        if "summary_point" not in s:
+            continue
+        pnum = min(s.get("paragraph_number", window_end), paragraphs_count - 1)
+        if pnum != window_end:
+            flush()
+            window_start, window_end = window_end + 1, pnum
+        points.append(s["summary_point"])
+    flush()
+    return [c for c in chapters if c]
+
+
+def format_long_memory(memories: Sequence[str]) -> str:
+    return "\n".join(
+        [f"Related Paragraphs {i+1}: {memory}" for i, memory in enumerate(memories)]
+    )
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> List[int]:
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))
+    return [int(i) for i in candidates[order]]
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def build_memory_index(embeddings: np.ndarray) -> np.ndarray:
+    if not embeddings.size:
+        return np.zeros((0, 0), dtype=MEMORY_INDEX_DTYPE)
+    return normalize_rows(embeddings).astype(MEMORY_INDEX_DTYPE)
+
+
+def cosine_scores(query: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    if not len(vectors):
+        return np.zeros(0, dtype=np.float32)
+    query = normalize_rows(np.asarray(query).reshape(1, -1))[0]
+    if vectors.dtype != MEMORY_INDEX_DTYPE:
+        return normalize_rows(vectors) @ query
+
+    # Memory indices are stored normalized, upcast them chunk by chunk for BLAS
+    scores = np.empty(len(vectors), dtype=np.float32)
+    chunk = np.empty((min(SCORE_CHUNK_SIZE, len(vectors)), vectors.shape[1]), dtype=np.float32)
+    for start in range(0, len(vectors), SCORE_CHUNK_SIZE):
+        end = min(start + SCORE_CHUNK_SIZE, len(vectors))
+        chunk[:end - start] = vectors[start:end]
+        np.matmul(chunk[:end - start], query, out=scores[start:end])
+    return scores
+
+
+class HierarchicalRetriever:
+    def __init__(
+        self,
+        embedder,
+        query_prefix: str = "query: ",
+        passage_prefix: str = "passage: ",
+        top_chapters: int = 2,
+        top_segments: int = 3,
+    ):
+        self.embedder = embedder
+        self.query_prefix = query_prefix
+        self.passage_prefix = passage_prefix
+        self.top_chapters = top_chapters
+        self.top_segments = top_segments
+
+    def _search(self, query_embedding, texts, k):
+        if not texts:
+            return []
+        vectors = self.embedder.encode_cached(texts, self.passage_prefix)
+        return top_k_indices(cosine_scores(query_embedding, vectors), k)
+
+    def retrieve(
+        self,
+        query: str,
+        long_memory: Sequence[str],
+        l1_summaries: Sequence[dict],
+        l2_summaries: Sequence[str],
+        top_k: int = 2,
+    ) -> List[int]:
+        if not long_memory:
+            return []
+        query_embedding = self.embedder.encode_cached([query], self.query_prefix)[0]
+        chapters = get_segments(l1_summaries, len(long_memory))
+
+        # Chapters without a summary yet are always searched
+        summarized = chapters[:len(l2_summaries)]
+        selected = chapters[len(l2_summaries):]
+        chapter_texts = [l2_summaries[i] for i in range(len(summarized))]
+        for i in self._search(query_embedding, chapter_texts, self.top_chapters):
+            selected.append(summarized[i])
+
+        segments = [s for chapter in selected for s in chapter]
+        segment_texts = [s.text for s in segments]
+        candidates = []
+        for i in self._search(query_embedding, segment_texts, self.top_segments):
+            candidates.extend(range(segments[i].start, segments[i].end))
+
+        covered = max([s.end for chapter in chapters for s in chapter], default=0)
+        candidates.extend(range(covered, len(long_memory)))
+        candidates = sorted(set(c for c in candidates if c < len(long_memory)))
+        candidate_texts = [long_memory[i] for i in candidates]
+        return [candidates[i] for i in self._search(query_embedding, candidate_texts, top_k)]
+
+
+def lexical_tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_hashes: List[int] = []
+        self.doc_lengths: List[int] = []
+        self.doc_terms: List[Counter] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = dict()
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_hashes)
+
+    def _truncate(self, size: int):
+        for doc_id in range(len(self) - 1, size - 1, -1):
+            for term in self.doc_terms[doc_id]:
+                postings = self.postings[term]
+                postings.pop()
+                if not postings:
+                    self.postings.pop(term)
+            self.total_length -= self.doc_lengths[doc_id]
+        del self.doc_hashes[size:]
+        del self.doc_lengths[size:]
+        del self.doc_terms[size:]
+
+    def update(self, texts: Sequence[str]):
+        hashes = [hash(text) for text in texts]
+        common = 0
+        for old_hash, new_hash in zip(self.doc_hashes, hashes):
+            if old_hash != new_hash:
+                break
+            common += 1
+        if common < len(self):
+            self._truncate(common)
+        for doc_id in range(common, len(texts)):
+            tokens = lexical_tokenize(texts[doc_id])
+            terms = Counter(tokens)
+            for term, tf in terms.items():
+                self.postings.setdefault(term, []).append((doc_id, tf))
+            self.doc_hashes.append(hashes[doc_id])
+            self.doc_lengths.append(len(tokens))
+            self.doc_terms.append(terms)
+            self.total_length += len(tokens)
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self), dtype=np.float32)
+        if not len(self):
+            return scores
+        avg_length = max(self.total_length / len(self), 1.0)
+        for term in set(lexical_tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1.0 + (len(self) - df + 0.5) / (df + 0.5))
+            for doc_id, tf in postings:
+                norm = 1.0 - self.b + self.b * self.doc_lengths[doc_id] / avg_length
+                scores[doc_id] += idf * tf * (self.k1 + 1.0) / (tf + self.k1 * norm)
+        return scores
+
+    def search(self, query: str, top_k: int = 2) -> List[int]:
+        scores = self.scores(query)
+        return [i for i in top_k_indices(scores, top_k) if scores[i] > 0.0]
+
+
+def reciprocal_rank_fusion(score_lists: Sequence[np.ndarray], top_k: int = 2) -> List[int]:
+    fused = np.zeros(len(score_lists[0]), dtype=np.float32)
+    for scores in score_lists:
+        ranks = np.empty(len(scores), dtype=np.int64)
+        ranks[np.argsort(-scores, kind="stable")] = np.arange(len(scores))
+        fused += 1.0 / (RRF_K + 1.0 + ranks)
+    return top_k_indices(fused, top_k)
@@ -0,0 +1,215 @@
+import struct
+import threading
+from collections.abc import MutableSequence
+from typing import Any, Dict, List, Optional
+
+from tale_studio.files import atomic_open
+
+BINARY_SAVE_EXTENSION = ".tale"
+MAGIC = b"TALE\x01"
+HEADER_LENGTH_FORMAT = "<I"
+DEFAULT_CHUNK_SIZE = 64
+DEFAULT_LAST_PARAGRAPHS = 16
+LAZY_FIELDS = ("l1_summaries", "l2_summaries")
+
+
+def is_binary_save(file_name: str) -> bool:
+    with open(file_name, "rb") as r:
+        return r.read(len(MAGIC)) == MAGIC
+
+
+def _pack(obj: Any) -> bytes:
+    import msgpack
+    import zstandard
+
+    return zstandard.ZstdCompressor().compress(msgpack.packb(obj, use_bin_type=True))
+
+
+def _unpack(data: bytes) -> Any:
+    import msgpack
+    import zstandard
+
+    return msgpack.unpackb(zstandard.ZstdDecompressor().decompress(data), raw=False)
+
+
+def write_binary_save(
+    file_name: str, record: Dict[str, Any], chunk_size: int = DEFAULT_CHUNK_SIZE
+):
+    record = dict(record)
+    paragraphs = list(record.pop("paragraphs"))
+    lazy_fields = {key: list(record.pop(key)) for key in LAZY_FIELDS}
+    record.pop("memory_index", None)
+
+    blocks = []
+    for start in range(0, len(paragraphs), chunk_size):
+        blocks.append(_pack(paragraphs[start: start + chunk_size]))
+    blocks.append(_pack(lazy_fields))
+
+    offsets = []
+    offset = 0
+    for block in blocks:
+        offsets.append((offset, len(block)))
+        offset += len(block)
+
+    header = _pack(
+        {
+            "meta": record,
+            "num_paragraphs": len(paragraphs),
+            "chunk_size": chunk_size,
+            "chunks": offsets[:-1],
+            "lazy_fields": offsets[-1],
+        }
+    )
+    with atomic_open(file_name, "wb") as w:
+        w.write(MAGIC)
+        w.write(struct.pack(HEADER_LENGTH_FORMAT, len(header)))
+        w.write(header)
+        for block in blocks:
+            w.write(block)
+
+
+class BinarySaveReader:
+    def __init__(self, file_name: str):
+        self.file = open(file_name, "rb")
+        self.lock = threading.Lock()
+        magic = self.file.read(len(MAGIC))
+        assert magic == MAGIC, f"{file_name} is not a binary save"
+        size = struct.calcsize(HEADER_LENGTH_FORMAT)
+        (header_length,) = struct.unpack(HEADER_LENGTH_FORMAT, self.file.read(size))
+        self.header = _unpack(self.file.read(header_length))
+        self.data_offset = len(MAGIC) + size + header_length
+        self.pending = set(range(len(self.header["chunks"]))) | set(LAZY_FIELDS)
+        self._close_if_done()
+
+    def read_block(self, offset: int, length: int, block_id) -> Any:
+        with self.lock:
+            self.file.seek(self.data_offset + offset)
+            data = self.file.read(length)
+            self.pending.discard(block_id)
+            self._close_if_done()
+        return _unpack(data)
+
+    def _close_if_done(self):
+        if not self.pending:
+            self.file.close()
+
+    def close(self):
+        with self.lock:
+            self.pending.clear()
+            self.file.close()
+
+    def __del__(self):
+        self.file.close()
+
+    def read_chunk(self, chunk_index: int) -> List[str]:
+        return self.read_block(*self.header["chunks"][chunk_index], chunk_index)
+
+    def read_lazy_field(self, key: str) -> List[Any]:
+        return self.read_block(*self.header["lazy_fields"], key)[key]
+
+
+class LazyParagraphs(MutableSequence):
+    def __init__(self, reader: BinarySaveReader):
+        self.reader = reader
+        self.num_paragraphs = reader.header["num_paragraphs"]
+        self.chunk_size = reader.header["chunk_size"]
+        self.chunks: Dict[int, List[str]] = dict()
+        self.items: Optional[List[str]] = None
+
+    def preload_last(self, count: int):
+        first_chunk = max(0, self.num_paragraphs - count) // self.chunk_size
+        last_chunk = (self.num_paragraphs - 1) // self.chunk_size
+        for chunk_index in range(first_chunk, last_chunk + 1):
+            self._get_chunk(chunk_index)
+
+    def _get_chunk(self, chunk_index: int) -> List[str]:
+        if chunk_index not in self.chunks:
+            self.chunks[chunk_index] = self.reader.read_chunk(chunk_index)
+        return self.chunks[chunk_index]
+
+    def _materialize(self) -> List[str]:
+        if self.items is None:
+            self.items = [self[i] for i in range(self.num_paragraphs)]
+            self.chunks = dict()
+        return self.items
+
+    def __len__(self):
+        if self.items is not None:
+            return len(self.items)
+        return self.num_paragraphs
+
+    def __getitem__(self, index):
+        if self.items is not None:
+            return self.items[index]
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += self.num_paragraphs
+        if not 0 <= index < self.num_paragraphs:
+            raise IndexError("paragraph index out of range")
+        chunk = self._get_chunk(index // self.chunk_size)
+        return chunk[index % self.chunk_size]
+
+    def __setitem__(self, index, value):
+        self._materialize()[index] = value
+
+    def __delitem__(self, index):
+        del self._materialize()[index]
+
+    def insert(self, index, value):
+        self._materialize().insert(index, value)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __repr__(self):
+        return f"LazyParagraphs({len(self)} paragraphs)"
+
+
+class LazyField(MutableSequence):
+    def __init__(self, reader: BinarySaveReader, key: str):
+        self.reader = reader
+        self.key = key
+        self.items: Optional[List[Any]] = None
+
+    def _materialize(self) -> List[Any]:
+        if self.items is None:
+            self.items = self.reader.read_lazy_field(self.key)
+        return self.items
+
+    def __len__(self):
+        return len(self._materialize())
+
+    def __getitem__(self, index):
+        return self._materialize()[index]
+
+    def __setitem__(self, index, value):
+        self._materialize()[index] = value
+
+    def __delitem__(self, index):
+        del self._materialize()[index]
+
+    def insert(self, index, value):
+        self._materialize().insert(index, value)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"LazyField({self.key})"
+
+
+def read_binary_save(
+    file_name: str, last_paragraphs: int = DEFAULT_LAST_PARAGRAPHS
+) -> Dict[str, Any]:
+    reader = BinarySaveReader(file_name)
+    paragraphs = LazyParagraphs(reader)
+    paragraphs.preload_last(last_paragraphs)
+    record = dict(reader.header["meta"])
+    record["paragraphs"] = paragraphs
+    for key in LAZY_FIELDS:
+        record[key] = LazyField(reader, key)
+    return record
@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List
+
+import fire
+
+from tale_studio.state import State
+from tale_studio.files import SAVES_DIR_PATH
+
+CATALOG_FILE_NAME = ".catalog.sqlite"
+PREVIEW_LENGTH = 200
+COLUMNS = (
+    "file_name",
+    "name",
+    "language",
+    "novel_type",
+    "paragraph_count",
+    "mtime",
+    "preview",
+)
+
+
+def make_preview(state: State) -> str:
+    text = state.synopsis
+    if not text and state.paragraphs:
+        text = state.paragraphs[0]
+    return " ".join(text.split())[:PREVIEW_LENGTH]
+
+
+class SavesCatalog:
+    def __init__(self, saves_dir: str = SAVES_DIR_PATH):
+        self.saves_dir = str(saves_dir)
+        self.db_path = os.path.join(self.saves_dir, CATALOG_FILE_NAME)
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(
+                self.db_path, check_same_thread=False, timeout=30
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS saves ("
+                "file_name TEXT PRIMARY KEY, name TEXT, language TEXT, "
+                "novel_type TEXT, paragraph_count INTEGER, mtime REAL, preview TEXT)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS saves_mtime ON saves (mtime)"
+            )
+            self.connection.commit()
+        return self.connection
+
+    def update(self, file_name: str, state: State):
+        mtime = os.path.getmtime(os.path.join(self.saves_dir, file_name))
+        row = (
+            file_name,
+            state.name,
+            state.language,
+            state.novel_type,
+            len(state.paragraphs),
+            mtime,
+            make_preview(state),
+        )
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO saves VALUES (?, ?, ?, ?, ?, ?, ?)", row
+                )
+
+    def remove(self, file_name: str):
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM saves WHERE file_name = ?", (file_name,))
+
+    def _build_filter(self, query: str, language: str, novel_type: str):
+        conditions = []
+        params: List[Any] = []
+        if query:
+            conditions.append("(name LIKE ? OR file_name LIKE ? OR preview LIKE ?)")
+            params.extend([f"%{query}%"] * 3)
+        if language:
+            conditions.append("language = ?")
+            params.append(language)
+        if novel_type:
+            conditions.append("novel_type = ?")
+            params.append(novel_type)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return where, params
+
+    def list(
+        self,
+        query: str = "",
+        language: str = "",
+        novel_type: str = "",
+        limit: int = 50,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        where, params = self._build_filter(query, language, novel_type)
+        with self.lock:
+            rows = self._connect().execute(
+                f"SELECT {', '.join(COLUMNS)} FROM saves{where} "
+                "ORDER BY mtime DESC LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def count(self, query: str = "", language: str = "", novel_type: str = "") -> int:
+        where, params = self._build_filter(query, language, novel_type)
+        with self.lock:
+            row = self._connect().execute(
+                f"SELECT COUNT(*) FROM saves{where}", params
+            ).fetchone()
+        return row[0]
+
+    def sync(self, force: bool = False):
+        with self.lock:
+            known = dict(
+                self._connect().execute("SELECT file_name, mtime FROM saves").fetchall()
+            )
+        existing = set()
+        for entry in os.scandir(self.saves_dir):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            existing.add(entry.name)
+            if not force and known.get(entry.name) == entry.stat().st_mtime:
+                continue
+            try:
+                state = State.load(entry.path)
+            except Exception as e:
+                print(f"Skipping {entry.name}: {e}")
+                continue
+            self.update(entry.name, state)
+        for file_name in set(known) - existing:
+            self.remove(file_name)
+
+
+SAVES_CATALOG = SavesCatalog()
+
+
+def list_saves(
+    query: str = "",
+    language: str = "",
+    novel_type: str = "",
+    limit: int = 50,
+    offset: int = 0,
+):
+    for row in SAVES_CATALOG.list(query, language, novel_type, limit, offset):
+        print(
+            f"{row['file_name']}\t{row['name']}\t{row['language']}\t"
+            f"{row['novel_type']}\t{row['paragraph_count']}\t{row['preview'][:60]}"
+        )
+
+
+def sync_saves(force: bool = False):
+    SAVES_CATALOG.sync(force=force)
+    print(f"{SAVES_CATALOG.count()} saves in the catalog")
+
+
+if __name__ == "__main__":
+    fire.Fire({"list": list_saves, "sync": sync_saves})
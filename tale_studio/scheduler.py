@@ -0,0 +1,231 @@
+import time
+import hashlib
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+DEFAULT_SESSION_ID = "default"
+DEFAULT_BACKEND_LIMITS = {
+    "gguf": 1,
+    "tgi": 4,
+    "openai": 8,
+    "anthropic": 8,
+}
+DEFAULT_LIMIT = 4
+CANCEL_POLL_INTERVAL = 0.5
+
+_session_id = contextvars.ContextVar("session_id", default=DEFAULT_SESSION_ID)
+_priority = contextvars.ContextVar("priority", default=PRIORITY_NORMAL)
+_cancel_event = contextvars.ContextVar("cancel_event", default=None)
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class RequestRejected(Exception):
+    pass
+
+
+@contextmanager
+def request_context(session_id: Optional[str] = None, priority: int = PRIORITY_NORMAL):
+    session_id = session_id or DEFAULT_SESSION_ID
+    with SCHEDULER.session_lock(session_id):
+        session_token = _session_id.set(session_id)
+        priority_token = _priority.set(priority)
+        try:
+            yield
+        finally:
+            _session_id.reset(session_token)
+            _priority.reset(priority_token)
+
+
+@contextmanager
+def cancel_scope(event: threading.Event):
+    token = _cancel_event.set(event)
+    try:
+        yield
+    finally:
+        _cancel_event.reset(token)
+
+
+def get_cancel_event() -> Optional[threading.Event]:
+    return _cancel_event.get()
+
+
+def is_cancelled() -> bool:
+    event = _cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def check_cancelled():
+    if is_cancelled():
+        raise RequestCancelled()
+
+
+def cancellable_sleep(seconds: float):
+    event = _cancel_event.get()
+    if event is None:
+        time.sleep(seconds)
+        return
+    event.wait(seconds)
+    check_cancelled()
+
+
+def hash_key(key: Optional[str]) -> str:
+    if not key:
+        return "env"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:8]
+
+
+@dataclass
+class Ticket:
+    priority: int
+    seq: int
+    session_id: str
+    enqueued_at: float
+
+
+@dataclass
+class BackendStats:
+    in_flight: int = 0
+    queued: int = 0
+    served: int = 0
+    total_wait_time: float = 0.0
+    max_wait_time: float = 0.0
+
+    @property
+    def mean_wait_time(self):
+        return self.total_wait_time / self.served if self.served else 0.0
+
+
+class RequestScheduler:
+    def __init__(
+        self,
+        backend_limits: Dict[str, int] = DEFAULT_BACKEND_LIMITS,
+        default_limit: int = DEFAULT_LIMIT,
+    ):
+        self.backend_limits = dict(backend_limits)
+        self.default_limit = default_limit
+        self.condition = threading.Condition()
+        self.waiting: Dict[str, List[Ticket]] = defaultdict(list)
+        self.stats: Dict[str, BackendStats] = defaultdict(BackendStats)
+        self.session_orders: Dict[str, int] = dict()
+        self.session_tickets: Dict[str, int] = defaultdict(int)
+        self.session_locks: Dict[str, threading.RLock] = dict()
+        self.session_lock_users: Dict[str, int] = defaultdict(int)
+        self.counter = itertools.count()
+
+    @contextmanager
+    def session_lock(self, session_id: str):
+        with self.condition:
+            lock = self.session_locks.setdefault(session_id, threading.RLock())
+            self.session_lock_users[session_id] += 1
+        try:
+            with lock:
+                yield
+        finally:
+            with self.condition:
+                self.session_lock_users[session_id] -= 1
+                if not self.session_lock_users[session_id]:
+                    del self.session_lock_users[session_id]
+                    del self.session_locks[session_id]
+
+    def _drop_session_ticket(self, session_id: str):
+        self.session_tickets[session_id] -= 1
+        if not self.session_tickets[session_id]:
+            del self.session_tickets[session_id]
+            self.session_orders.pop(session_id, None)
+
+    def set_limit(self, backend: str, limit: int):
+        with self.condition:
+            self.backend_limits[backend] = limit
+            self.condition.notify_all()
+
+    def get_limit(self, backend: str) -> int:
+        if backend in self.backend_limits:
+            return self.backend_limits[backend]
+        kind = backend.split(":")[0]
+        return self.backend_limits.get(kind, self.default_limit)
+
+    def _ticket_order(self, ticket: Ticket):
+        session_order = self.session_orders[ticket.session_id]
+        return (ticket.priority, session_order, ticket.seq)
+
+    def _can_start(self, backend: str, ticket: Ticket) -> bool:
+        if self.stats[backend].in_flight >= self.get_limit(backend):
+            return False
+        return min(self.waiting[backend], key=self._ticket_order) is ticket
+
+    def acquire(self, backend: str):
+        session_id = _session_id.get()
+        with self.condition:
+            ticket = Ticket(
+                priority=_priority.get(),
+                seq=next(self.counter),
+                session_id=session_id,
+                enqueued_at=time.monotonic(),
+            )
+            stats = self.stats[backend]
+            self.waiting[backend].append(ticket)
+            self.session_tickets[session_id] += 1
+            self.session_orders.setdefault(session_id, ticket.seq)
+            stats.queued += 1
+            timeout = CANCEL_POLL_INTERVAL if get_cancel_event() is not None else None
+            while not self._can_start(backend, ticket):
+                if is_cancelled():
+                    self.waiting[backend].remove(ticket)
+                    self._drop_session_ticket(session_id)
+                    stats.queued -= 1
+                    self.condition.notify_all()
+                    raise RequestCancelled()
+                self.condition.wait(timeout)
+            self.waiting[backend].remove(ticket)
+            self.session_orders[session_id] = next(self.counter)
+
+            wait_time = time.monotonic() - ticket.enqueued_at
+            stats.queued -= 1
+            stats.in_flight += 1
+            stats.served += 1
+            stats.total_wait_time += wait_time
+            stats.max_wait_time = max(stats.max_wait_time, wait_time)
+
+    def release(self, backend: str, session_id: Optional[str] = None):
+        with self.condition:
+            self.stats[backend].in_flight -= 1
+            self._drop_session_ticket(session_id or _session_id.get())
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self, backend: str):
+        session_id = _session_id.get()
+        self.acquire(backend)
+        try:
+            yield
+        finally:
+            self.release(backend, session_id)
+
+    def format_stats(self) -> str:
+        with self.condition:
+            lines = [
+                "| Backend | Limit | In flight | Queued | Served | Mean wait, s | Max wait, s |",
+                "|---|---|---|---|---|---|---|",
+            ]
+            for backend, stats in sorted(self.stats.items()):
+                lines.append(
+                    f"| {backend} | {self.get_limit(backend)} | {stats.in_flight} "
+                    f"| {stats.queued} | {stats.served} "
+                    f"| {stats.mean_wait_time:.2f} | {stats.max_wait_time:.2f} |"
+                )
+        return "\n".join(lines)
+
+
+SCHEDULER = RequestScheduler()
@@ -0,0 +1,177 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from tale_studio.state import State
+from tale_studio.autosave import AUTOSAVE
+from tale_studio.story_tree import StoryTree
+from tale_studio.paragraph_view import PageSnapshot
+from tale_studio.model_settings import ModelSettings
+from tale_studio.files import SESSIONS_DIR_PATH, atomic_open
+
+DEFAULT_MAX_IDLE_TIME = 3600
+DEFAULT_SPILL_TTL = 7 * 24 * 3600
+SPILL_EXTENSION = ".json"
+SECRET_FIELDS = ("openai_api_key", "anthropic_api_key")
+
+
+@dataclass
+class Session:
+    state: State = field(default_factory=State)
+    model_settings: ModelSettings = field(default_factory=ModelSettings)
+    tree: Optional[StoryTree] = None
+    page_snapshot: PageSnapshot = field(default_factory=PageSnapshot)
+    last_access: float = field(default_factory=time.monotonic)
+
+    def get_tree(self) -> StoryTree:
+        if self.tree is None:
+            self.tree = StoryTree(self.state)
+        return self.tree
+
+    def reset_tree(self):
+        self.tree = StoryTree(self.state)
+
+    def to_dict(self):
+        return {
+            "state": self.state.to_dict(),
+            "model_settings": self.model_settings.to_dict(),
+            "tree": self.tree.to_dict() if self.tree is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        tree = d.get("tree")
+        return cls(
+            state=State.from_dict(d["state"]),
+            model_settings=ModelSettings.from_dict(d["model_settings"]),
+            tree=StoryTree.from_dict(tree) if tree else None,
+        )
+
+
+class SessionStore:
+    def __init__(
+        self,
+        max_idle_time: float = DEFAULT_MAX_IDLE_TIME,
+        spill_dir: Optional[str] = SESSIONS_DIR_PATH,
+        spill_ttl: float = DEFAULT_SPILL_TTL,
+    ):
+        self.max_idle_time = max_idle_time
+        self.spill_dir = spill_dir
+        self.spill_ttl = spill_ttl
+        self.sessions: Dict[str, Session] = dict()
+        self.spilling: Dict[str, Dict] = dict()
+        self.last_spill_sweep = 0.0
+        self.lock = threading.Lock()
+
+    def _spill_path(self, session_id: str):
+        file_name = re.sub(r"[^A-Za-z0-9_-]", "_", session_id) + SPILL_EXTENSION
+        return os.path.join(str(self.spill_dir), file_name)
+
+    def _make_payload(self, session: Session) -> Dict:
+        payload = session.to_dict()
+        payload["model_settings"] = dict(payload["model_settings"])
+        for key in SECRET_FIELDS:
+            payload["model_settings"].pop(key, None)
+        return payload
+
+    def _spill(self, session_id: str, payload: Dict):
+        os.makedirs(str(self.spill_dir), exist_ok=True)
+        path = self._spill_path(session_id)
+        with atomic_open(path, "w") as w:
+            json.dump(payload, w, ensure_ascii=False)
+        with self.lock:
+            if self.spilling.get(session_id) is payload:
+                del self.spilling[session_id]
+                return
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _restore(self, session_id: str) -> Optional[Session]:
+        if not self.spill_dir:
+            return None
+        payload = self.spilling.pop(session_id, None)
+        if payload is not None:
+            return Session.from_dict(payload)
+        path = self._spill_path(session_id)
+        if not os.path.exists(path):
+            return None
+        with open(path) as r:
+            session = Session.from_dict(json.load(r))
+        os.remove(path)
+        return session
+
+    def get(self, session_id: str) -> Session:
+        with self.lock:
+            spills, expired = self._evict_idle(exclude=session_id)
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self._restore(session_id) or Session()
+                self.sessions[session_id] = session
+            session.last_access = time.monotonic()
+        for spilled_id, payload in spills:
+            try:
+                self._spill(spilled_id, payload)
+            except Exception:
+                logging.exception(f"Failed to spill session {spilled_id}")
+        expired.extend(self._expire_spills())
+        for expired_id in expired:
+            AUTOSAVE.remove(expired_id)
+        return session
+
+    def remove(self, session_id: str):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+            self.spilling.pop(session_id, None)
+        AUTOSAVE.remove(session_id)
+
+    def _evict_idle(self, exclude: Optional[str] = None) -> Tuple[List[Tuple[str, Dict]], List[str]]:
+        now = time.monotonic()
+        spills, expired = [], []
+        for session_id, session in list(self.sessions.items()):
+            if session_id == exclude:
+                continue
+            if now - session.last_access < self.max_idle_time:
+                continue
+            if self.spill_dir:
+                payload = self._make_payload(session)
+                self.spilling[session_id] = payload
+                spills.append((session_id, payload))
+            else:
+                expired.append(session_id)
+            del self.sessions[session_id]
+        return spills, expired
+
+    def _expire_spills(self) -> List[str]:
+        spill_dir = str(self.spill_dir) if self.spill_dir else None
+        if spill_dir is None or not os.path.isdir(spill_dir):
+            return []
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_spill_sweep < min(self.spill_ttl, self.max_idle_time):
+                return []
+            self.last_spill_sweep = now
+        expired = []
+        deadline = time.time() - self.spill_ttl
+        for file_name in os.listdir(spill_dir):
+            if not file_name.endswith(SPILL_EXTENSION):
+                continue
+            path = os.path.join(spill_dir, file_name)
+            try:
+                if os.path.getmtime(path) >= deadline:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            expired.append(file_name[:-len(SPILL_EXTENSION)])
+        return expired
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+SESSIONS = SessionStore()
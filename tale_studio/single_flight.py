@@ -0,0 +1,106 @@
+import time
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+@dataclass
+class LoadStats:
+    loads: int = 0
+    hits: int = 0
+    waits: int = 0
+    errors: int = 0
+    total_load_time: float = 0.0
+    last_load_time: float = 0.0
+
+    @property
+    def mean_load_time(self) -> float:
+        if not self.loads:
+            return 0.0
+        return self.total_load_time / self.loads
+
+
+class SingleFlightCache:
+    def __init__(self, name: str, ttl: Optional[float] = None):
+        self.name = name
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.values: Dict[Hashable, Tuple[Any, float]] = dict()
+        self.loading: Dict[Hashable, Future] = dict()
+        self.stats = LoadStats()
+        SINGLE_FLIGHT_CACHES.append(self)
+
+    def _is_fresh(self, loaded_at: float) -> bool:
+        return self.ttl is None or time.monotonic() - loaded_at < self.ttl
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        with self.lock:
+            if key in self.values:
+                value, loaded_at = self.values[key]
+                if self._is_fresh(loaded_at):
+                    self.stats.hits += 1
+                    return value
+            future = self.loading.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self.loading[key] = future
+            else:
+                self.stats.waits += 1
+
+        if not is_owner:
+            return future.result()
+
+        start_time = time.perf_counter()
+        try:
+            value = loader()
+        except BaseException as e:
+            with self.lock:
+                self.loading.pop(key, None)
+                self.stats.errors += 1
+            future.set_exception(e)
+            raise
+        load_time = time.perf_counter() - start_time
+        with self.lock:
+            self.values[key] = (value, time.monotonic())
+            self.loading.pop(key, None)
+            self.stats.loads += 1
+            self.stats.total_load_time += load_time
+            self.stats.last_load_time = load_time
+        future.set_result(value)
+        return value
+
+    def is_loading(self, key: Hashable) -> bool:
+        with self.lock:
+            return key in self.loading
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.lock:
+            return key in self.values and self._is_fresh(self.values[key][1])
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        with self.lock:
+            if key is None:
+                self.values.clear()
+            else:
+                self.values.pop(key, None)
+
+
+SINGLE_FLIGHT_CACHES: List[SingleFlightCache] = []
+
+
+def format_load_stats() -> str:
+    lines = [
+        "| Cache | Entries | Loads | Hits | Waits | Errors | Mean load, s | Last load, s |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    for cache in SINGLE_FLIGHT_CACHES:
+        with cache.lock:
+            stats = cache.stats
+            lines.append(
+                f"| {cache.name} | {len(cache.values)} | {stats.loads} | {stats.hits} "
+                f"| {stats.waits} | {stats.errors} | {stats.mean_load_time:.2f} "
+                f"| {stats.last_load_time:.2f} |"
+            )
+    return "\n".join(lines)
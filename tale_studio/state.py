@@ -1,9 +1,21 @@
+import copy
 import json
 from typing import List, Any, Optional
 
-from dataclasses import dataclass, asdict, field
+from dataclasses import dataclass, field, fields
 
-import torch
+import numpy as np
+
+from tale_studio.files import atomic_open
+from tale_studio.retrieval import BM25Index, build_memory_index
+from tale_studio.paragraph_store import ParagraphStore
+from tale_studio.save_format import (
+    BINARY_SAVE_EXTENSION,
+    LazyParagraphs,
+    is_binary_save,
+    read_binary_save,
+    write_binary_save,
+)
 
 
 @dataclass
@@ -14,38 +26,68 @@ class State:
     novel_type: str = ""
     language: str = ""
     description: str = ""
-    paragraphs: List[str] = field(default_factory=lambda: list())
+    paragraphs: ParagraphStore = field(default_factory=ParagraphStore)
     l1_summaries: List[Any] = field(default_factory=lambda: list())
     l2_summaries: List[Any] = field(default_factory=lambda: list())
     short_memory: str = ""
-    memory_index: Optional[torch.Tensor] = None
+    memory_index: Optional[np.ndarray] = None
+    lexical_index: Optional[BM25Index] = None
     instruction: str = ""
     next_instructions: List[str] = field(default_factory=lambda: list())
 
+    def __setattr__(self, name, value):
+        if name == "paragraphs" and not isinstance(value, ParagraphStore):
+            if isinstance(value, LazyParagraphs) and value.items is None:
+                value = ParagraphStore(cold=value)
+            else:
+                value = ParagraphStore(value)
+        super().__setattr__(name, value)
+
     @property
     def long_memory(self):
-        return self.paragraphs[:-1]
+        return self.paragraphs.view(0, len(self.paragraphs) - 1)
 
     def update_index(self, embedder, passage_prefix):
-        long_memory = [passage_prefix + p for p in self.long_memory]
-        self.memory_index = embedder.encode(long_memory, convert_to_tensor=True)
+        embeddings = embedder.encode_cached(self.long_memory, passage_prefix)
+        self.memory_index = build_memory_index(embeddings)
+
+    def update_lexical_index(self):
+        if self.lexical_index is None:
+            self.lexical_index = BM25Index()
+        self.lexical_index.update(self.long_memory)
+
+    def fork(self) -> "State":
+        state = copy.copy(self)
+        state.paragraphs = self.paragraphs.fork()
+        for key in ("l1_summaries", "l2_summaries", "next_instructions"):
+            setattr(state, key, list(getattr(self, key)))
+        state.memory_index = None
+        state.lexical_index = None
+        return state
 
-    def to_dict(self):
-        memory_index = self.memory_index
-        self.memory_index = None
-        result = asdict(self)
-        self.memory_index = memory_index
-        return result
+    def to_dict(self, paragraphs_start: int = 0):
+        record = {f.name: getattr(self, f.name) for f in fields(self)}
+        record.pop("lexical_index")
+        record["memory_index"] = None
+        record["paragraphs"] = record["paragraphs"][paragraphs_start:]
+        for key in ("paragraphs", "l1_summaries", "l2_summaries", "next_instructions"):
+            record[key] = list(record[key])
+        return record
 
     @classmethod
     def from_dict(cls, d):
         return cls(**d)
 
-    def save(self, file_name):
-        with open(file_name, "w") as w:
-            json.dump(self.to_dict(), w, ensure_ascii=False)
+    def save(self, file_name, indent: Optional[int] = None):
+        if str(file_name).endswith(BINARY_SAVE_EXTENSION):
+            write_binary_save(str(file_name), self.to_dict())
+            return
+        with atomic_open(file_name, "w") as w:
+            json.dump(self.to_dict(), w, ensure_ascii=False, indent=indent)
 
     @classmethod
     def load(cls, file_name):
+        if is_binary_save(file_name):
+            return cls.from_dict(read_binary_save(str(file_name)))
         with open(file_name, "r") as r:
             return cls.from_dict(json.load(r))
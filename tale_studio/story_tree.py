@@ -0,0 +1,154 @@
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from tale_studio.state import State
+
+ROOT_LABEL = "Start"
+LABEL_MAX_LENGTH = 60
+
+
+@dataclass
+class StoryNode:
+    node_id: int
+    state: State
+    parent_id: Optional[int] = None
+    label: str = ""
+    shared_paragraphs: int = 0
+    children: List[int] = field(default_factory=list)
+
+
+class StoryTree:
+    def __init__(self, state: State, label: str = ROOT_LABEL):
+        self.nodes: Dict[int, StoryNode] = dict()
+        self.next_id = 0
+        self.current_id = 0
+        self.lock = threading.RLock()
+        self._add(state.fork(), None, label)
+        state.paragraphs.mark_stable()
+
+    def _add(self, state: State, parent_id: Optional[int], label: str, shared_paragraphs: int = 0) -> StoryNode:
+        node = StoryNode(
+            node_id=self.next_id,
+            state=state,
+            parent_id=parent_id,
+            label=label,
+            shared_paragraphs=shared_paragraphs,
+        )
+        self.nodes[node.node_id] = node
+        if parent_id is not None:
+            self.nodes[parent_id].children.append(node.node_id)
+        self.next_id += 1
+        return node
+
+    @property
+    def current(self) -> StoryNode:
+        return self.nodes[self.current_id]
+
+    def commit(self, state: State, label: str = "", parent_id: Optional[int] = None) -> StoryNode:
+        with self.lock:
+            if parent_id not in self.nodes:
+                parent_id = self.current_id
+            shared = min(state.paragraphs.stable, len(self.nodes[parent_id].state.paragraphs))
+            node = self._add(state.fork(), parent_id, label, shared)
+            state.paragraphs.mark_stable()
+            self.current_id = node.node_id
+            return node
+
+    def checkout(self, node_id: int, previous: Optional[State] = None) -> State:
+        with self.lock:
+            if node_id not in self.nodes:
+                raise KeyError(f"No story node {node_id}")
+            self.current_id = node_id
+            state = self.nodes[node_id].state.fork()
+        if previous is not None:
+            state.lexical_index = previous.lexical_index
+        return state
+
+    def undo(self, previous: Optional[State] = None) -> State:
+        with self.lock:
+            parent_id = self.current.parent_id
+            return self.checkout(self.current_id if parent_id is None else parent_id, previous)
+
+    def prune(self, node_id: int, previous: Optional[State] = None) -> Optional[State]:
+        with self.lock:
+            node = self.nodes[node_id]
+            if node.parent_id is None:
+                raise ValueError("The root node can not be pruned")
+            subtree = self.get_subtree(node_id)
+            self.nodes[node.parent_id].children.remove(node_id)
+            for child_id in subtree:
+                del self.nodes[child_id]
+            if self.current_id in subtree:
+                return self.checkout(node.parent_id, previous)
+            return None
+
+    def get_subtree(self, node_id: int) -> List[int]:
+        subtree, stack = [], [node_id]
+        while stack:
+            node = self.nodes[stack.pop()]
+            subtree.append(node.node_id)
+            stack.extend(node.children)
+        return subtree
+
+    def get_path(self, node_id: Optional[int] = None) -> List[int]:
+        path = []
+        node_id = self.current_id if node_id is None else node_id
+        while node_id is not None:
+            path.append(node_id)
+            node_id = self.nodes[node_id].parent_id
+        return path[::-1]
+
+    def iter_nodes(self):
+        with self.lock:
+            stack = [(0, 0)]
+            while stack:
+                node_id, depth = stack.pop()
+                node = self.nodes[node_id]
+                yield node, depth
+                stack.extend((child_id, depth + 1) for child_id in reversed(node.children))
+
+    def list_choices(self):
+        choices = []
+        for node, depth in self.iter_nodes():
+            label = node.label.replace("\n", " ")
+            if len(label) > LABEL_MAX_LENGTH:
+                label = label[:LABEL_MAX_LENGTH] + "..."
+            marker = " (current)" if node.node_id == self.current_id else ""
+            title = f"{'—' * depth} #{node.node_id}{marker}, {len(node.state.paragraphs)} paragraphs: {label}"
+            choices.append((title.strip(), node.node_id))
+        return choices
+
+    def to_dict(self):
+        with self.lock:
+            nodes = []
+            for node, _ in self.iter_nodes():
+                shared = node.shared_paragraphs
+                record = node.state.to_dict(paragraphs_start=shared)
+                nodes.append({
+                    "node_id": node.node_id,
+                    "parent_id": node.parent_id,
+                    "label": node.label,
+                    "shared_paragraphs": shared,
+                    "state": record,
+                })
+            return {"current_id": self.current_id, "next_id": self.next_id, "nodes": nodes}
+
+    @classmethod
+    def from_dict(cls, d):
+        tree = cls.__new__(cls)
+        tree.nodes = dict()
+        tree.lock = threading.RLock()
+        for record in d["nodes"]:
+            state_record = dict(record["state"])
+            paragraphs = state_record.pop("paragraphs")
+            state = State.from_dict(state_record)
+            if record["parent_id"] is not None:
+                parent_state = tree.nodes[record["parent_id"]].state
+                state.paragraphs = parent_state.paragraphs.fork(record["shared_paragraphs"])
+            state.paragraphs.extend(paragraphs)
+            tree.next_id = record["node_id"]
+            tree._add(state, record["parent_id"], record["label"], record["shared_paragraphs"])
+        tree.next_id = d["next_id"]
+        tree.current_id = d["current_id"]
+        return tree
@@ -2,39 +2,51 @@ import os
 import copy
 import fire
 import json
-from typing import List, Any
-
-from nltk.tokenize import sent_tokenize
-
-from tale_studio.utils import novel_json_completion, encode_prompt, tokenize
+import logging
+from typing import Callable, List, Any, Dict, Optional
+
+from tale_studio.utils import (
+    novel_json_completion,
+    encode_prompt,
+    tokenize,
+    parse_json_output,
+    get_token_counter,
+    estimate_tokens,
+    DEFAULT_SYSTEM_PROMPT,
+)
 from tale_studio.model_settings import ModelSettings, GenerationParams
 from tale_studio.state import State
 
 
-def extract_meta(paragraphs, model_settings):
+def encode_meta_prompt(paragraphs):
     text = "\n\n".join(paragraphs)
-    prompt = encode_prompt(os.path.join("existing_book", "extract_meta"), text=text)
+    return encode_prompt(os.path.join("existing_book", "extract_meta"), text=text)
+
+
+def extract_meta(paragraphs, model_settings):
+    prompt = encode_meta_prompt(paragraphs)
     print("META PROMPT")
     print(prompt)
     print("========")
-    output = novel_json_completion(prompt, model_settings=model_settings)
+    output = novel_json_completion(
+        prompt, model_settings=model_settings, profile=os.path.join("existing_book", "extract_meta")
+    )
     print("META OUTPUT")
     print(output)
     print("========")
     return (output["name"], output["language"])
 
 
-def summarize(
+def encode_summary_prompt(
     paragraphs: List[str],
     language: str,
     prev_summary: str = "",
     prev_chapter_header: str = "",
-    model_settings: ModelSettings = ModelSettings(),
     prompt: str = "l1_summarize",
     num_sentences: int = 10,
 ):
     text = "\n\n".join(paragraphs)
-    prompt = encode_prompt(
+    return encode_prompt(
         os.path.join("existing_book", prompt),
         prev_summary=prev_summary,
         prev_chapter_header=prev_chapter_header,
@@ -42,10 +54,30 @@ def summarize(
         language=language,
         num_sentences=num_sentences,
     )
+
+
+def summarize(
+    paragraphs: List[str],
+    language: str,
+    prev_summary: str = "",
+    prev_chapter_header: str = "",
+    model_settings: ModelSettings = ModelSettings(),
+    prompt: str = "l1_summarize",
+    num_sentences: int = 10,
+):
+    profile = os.path.join("existing_book", prompt)
+    prompt = encode_summary_prompt(
+        paragraphs=paragraphs,
+        language=language,
+        prev_summary=prev_summary,
+        prev_chapter_header=prev_chapter_header,
+        prompt=prompt,
+        num_sentences=num_sentences,
+    )
     print("PROMPT")
     print(prompt)
     print("========")
-    output = novel_json_completion(prompt, model_settings=model_settings)
+    output = novel_json_completion(prompt, model_settings=model_settings, profile=profile)
     print("OUTPUT")
     print(output)
     print("========")
@@ -56,6 +88,8 @@ def summarize(
 
 
 def split_paragrahps(paragraphs, max_paragraph_length, language):
+    from nltk.tokenize import sent_tokenize
+
     new_paragraphs = []
     for p in paragraphs:
         if len(p) < max_paragraph_length:
@@ -107,6 +141,7 @@ def gen_windows(
     model_settings: ModelSettings,
     start_index: int = -1,
     input_tokens_limit: int = 2000,
+    count_tokens: Optional[Callable[[str], int]] = None,
 ):
     window = []
     window_tokens_count = 0
@@ -114,7 +149,10 @@ def gen_windows(
         if pnum <= start_index:
             continue
 
-        paragraph_tokens_count = len(tokenize(p, model_settings=model_settings))
+        if count_tokens is not None:
+            paragraph_tokens_count = count_tokens(p)
+        else:
+            paragraph_tokens_count = len(tokenize(p, model_settings=model_settings))
         if window_tokens_count + paragraph_tokens_count < input_tokens_limit:
             window_tokens_count += paragraph_tokens_count
             window.append((pnum, p))
@@ -204,6 +242,181 @@ def postprocess_l1(summaries):
     return summaries
 
 
+def build_l2_paragraphs(l1_summaries):
+    l2_paragraphs = [[]]
+    for point in l1_summaries:
+        if "summary_point" in point:
+            l2_paragraphs[-1].append(point["summary_point"])
+            continue
+        if "chapter_header" in point:
+            l2_paragraphs.append([])
+    return [
+        "\n".join(p).strip() for p in l2_paragraphs if "\n".join(p).strip()
+    ]
+
+
+def parse_batch_summary(
+    results: Dict[str, str],
+    custom_id: str,
+    model_settings: ModelSettings,
+    **summarize_kwargs,
+):
+    try:
+        output = parse_json_output(results[custom_id])
+        for key in ("summary", "synopsis"):
+            if key in output:
+                return output[key]
+        raise KeyError(custom_id)
+    except Exception:
+        logging.warning(f"No usable batch output for {custom_id}, requesting it directly")
+    return summarize(model_settings=model_settings, **summarize_kwargs)
+
+
+def parse_batch_meta(results: Dict[str, str], meta_window: List[str], model_settings: ModelSettings):
+    try:
+        output = parse_json_output(results["meta"])
+        return output["name"], output["language"]
+    except Exception:
+        logging.warning("No usable batch output for meta, requesting it directly")
+        return extract_meta(meta_window, model_settings)
+
+
+def _batch_l1_stage(
+    state: State,
+    run: Callable,
+    output_file: str,
+    language: str,
+    model_settings: ModelSettings,
+    count_tokens: Callable[[str], int],
+    input_tokens_limit: int,
+):
+    language = state.language or language
+    start_index = -1
+    if state.l1_summaries and "paragraph_number" in state.l1_summaries[0]:
+        start_index = max([s["paragraph_number"] for s in state.l1_summaries])
+    windows = list(gen_windows(
+        state.paragraphs,
+        start_index=start_index,
+        input_tokens_limit=input_tokens_limit,
+        model_settings=model_settings,
+        count_tokens=count_tokens,
+    ))
+    meta_window = None
+    if not state.name:
+        first_window = next(gen_windows(
+            state.paragraphs,
+            input_tokens_limit=input_tokens_limit,
+            model_settings=model_settings,
+            count_tokens=count_tokens,
+        ))
+        meta_window = [p for _, p in first_window]
+
+    prompts, profiles = dict(), dict()
+    if meta_window:
+        prompts["meta"] = encode_meta_prompt(meta_window)
+        profiles["meta"] = os.path.join("existing_book", "extract_meta")
+    # Windows are summarized independently, without the previous summary
+    l1_kwargs = dict()
+    for window in windows:
+        texts = [p for _, p in window]
+        pnum = max(n for n, _ in window)
+        if not "\n".join(texts).strip():
+            continue
+        kwargs = dict(paragraphs=texts, language=language, prompt="l1_summarize", num_sentences=10)
+        l1_kwargs[f"l1-{pnum}"] = (pnum, kwargs)
+        prompts[f"l1-{pnum}"] = encode_summary_prompt(**kwargs)
+        profiles[f"l1-{pnum}"] = os.path.join("existing_book", "l1_summarize")
+    results = run("l1", prompts, profiles)
+
+    if meta_window:
+        state.name, state.language = parse_batch_meta(results, meta_window, model_settings)
+    for custom_id, (pnum, kwargs) in l1_kwargs.items():
+        summary = parse_batch_summary(results, custom_id, model_settings, **kwargs)
+        for s in summary:
+            s["paragraph_number"] = pnum
+            state.l1_summaries.append(s)
+    state.save(output_file)
+
+    state.l1_summaries = postprocess_l1(state.l1_summaries)
+    state.save(output_file)
+
+
+def _batch_l2_stage(state: State, run: Callable, output_file: str, model_settings: ModelSettings):
+    l2_paragraphs = build_l2_paragraphs(state.l1_summaries)
+    prompts, profiles = dict(), dict()
+    l2_kwargs = dict()
+    for pnum, paragraph in enumerate(l2_paragraphs):
+        if pnum < len(state.l2_summaries):
+            continue
+        kwargs = dict(paragraphs=[paragraph], language=state.language, prompt="l2_summarize", num_sentences=3)
+        l2_kwargs[f"l2-{pnum}"] = kwargs
+        prompts[f"l2-{pnum}"] = encode_summary_prompt(**kwargs)
+        profiles[f"l2-{pnum}"] = os.path.join("existing_book", "l2_summarize")
+    results = run("l2", prompts, profiles)
+    for custom_id, kwargs in l2_kwargs.items():
+        state.l2_summaries.append(parse_batch_summary(results, custom_id, model_settings, **kwargs))
+    state.outline = "\n\n".join(state.l2_summaries)
+    state.save(output_file)
+
+
+def _batch_final_stage(state: State, run: Callable, output_file: str, model_settings: ModelSettings):
+    prompts, profiles = dict(), dict()
+    final_kwargs = dict()
+    for field in ("synopsis", "short_memory"):
+        if getattr(state, field):
+            continue
+        kwargs = dict(paragraphs=state.l2_summaries, language=state.language, prompt=field, num_sentences=10)
+        final_kwargs[field] = kwargs
+        prompts[field] = encode_summary_prompt(**kwargs)
+        profiles[field] = os.path.join("existing_book", field)
+    results = run("final", prompts, profiles)
+    for field, kwargs in final_kwargs.items():
+        setattr(state, field, parse_batch_summary(results, field, model_settings, **kwargs))
+    state.save(output_file)
+
+
+def summarize_book_batch(
+    state: State,
+    output_file: str,
+    language: str,
+    model_settings: ModelSettings,
+    input_tokens_limit: int = 2000,
+    provider: str = "",
+    base_url: Optional[str] = None,
+    poll_interval: float = 30,
+):
+    from tale_studio.batch_api import BatchJobs, get_batch_client, get_batch_provider
+
+    provider = provider or get_batch_provider(model_settings.model_name)
+    client = get_batch_client(provider, model_settings, base_url=base_url)
+    count_tokens = get_token_counter(model_settings, backend=provider)
+    try:
+        count_tokens("")
+    except Exception:
+        logging.warning(f"No {provider} tokenizer available offline, estimating tokens from characters")
+        count_tokens = estimate_tokens
+    jobs = BatchJobs(output_file + ".batch.json")
+    system_prompt = DEFAULT_SYSTEM_PROMPT
+
+    def run(stage, prompts, profiles):
+        if not prompts:
+            return dict()
+        return jobs.run(
+            stage,
+            prompts,
+            profiles=profiles,
+            client=client,
+            model_settings=model_settings,
+            system_prompt=system_prompt,
+            poll_interval=poll_interval,
+        )
+
+    _batch_l1_stage(state, run, output_file, language, model_settings, count_tokens, input_tokens_limit)
+    _batch_l2_stage(state, run, output_file, model_settings)
+    _batch_final_stage(state, run, output_file, model_settings)
+    jobs.clear()
+
+
 def summarize_book(
     input_file: str,
     output_file: str,
@@ -212,6 +425,10 @@ def summarize_book(
     min_paragraph_length: int = 400,
     max_paragraph_length: int = 1000,
     input_tokens_limit: int = 2000,
+    batch: bool = False,
+    batch_provider: str = "",
+    batch_base_url: Optional[str] = None,
+    batch_poll_interval: float = 30,
 ):
     assert input_file.endswith(".txt")
 
@@ -238,6 +455,19 @@ def summarize_book(
         generation_params=GenerationParams(temperature=0.3, repetition_penalty=1.25),
     )
 
+    if batch:
+        summarize_book_batch(
+            state,
+            output_file=output_file,
+            language=language,
+            model_settings=model_settings,
+            input_tokens_limit=input_tokens_limit,
+            provider=batch_provider,
+            base_url=batch_base_url,
+            poll_interval=batch_poll_interval,
+        )
+        return
+
     if not state.name:
         for window in gen_windows(
             state.paragraphs,
@@ -267,16 +497,7 @@ def summarize_book(
     state.l1_summaries = postprocess_l1(state.l1_summaries)
     state.save(output_file)
 
-    l2_paragraphs = [[]]
-    for point in state.l1_summaries:
-        if "summary_point" in point:
-            l2_paragraphs[-1].append(point["summary_point"])
-            continue
-        if "chapter_header" in point:
-            l2_paragraphs.append([])
-    l2_paragraphs = [
-        "\n".join(p).strip() for p in l2_paragraphs if "\n".join(p).strip()
-    ]
+    l2_paragraphs = build_l2_paragraphs(state.l1_summaries)
 
     cached_l2_summaries_count = len(state.l2_summaries)
     for pnum, paragraph in enumerate(l2_paragraphs):
@@ -0,0 +1,72 @@
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict
+
+
+@dataclass
+class UsageStats:
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    cache_write_tokens: int = 0
+    completion_tokens: int = 0
+    total_latency: float = 0.0
+
+    @property
+    def cached_share(self) -> float:
+        if not self.prompt_tokens:
+            return 0.0
+        return self.cached_tokens / self.prompt_tokens
+
+    @property
+    def mean_latency(self) -> float:
+        if not self.requests:
+            return 0.0
+        return self.total_latency / self.requests
+
+
+class UsageTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats: Dict[str, UsageStats] = defaultdict(UsageStats)
+
+    def record(
+        self,
+        backend: str,
+        prompt_tokens: int = 0,
+        cached_tokens: int = 0,
+        cache_write_tokens: int = 0,
+        completion_tokens: int = 0,
+    ):
+        with self.lock:
+            stats = self.stats[backend]
+            stats.prompt_tokens += prompt_tokens
+            stats.cached_tokens += cached_tokens
+            stats.cache_write_tokens += cache_write_tokens
+            stats.completion_tokens += completion_tokens
+
+    def record_latency(self, backend: str, latency: float):
+        with self.lock:
+            stats = self.stats[backend]
+            stats.requests += 1
+            stats.total_latency += latency
+
+    def format_stats(self) -> str:
+        with self.lock:
+            lines = [
+                "| Backend | Requests | Prompt tokens | Cached tokens | Cache writes "
+                "| Completion tokens | Cached share | Mean latency, s |",
+                "|---|---|---|---|---|---|---|---|",
+            ]
+            for backend, stats in sorted(self.stats.items()):
+                lines.append(
+                    f"| {backend} | {stats.requests} | {stats.prompt_tokens} "
+                    f"| {stats.cached_tokens} | {stats.cache_write_tokens} "
+                    f"| {stats.completion_tokens} | {stats.cached_share:.0%} "
+                    f"| {stats.mean_latency:.2f} |"
+                )
+        return "\n".join(lines)
+
+
+USAGE = UsageTracker()
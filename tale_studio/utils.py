@@ -1,7 +1,8 @@
 import json
+import time
 import traceback
+from typing import Callable, Optional
 
-import torch
 from jinja2 import Template
 
 from tale_studio.model_settings import ModelSettings
@@ -19,56 +20,149 @@ from tale_studio.anthropic_wrapper import (
     anthropic_list_models,
     anthropic_get_key,
 )
-from tale_studio.gguf_wrapper import gguf_completion, gguf_tokenize
+from tale_studio.gguf_wrapper import gguf_completion, gguf_tokenize, get_gguf_backend_key
 from tale_studio.tgi_wrapper import tgi_completion
-
+from tale_studio.local_server_wrapper import (
+    local_completion,
+    get_local_backend_key,
+    LocalServerPools,
+    LOCAL_MODEL_PREFIX,
+)
+from tale_studio.scheduler import SCHEDULER, RequestRejected, hash_key
+from tale_studio.usage import USAGE
+from tale_studio.generation_profiles import apply_profile, truncate_at_stop, DEFAULT_PROFILE
+from tale_studio.hedging import HEDGING
 
 DEFAULT_SYSTEM_PROMPT = "You are a helpful and creative assistant for writing novels."
 
 
-def tokenize(text: str, model_settings: ModelSettings):
+def get_backend(model_settings: ModelSettings) -> str:
+    if model_settings.model_name == "tgi":
+        return "tgi"
+    if model_settings.model_name.startswith(LOCAL_MODEL_PREFIX):
+        return "local"
     openai_api_key = openai_get_key(model_settings)
-    anthropic_api_key = anthropic_get_key(model_settings)
-    if model_settings.model_name in openai_list_models(openai_api_key):
-        return openai_tokenize(model_name=model_settings.model_name, text=text)
+    if model_settings.model_name in openai_list_models(api_key=openai_api_key):
+        return "openai"
     if model_settings.model_name in anthropic_list_models():
+        return "anthropic"
+    return "gguf"
+
+
+def get_backend_key(backend: str, model_settings: ModelSettings) -> str:
+    if backend == "openai":
+        return f"openai:{hash_key(openai_get_key(model_settings))}"
+    if backend == "anthropic":
+        return f"anthropic:{hash_key(anthropic_get_key(model_settings))}"
+    if backend == "gguf":
+        return get_gguf_backend_key(model_settings.model_name, model_settings.n_parallel)
+    if backend == "local":
+        LocalServerPools.get_pool(model_settings)
+        return get_local_backend_key(model_settings)
+    return backend
+
+
+def tokenize(text: str, model_settings: ModelSettings):
+    backend = get_backend(model_settings)
+    if backend == "openai":
+        return openai_tokenize(model_name=model_settings.model_name, text=text)
+    if backend == "anthropic":
+        anthropic_api_key = anthropic_get_key(model_settings)
         return anthropic_tokenize(text=text, api_key=anthropic_api_key)
     return gguf_tokenize(model_settings=model_settings, text=text)
 
 
+def estimate_tokens(text: str) -> int:
+    return len(text) // 3 + 1
+
+
+def get_token_counter(model_settings: ModelSettings, backend: Optional[str] = None) -> Callable[[str], int]:
+    backend = backend or get_backend(model_settings)
+    if backend in ("tgi", "local", "anthropic"):
+        return estimate_tokens
+    if backend == "openai":
+        return lambda text: len(
+            openai_tokenize(model_name=model_settings.model_name, text=text)
+        )
+    return lambda text: len(gguf_tokenize(model_settings=model_settings, text=text))
+
+
+def build_messages(
+    prompt: str,
+    system_prompt: str,
+    prefix: str = "",
+    backend: str = "openai",
+):
+    content = prompt
+    if prefix and backend == "anthropic":
+        content = [
+            {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": prompt},
+        ]
+    elif prefix:
+        content = prefix + "\n\n" + prompt
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": content},
+    ]
+
+
 def novel_completion(
     prompt: str,
     model_settings: ModelSettings,
     system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+    prefix: str = "",
+    profile: str = DEFAULT_PROFILE,
 ):
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {
-            "role": "user",
-            "content": prompt,
-        },
-    ]
-    openai_key = openai_get_key(model_settings)
-    if model_settings.model_name == "tgi":
-        output = tgi_completion(messages, model_settings)
-    elif model_settings.model_name in openai_list_models(api_key=openai_key):
-        output = openai_completion(
-            messages,
-            decoding_args=OpenAIDecodingArguments(
-                temperature=model_settings.generation_params.temperature,
-                top_p=model_settings.generation_params.top_p,
-            ),
-            model_name=model_settings.model_name,
-            api_key=model_settings.openai_api_key,
-        )
-    elif model_settings.model_name in anthropic_list_models():
-        output = anthropic_completion(
-            messages,
-            model_name=model_settings.model_name,
-            api_key=model_settings.anthropic_api_key,
-        )
-    else:
-        output = gguf_completion(messages, model_settings)
+    return HEDGING.run(
+        lambda settings: _novel_completion(prompt, settings, system_prompt, prefix, profile),
+        model_settings=model_settings,
+        profile=profile,
+    )
+
+
+def _novel_completion(
+    prompt: str,
+    model_settings: ModelSettings,
+    system_prompt: str,
+    prefix: str,
+    profile: str,
+):
+    backend = get_backend(model_settings)
+    messages = build_messages(prompt, system_prompt, prefix=prefix, backend=backend)
+    model_settings = apply_profile(model_settings, profile)
+    params = model_settings.generation_params
+    with SCHEDULER.slot(get_backend_key(backend, model_settings)):
+        start_time = time.perf_counter()
+        if backend == "tgi":
+            output = tgi_completion(messages, model_settings)
+        elif backend == "local":
+            output = local_completion(messages, model_settings)
+        elif backend == "openai":
+            output = openai_completion(
+                messages,
+                decoding_args=OpenAIDecodingArguments(
+                    max_tokens=params.max_new_tokens,
+                    temperature=params.temperature,
+                    top_p=params.top_p,
+                    stop=list(params.stop) or None,
+                ),
+                model_name=model_settings.model_name,
+                api_key=model_settings.openai_api_key,
+            )
+        elif backend == "anthropic":
+            output = anthropic_completion(
+                messages,
+                model_name=model_settings.model_name,
+                api_key=model_settings.anthropic_api_key,
+                max_tokens=params.max_new_tokens,
+                temperature=min(params.temperature, 1.0),
+                stop_sequences=list(params.stop),
+            )
+        else:
+            output = gguf_completion(messages, model_settings)
+        USAGE.record_latency(backend, time.perf_counter() - start_time)
+    output = truncate_at_stop(output, params.stop)
     output = output.replace("<|im_end|>", "")
     output = output.replace("</s>", "")
     return output
@@ -87,6 +181,8 @@ def novel_json_completion(
     prompt: str,
     model_settings: ModelSettings,
     system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+    prefix: str = "",
+    profile: str = DEFAULT_PROFILE,
 ):
     response = None
     while True:
@@ -95,9 +191,13 @@ def novel_json_completion(
                 prompt=prompt,
                 model_settings=model_settings,
                 system_prompt=system_prompt,
+                prefix=prefix,
+                profile=profile,
             )
             output = parse_json_output(response)
             break
+        except RequestRejected:
+            raise
         except Exception:
             if response:
                 print(f"Response: {response}")
@@ -107,24 +207,6 @@ def novel_json_completion(
     return output
 
 
-def cos_sim(a: torch.Tensor, b: torch.Tensor) -> torch.Tensor:
-    if not isinstance(a, torch.Tensor):
-        a = torch.tensor(a)
-
-    if not isinstance(b, torch.Tensor):
-        b = torch.tensor(b)
-
-    if len(a.shape) == 1:
-        a = a.unsqueeze(0)
-
-    if len(b.shape) == 1:
-        b = b.unsqueeze(0)
-
-    a_norm = torch.nn.functional.normalize(a, p=2, dim=1)
-    b_norm = torch.nn.functional.normalize(b, p=2, dim=1)
-    return torch.mm(a_norm, b_norm.transpose(0, 1))
-
-
 def encode_prompt(template_name, **kwargs):
     template_path = PROMPTS_DIR_PATH / f"{template_name}.jinja"
     with open(template_path) as f: